@@ -0,0 +1,304 @@
+"""
+One pass analysis of a gps track.
+
+TrackAnalyzer takes the fixes one at a time (straight from iter_fixes or a
+cached Track) and does everything makeKMLFile needs in that single pass:
+the jump filter, the start/end of motion trim, left turns, stops and the
+simplified route line. Results come out as events that the kml writer
+consumes as they arrive:
+
+    ("start", fix)                      the trip start (fix right before the car first moved)
+    ("route", [(lon, lat), ...])        the next points of the simplified route line
+    ("left", lat, lon)                  a left turn
+    ("stop", lat, lon, seconds)         a stop
+    ("end", fix)                        the trip end (fix right after the car last moved)
+
+This is the one place the detection rules live, makeKMLFile and the live
+mode (live.py, server.py) run their fixes through it and the threshold
+sweep (sweep.py) applies the same rules to whole arrays. Only a
+small window is kept: the last fix and segment, one simplify window of
+route points and the second half of the current stop. The exception is
+anything after the car last moved: until it moves again it isn't known if
+that is still part of the trip, so turns, stops and route points from there
+are held back and dropped if the car never moves again. While the car
+stands still that stays small too: a stretch of fixes that aren't moving
+only keeps its first and latest route point, and a long stop keeps every
+2nd/4th/... fix of its second half (MAX_SLOW_POINTS).
+"""
+
+from bisect import bisect_right
+from collections import deque
+
+from geometry import degree_turn, haversine_m, signed_bearing_delta, simplify
+
+# a stop longer than twice this many fixes gets its marker from a sample of
+# its fixes, within a few fixes of the middle one (it's parked there anyway)
+MAX_SLOW_POINTS = 4096
+
+
+class TrackAnalyzer:
+    """
+    Usage:
+        analyzer = TrackAnalyzer(tolerance=2.0)
+        for event in analyzer.run(fixes):
+            ...
+        analyzer.points          # fixes in the trimmed trip
+        analyzer.distance        # meters driven in it
+        analyzer.jumps           # fixes the jump filter dropped (+ analyzer.duplicates)
+    """
+
+    def __init__(self, max_speed=97, stop_speed=1.0, min_stop=1.0, moving=2,
+                 threshold_deg=10.0, turn_step=8.0, tolerance=2.0, window=2000,
+                 turn_span=None, turn_angle=40.0):
+        self.max_speed = max_speed
+        self.stop_speed = stop_speed
+        self.min_stop = min_stop
+        self.moving = moving
+        self.threshold_deg = threshold_deg
+        self.turn_step = turn_step
+        self.tolerance = tolerance
+        self.window = window
+        # with smoothed fixes (see smoothing.py) turns are found from the
+        # course turning more than turn_angle within turn_span meters,
+        # instead of from the bearing between each pair of fixes
+        self.turn_span = turn_span
+        self.turn_angle = turn_angle
+        self.headings = deque()     # (meters driven, course, lat, lon) over the last turn_span meters
+        self.driven = 0.0
+        self.turning = False
+
+        self.count = 0              # fixes kept by the jump filter so far
+        self.jumps = 0              # and dropped by it: too fast
+        self.duplicates = 0         # same time as the last kept fix
+        self.last = None            # the last of them
+        self.vertex = None          # (index, lat, lon) of the last point the turn rule took a bearing to
+        self.vertex_bearing = None  # and the bearing it was reached at
+        self.turn_run = []          # (lat, lon) of the points the current left turn swung at
+        self.start = None           # index of the trip start
+        self.start_fix = None
+        self.last_moving = None     # index of the last fix faster than moving
+        self.after_moving = None    # the fix right after that one
+        self.held = deque()         # (index the car has to move past, event)
+        self.slow = None            # (first index, first time, last time) of the slow stretch
+        self.slow_half = deque()    # (index, lat, lon) of its second half, for the middle fix
+        self.slow_step = 1          # every how many fixes of it are in slow_half
+        self.route = []             # (lon, lat) not simplified yet
+        self.route_index = []       # and the index of the fix each one is
+        self.standing = 0           # fixes in a row that weren't moving, up to the last one
+        self.route_points = 0       # route points sent out
+        self.end_fix = None
+        self.points = 0
+        self.odometer = 0.0         # meters driven since the trip start
+        self.distance = 0.0         # same up to the trip end (so far)
+
+    def run(self, fixes):
+        """all the events for a whole track"""
+        for fix in fixes:
+            yield from self.add(fix)
+        yield from self.finish()
+
+    def add(self, fix):
+        """takes the next fix, returns the events it completed"""
+        lat, lon, t = fix["latitude"], fix["longitude"], fix["time"]
+        prev = self.last
+        dist = None
+        if prev is not None:
+            # jump filter: a fix at the same time as the last kept one, or
+            # that would need more than max_speed m/s to get to, is dropped
+            dist = haversine_m(prev["latitude"], prev["longitude"], lat, lon)
+            time_diff = t - prev["time"]
+            if time_diff == 0:
+                self.duplicates += 1
+                return []
+            if dist / time_diff > self.max_speed:
+                self.jumps += 1
+                return []
+
+        i = self.count
+        self.count += 1
+        self.last = fix
+        moving = fix["speed"] > self.moving
+        events = []
+
+        if self.start is None:
+            if not moving:
+                return events
+            # the trip starts at the fix right before the car first moves
+            self.start = i - 1 if prev is not None else i
+            self.start_fix = prev or fix
+            self.vertex = (self.start, self.start_fix["latitude"], self.start_fix["longitude"])
+            if prev is not None:
+                self._add_route(self.start, prev, False)
+                if prev["speed"] < self.stop_speed:
+                    self._slow(self.start, prev)
+            events.append(("start", self.start_fix))
+        elif self.turn_span:
+            self._course_turn(i, fix, dist, moving)
+        else:
+            self._step_turn(i, lat, lon)
+
+        # stops: slower than stop_speed for at least min_stop seconds, the
+        # marker goes on the middle fix. A stop only counts once the car moves again
+        if fix["speed"] < self.stop_speed:
+            self._slow(i, fix)
+        elif self.slow is not None:
+            first, first_t, last_t = self.slow
+            if last_t - first_t >= self.min_stop:
+                _, mid_lat, mid_lon = self.slow_half[0]
+                self.held.append((i - 1, ("stop", mid_lat, mid_lon, last_t - first_t)))
+            self.slow = None
+            self.slow_half.clear()
+            self.slow_step = 1
+
+        self._add_route(i, fix, moving)
+        if i > self.start:
+            self.odometer += dist
+        if moving:
+            self.last_moving = i
+            self.after_moving = None
+            self.distance = self.odometer
+        elif self.after_moving is None and self.last_moving == i - 1:
+            self.after_moving = fix
+            self.distance = self.odometer
+
+        # everything up to right after the last moving fix is in the trip for sure
+        confirmed = self.last_moving
+        while self.held and self.held[0][0] <= confirmed:
+            events.append(self.held.popleft()[1])
+        self._route_windows(events, confirmed + 1)
+        return events
+
+    def _step_turn(self, i, lat, lon):
+        """
+        left turn: the bearing swung left by more than threshold_deg at a
+        point of the trip. The bearings are taken between points at least
+        turn_step meters apart (the next fix that far from the last one), not
+        between fixes, so the rule finds the same turns at 1 Hz or 10 Hz.
+        The points in a row that swung left are one turn, the marker goes
+        on the middle one
+        """
+        v_index, v_lat, v_lon = self.vertex
+        if haversine_m(v_lat, v_lon, lat, lon) < self.turn_step:
+            return
+        bearing = degree_turn((v_lat, v_lon), (lat, lon))
+        if self.vertex_bearing is not None and signed_bearing_delta(self.vertex_bearing, bearing) < -self.threshold_deg:
+            self.turn_run.append((v_lat, v_lon))
+        elif self.turn_run:
+            # the turn is over, it counts once this fix is in the trip
+            self.held.append((i - 1, self._turn_event()))
+        self.vertex = (i, lat, lon)
+        self.vertex_bearing = bearing
+
+    def _turn_event(self):
+        lat, lon = self.turn_run[len(self.turn_run) // 2]
+        self.turn_run = []
+        return ("left", lat, lon)
+
+    def _course_turn(self, i, fix, dist, moving):
+        """
+        left turn when the course swung left by more than turn_angle over the
+        last turn_span meters. The marker goes at the middle of that stretch,
+        and the next turn can only start once the swing has eased off
+        """
+        headings = self.headings
+        if not moving:
+            # the course means nothing when (almost) standing still
+            headings.clear()
+            self.turning = False
+            return
+        self.driven += dist
+        headings.append((self.driven, fix["course"], fix["latitude"], fix["longitude"]))
+        while len(headings) > 1 and headings[1][0] <= self.driven - self.turn_span:
+            headings.popleft()
+        delta = signed_bearing_delta(headings[0][1], fix["course"])
+        if delta < -self.turn_angle:
+            if not self.turning:
+                _, _, lat, lon = headings[len(headings) // 2]
+                self.held.append((i, ("left", lat, lon)))
+                self.turning = True
+        elif delta > -self.turn_angle / 2:
+            self.turning = False
+
+    def _slow(self, i, fix):
+        """adds a fix to the slow stretch, keeping the half the middle fix can still be in"""
+        if self.slow is None:
+            self.slow = (i, fix["time"], fix["time"])
+        else:
+            self.slow = (self.slow[0], self.slow[1], fix["time"])
+        half = self.slow_half
+        if not half or i - half[-1][0] >= self.slow_step:
+            half.append((i, fix["latitude"], fix["longitude"]))
+        # the middle of first..i is first + (length)//2
+        middle = self.slow[0] + (i - self.slow[0] + 1) // 2
+        while len(half) > 1 and half[1][0] <= middle:
+            half.popleft()
+        if len(half) > MAX_SLOW_POINTS:
+            # a long stop: from here on only every 2nd fix of what was kept
+            self.slow_half = deque(list(half)[::2])
+            self.slow_step *= 2
+
+    def _add_route(self, i, fix, moving):
+        """
+        the fix's route point. Of fixes in a row that aren't moving only the
+        first and the latest are kept, parked jitter isn't route
+        """
+        point = (fix["longitude"], fix["latitude"])
+        self.standing = 0 if moving else self.standing + 1
+        if self.standing > 2:
+            self.route[-1] = point
+            self.route_index[-1] = i
+        else:
+            self.route.append(point)
+            self.route_index.append(i)
+
+    def _route_windows(self, events, end):
+        """simplifies and sends out every full window of route points up to index end"""
+        window = self.window
+        end = min(end, self.count - 1)
+        while len(self.route) > window and self.route_index[window] <= end:
+            self._send_route(events, self.route[:window + 1], last=False)
+            del self.route[:window]
+            del self.route_index[:window]
+
+    def _send_route(self, events, coords, last):
+        """
+        one window of simplify: sends the points to keep. The window's last
+        point is the first of the next window, so it is only sent with the last one
+        """
+        if self.tolerance > 0:
+            lons = [c[0] for c in coords]
+            lats = [c[1] for c in coords]
+            coords = [coords[j] for j in simplify(lats, lons, self.tolerance, self.window)]
+        if not last:
+            coords = coords[:-1]
+        if coords:
+            self.route_points += len(coords)
+            events.append(("route", coords))
+
+    def finish(self):
+        """end of the track: the rest of the route and the trip end"""
+        if self.count == 0:
+            raise ValueError("no valid GPRMC fixes found")
+        if self.start is None:
+            raise ValueError("the car never moved")
+
+        # the trip ends right after the car last moved, anything held back
+        # past that is dropped
+        end = min(self.last_moving + 1, self.count - 1)
+        # (no fix after it when the log ends while moving)
+        self.end_fix = self.after_moving or self.last
+        keep = bisect_right(self.route_index, end)
+        del self.route[keep:]
+        del self.route_index[keep:]
+
+        events = []
+        # a turn still going at the end of the log, if it was in the trip
+        if self.turn_run and self.vertex[0] <= end:
+            events.append(self._turn_event())
+        self._route_windows(events, end)
+        self._send_route(events, self.route, last=True)
+        self.route = []
+        self.route_index = []
+        self.points = end - self.start + 1
+        events.append(("end", self.end_fix))
+        return events
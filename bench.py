@@ -0,0 +1,287 @@
+"""
+Benchmarks for the gps -> kml pipeline.
+
+Times every stage of the pipeline on its own (parse, the one pass
+TrackAnalyzer that does the jump filter, trim, turns, stops and route
+simplification (analyze), marker clustering, kml write), plus the whole
+thing end to end, and measures the peak memory of each stage with
+tracemalloc. Results are saved as JSON so two versions can be compared with
+--compare.
+
+Runs on the sample logs by default, or on a synthetic log of any length:
+    python bench.py                                   # Some_Example_GPS_Files/*.txt
+    python bench.py --synthetic 24 --hz 10            # 24 hour drive at 10 Hz
+    python bench.py --compare old_results.json        # show the change per stage
+    python bench.py --generate drive.txt --synthetic 2   # only write the log
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+from pathlib import Path
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not on windows
+    resource = None
+
+from analyzer import TrackAnalyzer
+import main
+from kmlwriter import KMLWriter
+from spatial import cluster_points
+
+KNOTS_TO_MS = 1852 / 3600
+# where the synthetic drive starts (RIT)
+START = main.RIT
+
+
+#### SYNTHETIC LOGS ####
+
+def nmea_lat(lat):
+    deg = int(abs(lat))
+    return f"{deg:02d}{(abs(lat) - deg) * 60:07.4f}", "N" if lat >= 0 else "S"
+
+def nmea_lon(lon):
+    deg = int(abs(lon))
+    return f"{deg:03d}{(abs(lon) - deg) * 60:07.4f}", "E" if lon >= 0 else "W"
+
+def sentence(body):
+    """adds the $ and the *hh checksum"""
+    return f"${body}*{main.nmea_checksum(body):02X}\n"
+
+def synthetic_fixes(hours, hz, seed=0):
+    """
+    Yields (unix time, lat, lon, speed knots, course) for a made up drive:
+    straight stretches at 20-40 knots, then an intersection where the car
+    either stops for 5-60 s or not, and turns left, right or goes straight.
+    """
+    rng = random.Random(seed)
+    dt = 1.0 / hz
+    t = datetime.datetime(2025, 5, 1, 12, tzinfo=datetime.timezone.utc).timestamp()
+    end = t + hours * 3600
+    lat, lon = START
+    heading = rng.uniform(0, 360)
+    speed = 0.0
+
+    while t < end:
+        # drive a block
+        cruise = rng.uniform(20, 40)
+        block = rng.uniform(150, 800)   # meters
+        driven = 0.0
+        while driven < block and t < end:
+            # speed up / slow down at about 2 knots a second
+            if driven > block - 60:
+                target = 5.0
+            else:
+                target = cruise
+            speed += max(-2 * dt, min(2 * dt, target - speed))
+            step = speed * KNOTS_TO_MS * dt
+            driven += step
+            lat += step * math.cos(math.radians(heading)) / 111320
+            lon += step * math.sin(math.radians(heading)) / (111320 * math.cos(math.radians(lat)))
+            t += dt
+            yield t, lat, lon, speed, heading
+
+        # the intersection
+        if rng.random() < 0.4:
+            while speed > 0 and t < end:
+                speed = max(0.0, speed - 4 * dt)
+                t += dt
+                yield t, lat, lon, speed, heading
+            wait = rng.uniform(5, 60)
+            for _ in range(int(wait * hz)):
+                t += dt
+                yield t, lat + rng.gauss(0, 2e-6), lon + rng.gauss(0, 2e-6), rng.uniform(0, 0.3), heading
+        turn = rng.choice((-90, 90, 0, 0))
+        # turn over ~3 seconds
+        steps = int(3 * hz)
+        for _ in range(steps):
+            heading = (heading + turn / steps) % 360
+            step = max(speed, 5.0) * KNOTS_TO_MS * dt
+            lat += step * math.cos(math.radians(heading)) / 111320
+            lon += step * math.sin(math.radians(heading)) / (111320 * math.cos(math.radians(lat)))
+            t += dt
+            yield t, lat, lon, max(speed, 5.0), heading
+
+def generate_log(path, hours=1.0, hz=10, seed=0):
+    """
+    Writes a synthetic NMEA log (same header and RMC/GGA layout as the real
+    logs) and returns the number of fixes. A few burped and corrupt lines are
+    mixed in like on the real receiver
+    """
+    rng = random.Random(seed + 1)
+    count = 0
+    with open(path, "w", encoding="latin1") as f:
+        f.write("Vers 72\nUSE_SERIAL_FEEDBACK=true\nDEVELOPMENT_MODE=false\nUSE_RMC_ONLY=false\n\n")
+        for t, lat, lon, speed, course in synthetic_fixes(hours, hz, seed):
+            stamp = datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+            hms = f"{stamp:%H%M%S}.{stamp.microsecond // 1000:03d}"
+            lat_s, ns = nmea_lat(lat)
+            lon_s, ew = nmea_lon(lon)
+            rmc = sentence(f"GPRMC,{hms},A,{lat_s},{ns},{lon_s},{ew},{speed:.2f},{course:.2f},{stamp:%d%m%y},,,A")
+            gga = sentence(f"GPGGA,{hms},{lat_s},{ns},{lon_s},{ew},1,09,1.05,150.0,M,-34.4,M,,")
+            roll = rng.random()
+            if roll < 0.001:
+                # burped: the RMC cut off by the GGA
+                f.write(rmc[:rng.randint(20, len(rmc) - 5)] + gga)
+            elif roll < 0.0015:
+                # garbled character
+                i = rng.randint(1, len(rmc) - 5)
+                f.write(rmc[:i] + "\xfc" + rmc[i+1:] + gga)
+            else:
+                f.write(rmc + gga)
+            count += 1
+    return count
+
+
+#### MEASURING ####
+
+def measure(fn, memory=True):
+    """
+    runs fn once for the time and (if memory) once more under tracemalloc
+    for the peak. returns (seconds, peak bytes or None, result)
+    """
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak, result
+
+def bench_log(path, memory=True):
+    """times every stage on one log, returns the record that goes in the json"""
+    out = Path(tempfile.gettempdir()) / "bench_route.kml"
+    stages = {}
+
+    def run(name, fn, items):
+        seconds, peak, result = measure(fn, memory)
+        stages[name] = {
+            "seconds": round(seconds, 6),
+            "peak_bytes": peak,
+            "items": items,
+            "items_per_sec": round(items / seconds) if seconds else None,
+        }
+        return result
+
+    with main.open_log(path) as f:
+        lines = sum(1 for _ in f)
+    track = run("parse", lambda: main.load_track(main.readFile(path)), lines)
+    events = run("analyze", lambda: list(TrackAnalyzer(tolerance=main.SIMPLIFY_TOLERANCE).run(track)), len(track))
+    route = [point for event in events if event[0] == "route" for point in event[1]]
+    turns = run("turn_clustering", lambda: cluster_points([e[1:] for e in events if e[0] == "left"],
+                                                          main.TURN_SPACING), len(events))
+    stops = run("stop_clustering", lambda: cluster_points([e[1:] for e in events if e[0] == "stop"],
+                                                          main.STOP_RADIUS), len(events))
+
+    def write():
+        with KMLWriter(out) as kml:
+            main.write_route(kml, route)
+            kml.end_line()
+            for turn in turns:
+                kml.point("Left Turn", turn.lon, turn.lat, "left", clamp=True)
+            for stop in stops:
+                kml.point("Stop", stop.lon, stop.lat, "stop")
+    run("kml_write", write, len(route))
+    run("end_to_end", lambda: main.makeKMLFile(main.readFile(path), out, verbose=False), lines)
+    out.unlink(missing_ok=True)
+
+    return {
+        "name": Path(path).name,
+        "bytes": os.path.getsize(path),
+        "lines": lines,
+        "fixes": len(track),
+        "stages": stages,
+    }
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, old_path):
+    """prints the time/memory change of every stage against an older results file"""
+    old = {log["name"]: log for log in json.loads(Path(old_path).read_text())["logs"]}
+    print(f"\nCompared to {old_path}:")
+    for log in results["logs"]:
+        before = old.get(log["name"])
+        if before is None:
+            continue
+        print(log["name"])
+        for stage, now in log["stages"].items():
+            was = before["stages"].get(stage)
+            if not was or not was["seconds"]:
+                continue
+            line = f"  {stage:15s} time x{now['seconds'] / was['seconds']:.2f}"
+            if now["peak_bytes"] and was["peak_bytes"]:
+                line += f"  peak mem x{now['peak_bytes'] / was['peak_bytes']:.2f}"
+            print(line)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the gps -> kml pipeline")
+    parser.add_argument("logs", nargs="*", help="logs to run on (default: the sample logs)")
+    parser.add_argument("--synthetic", type=float, metavar="HOURS",
+                        help="benchmark a generated log of this many hours instead")
+    parser.add_argument("--hz", type=float, default=10, help="fix rate of the generated log (default 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generate", metavar="PATH", help="only write the synthetic log to PATH")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="results of an older run to compare with")
+    args = parser.parse_args()
+
+    if args.generate:
+        count = generate_log(args.generate, args.synthetic or 1.0, args.hz, args.seed)
+        print(f"Wrote {count} fixes to {args.generate}")
+        return
+
+    logs = args.logs
+    temp = None
+    if args.synthetic:
+        temp = Path(tempfile.gettempdir()) / f"synthetic_{args.synthetic}h_{args.hz}hz.txt"
+        generate_log(temp, args.synthetic, args.hz, args.seed)
+        logs = [temp]
+    elif not logs:
+        logs = sorted(Path(__file__).parent.joinpath("Some_Example_GPS_Files").glob("*.txt"))
+
+    results = {
+        "version": git_version(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "logs": [],
+    }
+    for log in logs:
+        record = bench_log(log, memory=not args.no_memory)
+        results["logs"].append(record)
+        total = record["stages"]["end_to_end"]
+        print(f"{record['name']}: {record['fixes']} fixes, end to end {total['seconds']:.3f}s "
+              f"({total['items_per_sec']} lines/s)")
+    if resource is not None:
+        # ru_maxrss is in kilobytes on linux, bytes on mac
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results["max_rss_bytes"] = rss if sys.platform == "darwin" else rss * 1024
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {args.output}")
+    if temp is not None:
+        temp.unlink(missing_ok=True)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
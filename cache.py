@@ -0,0 +1,130 @@
+"""
+On-disk cache of parsed tracks.
+
+Parsing the NMEA text is the slow part of a run, and it gives the same
+Track every time for the same log. The first run saves the parsed,
+checksum/quality filtered track (before the jump filter, so max_speed can
+still be tuned) as raw doubles; later runs mmap that file and use the
+columns in place, skipping readFile/read_gprmc entirely. What the parser
+dropped (the counts, see stats.py) is saved with the track as a bit of
+json, so a run from the cache reports the same numbers.
+
+Entries are keyed by a hash of the log's contents plus a tag for the parser
+version/settings, so an edited log or a parser change never gets a stale
+track. The least recently used entries are deleted once the cache is over
+max_bytes.
+"""
+
+from collections import Counter
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+
+from store import file_hash
+from track import COLUMNS, Track
+
+MAGIC = b"GPSTRK2" + (b"<" if sys.byteorder == "little" else b">")
+# magic, number of columns, number of fixes, bytes of counts json (padded
+# to 8 so the columns after it stay aligned)
+HEADER = struct.Struct("=8sIII")
+
+# default size limit of the cache directory
+MAX_BYTES = 256 * 1024 * 1024
+
+
+class TrackCache:
+    """
+    Usage:
+        cache = TrackCache(".track_cache")
+        track, counts = cache.get(digest, tag)       # (None, None) on a miss
+        cache.put(digest, tag, track, counts)
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.dir = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, digest, tag):
+        return self.dir / f"{digest}-{tag}.trk"
+
+    def get(self, digest, tag):
+        """
+        (the cached track, backed by a read-only mmap of the file, and the
+        parse counts saved with it) or (None, None)
+        """
+        path = self.path(digest, tag)
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):   # missing, or empty (mmap can't map 0 bytes)
+            return None, None
+
+        if len(data) < HEADER.size:
+            return None, None
+        magic, ncols, count, meta = HEADER.unpack_from(data)
+        if magic != MAGIC or ncols != len(COLUMNS) or len(data) != HEADER.size + meta + ncols * count * 8:
+            return None, None
+        try:
+            counts = json.loads(data[HEADER.size:HEADER.size + meta])
+        except ValueError:
+            return None, None
+
+        # mark it as recently used for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        view = memoryview(data)[HEADER.size + meta:].cast('d')
+        return Track({name: view[i*count:(i+1)*count] for i, name in enumerate(COLUMNS)}), counts
+
+    def put(self, digest, tag, track, counts=None):
+        """saves a track and its parse counts, then evicts old entries if the cache got too big"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(digest, tag)
+        # written under a temp name and renamed, so a reader (or another
+        # batch worker) never sees half a file
+        temp = path.with_suffix(f".{os.getpid()}.tmp")
+        meta = json.dumps(dict(counts or {})).encode()
+        meta += b" " * (-len(meta) % 8)
+        with open(temp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(COLUMNS), len(track), len(meta)))
+            f.write(meta)
+            for name in COLUMNS:
+                f.write(track.column(name))
+        os.replace(temp, path)
+        self.evict()
+
+    def evict(self):
+        """deletes the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for path in self.dir.glob("*.trk"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def load(self, log_path, tag, parse, counts=None):
+        """
+        the track of a log: from the cache if it is there, otherwise
+        parse(log_path, counts=...) and save the result for next time. counts
+        (a Counter) gets the parse counts either way
+        """
+        digest = file_hash(log_path)
+        track, saved = self.get(digest, tag)
+        if track is None:
+            saved = Counter()
+            track = parse(log_path, counts=saved)
+            self.put(digest, tag, track, saved)
+        if counts is not None:
+            counts.update(saved)
+        return track
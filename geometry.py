@@ -0,0 +1,330 @@
+"""
+Geometry helpers for gps tracks.
+
+The scalar functions work on one pair of points at a time, TrackAnalyzer
+(analyzer.py) uses them a fix at a time. The track functions work on whole
+columns of lat/lon/time/speed at once: every segment distance and bearing
+is computed exactly once, and the jump, turn and stop rules are read off
+those arrays. sweep.py uses them to try many thresholds on one track.
+
+numpy is used when it is installed (pip install numpy), otherwise the same
+results come from a single pure python pass.
+"""
+
+from bisect import bisect_left
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+# earth's radius in meters
+R = 6371000.0
+
+
+#### SCALAR HELPERS ####
+
+def degree_turn(p1, p2):
+    """
+    Returns turn degrees from point1 to point2
+    0 = north
+    90 = east
+    180 = south
+    270 = west
+    """
+    # convert degrees to radians
+    lat1, lon1 = math.radians(p1[0]), math.radians(p1[1])
+    lat2, lon2 = math.radians(p2[0]), math.radians(p2[1])
+    # get the difference in longitude between the two points
+    dlon = lon2 - lon1
+    # calculates the east-west component of the bearing
+    x = math.sin(dlon) * math.cos(lat2)
+    # calculates the north-south component of the bearing
+    y = math.cos(lat1)*math.sin(lat2) - math.sin(lat1)*math.cos(lat2)*math.cos(dlon)
+    # calcluate the angle from north clockwise to the (x,y) point
+    brng = math.atan2(x, y)
+    # convert back to degrees
+    brng = math.degrees(brng)
+    # ensures result is positive
+    return (brng + 360) % 360
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """great circle distance in meters between two (lat, lon) points"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    diff_lat = math.radians(lat2 - lat1)
+    diff_lon = math.radians(lon2 - lon1)
+
+    a = math.sin(diff_lat/2)**2 + math.cos(lat1_rad)*math.cos(lat2_rad)*math.sin(diff_lon/2)**2
+
+    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+def signed_bearing_delta(bearing1, bearing2):
+    # returns signed delta in degrees in range -180 and 180
+    # Postive = right turn, Negative = left turn
+    delta = (bearing2 - bearing1 + 540) % 360 - 180
+    return delta
+
+
+#### TRACK (ARRAY) HELPERS ####
+# the same rules as TrackAnalyzer, on the whole track at once
+
+def track_geometry(lats, lons):
+    """
+    Distance (meters) and bearing (degrees, 0 = north) of every segment of the
+    track in one pass. Segment i goes from point i to point i+1, so both
+    results have one less entry than the track
+    """
+    if np is not None:
+        lat = np.radians(np.asarray(lats, dtype=float))
+        lon = np.radians(np.asarray(lons, dtype=float))
+        lat1, lat2 = lat[:-1], lat[1:]
+        dlon = np.diff(lon)
+        cos1, cos2 = np.cos(lat1), np.cos(lat2)
+
+        a = np.sin(np.diff(lat)/2)**2 + cos1*cos2*np.sin(dlon/2)**2
+        dist = 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+        x = np.sin(dlon) * cos2
+        y = cos1*np.sin(lat2) - np.sin(lat1)*cos2*np.cos(dlon)
+        bearing = (np.degrees(np.arctan2(x, y)) + 360) % 360
+        return dist, bearing
+
+    dist = []
+    bearing = []
+    prev = None
+    for lat, lon in zip(lats, lons):
+        # radians, sin and cos of each point are worked out once and shared
+        # by the segment before and the segment after it
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        curr = (lat_r, lon_r, math.sin(lat_r), math.cos(lat_r))
+        if prev is not None:
+            lat1, lon1, sin1, cos1 = prev
+            lat2, lon2, sin2, cos2 = curr
+            dlon = lon2 - lon1
+
+            a = math.sin((lat2 - lat1)/2)**2 + cos1*cos2*math.sin(dlon/2)**2
+            dist.append(2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a)))
+
+            x = math.sin(dlon) * cos2
+            y = cos1*sin2 - sin1*cos2*math.cos(dlon)
+            bearing.append((math.degrees(math.atan2(x, y)) + 360) % 360)
+        prev = curr
+    return dist, bearing
+
+def bearing_deltas(bearing):
+    """
+    signed change in bearing (-180 to 180) between each pair of consecutive
+    segments, entry i is the turn made at point i+1
+    Postive = right turn, Negative = left turn
+    """
+    if np is not None:
+        bearing = np.asarray(bearing, dtype=float)
+        return (bearing[1:] - bearing[:-1] + 540) % 360 - 180
+    return [signed_bearing_delta(b1, b2) for b1, b2 in zip(bearing, bearing[1:])]
+
+def jump_mask(lats, lons, times, max_speed=97):
+    """
+    Which points to keep when dropping gps jumps, same rule as TrackAnalyzer:
+    a point is dropped if it is at the same time as the last kept point or
+    would need more than max_speed (m/s) to get there from it.
+    times are in seconds. Returns a list of bools, one per point
+    """
+    n = len(lats)
+    if n == 0:
+        return []
+
+    # first check every point against the point right before it. As long as
+    # nothing has been dropped yet that is the same as checking against the
+    # last kept point, so only the part after the first jump needs a slow pass
+    dist, _ = track_geometry(lats, lons)
+    first_jump = None
+    for i in range(1, n):
+        time_diff = times[i] - times[i-1]
+        if time_diff == 0 or dist[i-1] / time_diff > max_speed:
+            first_jump = i
+            break
+    keep = [True] * n
+    if first_jump is None:
+        return keep
+
+    prev = first_jump - 1
+    for i in range(first_jump, n):
+        time_diff = times[i] - times[prev]
+        if time_diff == 0 or haversine_m(lats[prev], lons[prev], lats[i], lons[i]) / time_diff > max_speed:
+            keep[i] = False
+        else:
+            prev = i
+    return keep
+
+def step_vertices(lats, lons, step=8.0, first=0, begin=None, dist=None):
+    """
+    The points the turn rule takes bearings between: point first, then the
+    next point at least step meters from it, and so on. begin is the first
+    point checked (default first + 1).
+    dist: track_geometry's segment distances, if already worked out. A point
+    can't be further from the last vertex than the path driven to it, so the
+    points before that path is step long are skipped without a haversine
+    """
+    if dist is None:
+        dist, _ = track_geometry(lats, lons)
+    # path driven from point 0 to each point
+    path = [0.0]
+    for d in dist:
+        path.append(path[-1] + float(d))
+    n = len(path)
+
+    vertices = [first]
+    v_lat, v_lon = lats[first], lons[first]
+    i = first + 1 if begin is None else begin
+    while i < n:
+        # (less a mm for the rounding in the sums)
+        i = max(i, bisect_left(path, path[vertices[-1]] + step - 1e-3))
+        if i >= n:
+            break
+        if haversine_m(v_lat, v_lon, lats[i], lons[i]) >= step:
+            vertices.append(i)
+            v_lat, v_lon = lats[i], lons[i]
+        i += 1
+    return vertices
+
+def turn_runs(deltas, direction="left", threshold_deg=10.0):
+    """
+    the runs of consecutive bearing_deltas that swing more than threshold_deg
+    in the given direction ("left" or "right"), as (first, last) positions in
+    deltas. TrackAnalyzer counts each run as one turn at its middle point
+    """
+    if np is not None and len(deltas):
+        delta = np.asarray(deltas, dtype=float)
+        turned = delta < -threshold_deg if direction == "left" else delta > threshold_deg
+        # +1 where a run begins, -1 right after one ends
+        edges = np.diff(turned.astype(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    runs = []
+    run_start = None
+    for i, delta in enumerate(deltas):
+        if (delta < -threshold_deg) if direction == "left" else (delta > threshold_deg):
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            runs.append((run_start, i - 1))
+            run_start = None
+    if run_start is not None:
+        runs.append((run_start, len(deltas) - 1))
+    return runs
+
+def stop_runs(speeds, times, stop_speed=1.0, min_stop=1.0):
+    """
+    Finds the stretches where the speed is below stop_speed for at least
+    min_stop seconds. A stretch only counts once the car is moving again.
+    Returns (first index, last index) of each stop
+    """
+    if np is not None and len(speeds):
+        slow = np.asarray(speeds, dtype=float) < stop_speed
+        times = np.asarray(times, dtype=float)
+        # +1 where a slow run begins, -1 right after one ends
+        edges = np.diff(slow.astype(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        # a run that goes to the end of the track never ended
+        if len(ends) and ends[-1] == len(slow):
+            starts, ends = starts[:-1], ends[:-1]
+        last = ends - 1
+        long_enough = times[last] - times[starts] >= min_stop
+        return list(zip(starts[long_enough].tolist(), last[long_enough].tolist()))
+
+    runs = []
+    run_start = None
+    for i, speed in enumerate(speeds):
+        if speed < stop_speed:
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            if times[i-1] - times[run_start] >= min_stop:
+                runs.append((run_start, i - 1))
+            run_start = None
+    return runs
+
+
+#### ROUTE SIMPLIFICATION ####
+
+def simplify(lats, lons, tolerance_m=2.0, window=2000):
+    """
+    Douglas-Peucker route simplification. Returns the indexes of the points
+    to keep; every dropped point is within tolerance_m meters of the line
+    that is kept.
+
+    The track is cut into windows of `window` points (the window ends are
+    always kept) and each window is simplified on its own, so the cost grows
+    linearly with the track length instead of n log n / n^2 for one big run.
+    Each window is flattened to meters around its first point, which is
+    plenty accurate over a few km.
+    """
+    n = len(lats)
+    if n < 3:
+        return list(range(n))
+
+    keep = [False] * n
+    keep[0] = True
+    for start in range(0, n - 1, window):
+        end = min(start + window, n - 1)
+        keep[end] = True
+
+        # flatten the window to x/y meters
+        lat0 = math.radians(lats[start])
+        ky = R * math.pi / 180
+        kx = ky * math.cos(lat0)
+        if np is not None:
+            xs = np.asarray(lons[start:end+1], dtype=float) * kx
+            ys = np.asarray(lats[start:end+1], dtype=float) * ky
+        else:
+            xs = [lon * kx for lon in lons[start:end+1]]
+            ys = [lat * ky for lat in lats[start:end+1]]
+
+        stack = [(0, end - start)]
+        while stack:
+            a, b = stack.pop()
+            if b - a < 2:
+                continue
+            i, d = _farthest(xs, ys, a, b)
+            if d > tolerance_m:
+                keep[start + i] = True
+                stack.append((a, i))
+                stack.append((i, b))
+
+    return [i for i, k in enumerate(keep) if k]
+
+def _farthest(xs, ys, a, b):
+    """(index, distance) of the point between a and b farthest from the segment a-b"""
+    ax, ay, bx, by = xs[a], ys[a], xs[b], ys[b]
+    dx, dy = bx - ax, by - ay
+    seg2 = dx*dx + dy*dy
+
+    if np is not None:
+        px = xs[a+1:b] - ax
+        py = ys[a+1:b] - ay
+        if seg2 == 0:
+            d2 = px*px + py*py
+        else:
+            # distance to the closest point of the segment (not the infinite line)
+            t = np.clip((px*dx + py*dy) / seg2, 0.0, 1.0)
+            ex, ey = px - t*dx, py - t*dy
+            d2 = ex*ex + ey*ey
+        i = int(np.argmax(d2))
+        return a + 1 + i, math.sqrt(d2[i])
+
+    best, best_d2 = a + 1, -1.0
+    for i in range(a + 1, b):
+        px, py = xs[i] - ax, ys[i] - ay
+        if seg2:
+            t = (px*dx + py*dy) / seg2
+            t = 0.0 if t < 0 else 1.0 if t > 1 else t
+            px, py = px - t*dx, py - t*dy
+        d2 = px*px + py*py
+        if d2 > best_d2:
+            best, best_d2 = i, d2
+    return best, math.sqrt(best_d2)
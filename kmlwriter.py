@@ -0,0 +1,227 @@
+"""
+Streaming KML writer.
+
+Writes the document straight to the file as placemarks are added instead of
+building the whole thing in memory first (which is what simplekml does).
+Every marker kind shares one <Style> that is written once in the header and
+referenced by id, so a placemark is only a few lines of output.
+
+A path ending in .kmz gets a zipped kmz (doc.kml inside), compressed as it
+is written. Other kml files that go with a document (e.g. the tiles of a
+level of detail route, see lod.py) are made with sibling(): plain files
+next to it, or more entries in the same kmz.
+"""
+
+import io
+from pathlib import Path
+import zipfile
+from xml.sax.saxutils import escape
+
+# kml colors are aabbggrr
+YELLOW = "ff00ffff"
+GREEN = "ff008000"
+BLUE = "ffff0000"
+RED = "ff0000ff"
+
+ICON = "http://maps.google.com/mapfiles/kml/pushpin/ylw-pushpin.png"
+
+# id -> (kind, color, width or scale)
+STYLES = {
+    "route": ("line", YELLOW, 3),
+    "start": ("icon", GREEN, 1.3),
+    "end": ("icon", BLUE, 1.3),
+    "left": ("icon", YELLOW, 1.0),
+    "stop": ("icon", RED, 1.2),
+}
+
+
+def format_coords(coords):
+    """(lon, lat) pairs -> kml coordinate text"""
+    return " ".join(f"{lon},{lat},0" for lon, lat in coords)
+
+
+def region(box, min_lod=0, max_lod=-1):
+    """
+    <Region> text: box is (west, south, east, north), the contents are shown
+    while the box is between min_lod and max_lod pixels on screen (-1 = no limit)
+    """
+    west, south, east, north = box
+    return ('<Region><LatLonAltBox>'
+            f'<north>{north}</north><south>{south}</south><east>{east}</east><west>{west}</west>'
+            '</LatLonAltBox>'
+            f'<Lod><minLodPixels>{min_lod}</minLodPixels><maxLodPixels>{max_lod}</maxLodPixels></Lod>'
+            '</Region>')
+
+
+class KMLWriter:
+    """
+    Usage:
+        with KMLWriter("out.kml") as kml:
+            kml.line("GPS Route", coords)
+            kml.point("Stop", lon, lat, "stop")
+
+    The header and styles are written as soon as the writer is opened. If
+    the with block raises, the half written file is removed.
+    """
+
+    def __init__(self, path, name=None, kmz=None):
+        self.path = Path(path)
+        self.zip = None
+        self.kmz = kmz              # the kmz writer this is an extra entry of
+        self.entries = []           # (name, text) of those extra entries
+        if kmz is not None:
+            # a zip only takes one entry at a time and doc.kml is still
+            # being written, so this one waits in memory until the kmz closes
+            self.out = io.StringIO()
+        elif self.path.suffix.lower() == ".kmz":
+            self.zip = zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED)
+            self.out = io.TextIOWrapper(self.zip.open("doc.kml", "w"), encoding="utf-8")
+        else:
+            self.out = open(self.path, "w", encoding="utf-8")
+        self.closed = False
+        self._write_header(name or self.path.stem)
+
+    def sibling(self, relpath, name=None):
+        """
+        a writer for another kml that this one links to by relpath: a file
+        relative to this one's folder, or an entry of the same kmz
+        """
+        if self.zip is not None:
+            return KMLWriter(Path(relpath).as_posix(), name, kmz=self)
+        path = self.path.parent / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return KMLWriter(path, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def _write_header(self, name):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+                       '<Document>\n'
+                       f'  <name>{escape(name)}</name>\n')
+        for style_id, (kind, color, size) in STYLES.items():
+            if kind == "line":
+                self.out.write(f'  <Style id="{style_id}">\n'
+                               f'    <LineStyle><color>{color}</color><width>{size}</width></LineStyle>\n'
+                               '  </Style>\n')
+            else:
+                self.out.write(f'  <Style id="{style_id}">\n'
+                               f'    <IconStyle><color>{color}</color><scale>{size}</scale>'
+                               f'<Icon><href>{ICON}</href></Icon></IconStyle>\n'
+                               '  </Style>\n')
+
+    def point(self, name, lon, lat, style, description=None, clamp=False):
+        """one marker placemark, style is one of the STYLES ids"""
+        desc = f'    <description>{escape(description)}</description>\n' if description else ''
+        mode = '<altitudeMode>clampToGround</altitudeMode>' if clamp else ''
+        self.out.write('  <Placemark>\n'
+                       f'    <name>{escape(name)}</name>\n'
+                       f'{desc}'
+                       f'    <styleUrl>#{style}</styleUrl>\n'
+                       f'    <Point>{mode}<coordinates>{lon},{lat},0</coordinates></Point>\n'
+                       '  </Placemark>\n')
+
+    def begin_folder(self, name):
+        """everything written until end_folder goes in a <Folder>"""
+        self.out.write(f'  <Folder>\n    <name>{escape(name)}</name>\n')
+
+    def end_folder(self):
+        self.out.write('  </Folder>\n')
+
+    def begin_line(self, name, style="route"):
+        """
+        starts a LineString placemark, the coordinates are then streamed in
+        with add_coords and the placemark finished with end_line
+        """
+        self.out.write('  <Placemark>\n'
+                       f'    <name>{escape(name)}</name>\n'
+                       f'    <styleUrl>#{style}</styleUrl>\n'
+                       '    <LineString>\n'
+                       '      <extrude>1</extrude>\n'
+                       '      <altitudeMode>clampToGround</altitudeMode>\n'
+                       '      <coordinates>')
+
+    def add_coords(self, coords):
+        """writes more (lon, lat) pairs into the open LineString"""
+        text = format_coords(coords)
+        if text:
+            self.out.write(text)
+            self.out.write(" ")
+
+    def end_line(self):
+        self.out.write('</coordinates>\n'
+                       '    </LineString>\n'
+                       '  </Placemark>\n')
+
+    def line(self, name, coords, style="route"):
+        """a whole LineString placemark in one go"""
+        self.begin_line(name, style)
+        self.add_coords(coords)
+        self.end_line()
+
+    def multi_line(self, name, lines, style="route", lod=None):
+        """
+        one placemark of several LineStrings (lists of (lon, lat)), only
+        shown within the lod region (region() text) when there is one
+        """
+        self.out.write('  <Placemark>\n'
+                       f'    <name>{escape(name)}</name>\n'
+                       + (f'    {lod}\n' if lod else '') +
+                       f'    <styleUrl>#{style}</styleUrl>\n'
+                       '    <MultiGeometry>\n')
+        for coords in lines:
+            self.out.write('      <LineString><extrude>1</extrude><altitudeMode>clampToGround</altitudeMode>'
+                           f'<coordinates>{format_coords(coords)}</coordinates></LineString>\n')
+        self.out.write('    </MultiGeometry>\n'
+                       '  </Placemark>\n')
+
+    def network_link(self, name, href, refresh=None, lod=None):
+        """
+        a NetworkLink that loads another kml (path or url), re-fetched every
+        refresh seconds when refresh is given. With lod (region() text) it is
+        only loaded once that region is in view and big enough on screen
+        """
+        timer = (f'<refreshMode>onInterval</refreshMode><refreshInterval>{refresh}</refreshInterval>'
+                 if refresh else '')
+        if lod:
+            timer += '<viewRefreshMode>onRegion</viewRefreshMode>'
+        self.out.write('  <NetworkLink>\n'
+                       f'    <name>{escape(name)}</name>\n'
+                       + (f'    {lod}\n' if lod else '') +
+                       f'    <Link><href>{escape(str(href))}</href>{timer}</Link>\n'
+                       '  </NetworkLink>\n')
+
+    def close(self):
+        if self.closed:
+            return
+        self.out.write('</Document>\n</kml>\n')
+        self._close_files()
+
+    def discard(self):
+        """closes and deletes the file (used when processing failed half way)"""
+        if self.kmz is not None:
+            # never made it into the kmz, nothing on disk
+            self.out.close()
+            self.closed = True
+            return
+        if not self.closed:
+            self._close_files()
+        self.path.unlink(missing_ok=True)
+
+    def _close_files(self):
+        if self.kmz is not None:
+            self.kmz.entries.append((str(self.path), self.out.getvalue()))
+        self.out.close()
+        if self.zip is not None:
+            for name, text in self.entries:
+                self.zip.writestr(name, text)
+            self.zip.close()
+        self.closed = True
@@ -0,0 +1,277 @@
+"""
+Follow mode for live gps streams.
+
+Reads NMEA from a log that is still being written (like tail -f), a FIFO
+or the serial device / pseudo-terminal itself, and keeps a small kml of the
+trip so far up to date as fixes come in:
+    python live.py /dev/ttyUSB0 --kml live.kml
+    python live.py growing_log.txt --kml live.kml --link live_link.kml
+
+Open the --link file in Google Earth once; it re-loads live.kml every
+--interval seconds, so the map follows the car.
+
+Everything is worked out one fix at a time by the same TrackAnalyzer as
+makeKMLFile (jump filter, stops, left turns, start/end of motion, and with
+--smooth the same Kalman filter first), so the live kml ends up with the
+same markers as the batch one. The route is written in parts: every
+ROUTE_PART simplified points go into live_route/<n>.kml once, and live.kml
+only links to them, so each rewrite stays small however long the drive.
+"""
+
+import argparse
+from datetime import timedelta
+import os
+from pathlib import Path
+import time
+
+from kmlwriter import KMLWriter
+import main
+from smoothing import MotionFilter
+from spatial import GridIndex
+
+# the analyzer simplifies the live route in windows of this many fixes, so
+# the line is at most this far behind the car before it is simplified
+ROUTE_WINDOW = 200
+# and draws at most about this many of the fixes not simplified yet
+ROUTE_TAIL = 100
+# every ROUTE_PART simplified route points go into their own kml, written once
+ROUTE_PART = 2000
+# seconds between kml rewrites
+INTERVAL = 0.5
+
+
+def follow(path, from_start=False, poll=0.1):
+    """
+    Yields the lines of a file as they are written. For a regular file this
+    waits at the end for more (starting at the current end unless
+    from_start); for a FIFO, pipe or tty it reads until the writer closes it.
+    A line is only yielded once its newline has arrived
+    """
+    regular = Path(path).is_file()
+    with open(path, "r", encoding="latin1", newline="") as f:
+        if regular and not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not regular:
+                    break
+                time.sleep(poll)
+                continue
+            if not line.endswith(("\n", "\r")):
+                # the rest of the line isn't written yet
+                partial += line
+                continue
+            yield partial + line
+            partial = ""
+
+
+class LiveAnalyzer:
+    """
+    Usage:
+        live = LiveAnalyzer(smooth=False)
+        for fix in main.iter_fixes(fields):
+            live.add(fix)               # -> list of new markers
+        live.finish()                   # the stream ended, close the trip
+        live.write_kml("live.kml")
+
+    Feeds the fixes one at a time to the same TrackAnalyzer as makeKMLFile
+    (main.trip_analyzer), so the stops, turns and trip times match the batch
+    kml of the same log. A marker only shows up once the analyzer confirmed
+    it (the car moved on after it).
+    """
+
+    def __init__(self, smooth=False):
+        self.analyzer = main.trip_analyzer(smooth=smooth, window=ROUTE_WINDOW)
+        self.filter = MotionFilter() if smooth else None
+        self.turns = GridIndex(main.TURN_SPACING)
+        self.stops = GridIndex(main.STOP_RADIUS)
+        self.route = []         # simplified (lon, lat) not in a route part yet
+        self.parts = 0          # route parts written so far
+        self.changed = False
+
+    @property
+    def fixes(self):
+        """fixes kept so far"""
+        return self.analyzer.count
+
+    @property
+    def first(self):
+        """fix right before the car first moved"""
+        return self.analyzer.start_fix
+
+    @property
+    def end(self):
+        """fix right after the car last moved (so far)"""
+        analyzer = self.analyzer
+        if analyzer.start is None:
+            return None
+        return analyzer.end_fix or analyzer.after_moving or analyzer.last
+
+    def add(self, fix):
+        """
+        takes the next fix (a dict from iter_fixes). returns the markers it
+        completed as ("left" | "stop", cluster) pairs
+        """
+        if self.filter is not None:
+            fix = self.filter.update(fix)
+            if fix is None:
+                return []
+        self.changed = True
+        return self._events(self.analyzer.add(fix))
+
+    def finish(self):
+        """the stream ended: sends out the rest of the route, drops what came after the car last moved"""
+        try:
+            events = self.analyzer.finish()
+        except ValueError:
+            # nothing to close, the car never moved
+            return []
+        self.changed = True
+        return self._events(events)
+
+    def _events(self, events):
+        markers = []
+        for event in events:
+            kind = event[0]
+            if kind == "route":
+                self.route.extend(event[1])
+            elif kind == "left":
+                markers.append(("left", self.turns.add(event[1], event[2])))
+            elif kind == "stop":
+                markers.append(("stop", self.stops.add(event[1], event[2], event[3])))
+        return markers
+
+    def tail(self):
+        """the route points the analyzer hasn't simplified yet, thinned to at most about ROUTE_TAIL"""
+        pending = self.analyzer.route
+        if len(pending) <= ROUTE_TAIL:
+            return pending
+        return pending[::len(pending) // ROUTE_TAIL + 1] + [pending[-1]]
+
+    def write_kml(self, path):
+        """
+        writes the trip so far. Full route parts are written once to
+        <name>_route/<n>.kml and only linked from path, so a rewrite is the
+        open part, the markers and the links. Every file is written next to
+        where it goes and renamed over it, so a map reloading it never sees
+        half a file
+        """
+        self.kml_writer(path)()
+
+    def kml_writer(self, path):
+        """
+        write_kml in two steps: copies the trip so far and returns a function
+        that writes it, so the writing can run on another thread while fixes
+        keep coming in (server.py)
+        """
+        path = Path(path)
+        parts = path.with_name(f"{path.stem}_route")
+        new_parts = []
+        while len(self.route) > ROUTE_PART:
+            # the part's last point starts the next one, so the line has no gaps
+            self.parts += 1
+            new_parts.append((self.parts, self.route[:ROUTE_PART + 1]))
+            del self.route[:ROUTE_PART]
+        links = self.parts
+        coords = self.route + self.tail()
+        first, last = self.first, self.analyzer.last
+        turns = [(turn.lat, turn.lon, turn.count) for turn in self.turns.clusters]
+        stops = [(stop.lat, stop.lon, stop.count, stop.total) for stop in self.stops.clusters]
+        self.changed = False
+
+        def write(kml):
+            for n in range(1, links + 1):
+                kml.network_link(f"GPS Route {n}", f"{parts.name}/{n}.kml")
+            if len(coords) > 1:
+                kml.line("GPS Route", coords)
+            if first is not None:
+                kml.point("Start", first["longitude"], first["latitude"], "start",
+                          description=f"Start time: {main.format_time(first['time'])}")
+            if last is not None:
+                kml.point("Now", last["longitude"], last["latitude"], "end",
+                          description=f"Last fix: {main.format_time(last['time'])}, "
+                                      f"{last['speed']:.1f} knots")
+            for lat, lon, count in turns:
+                kml.point("Left Turn", lon, lat, "left", clamp=True,
+                          description=f"{count} left turn(s) here")
+            for lat, lon, count, total in stops:
+                kml.point("Stop", lon, lat, "stop",
+                          description=f"{count} stop(s), {total:.0f} s stopped in total")
+
+        def write_files():
+            for n, part in new_parts:
+                parts.mkdir(exist_ok=True)
+                replace_kml(parts / f"{n}.kml", lambda kml: kml.line(f"GPS Route {n}", part))
+            replace_kml(path, write)
+        return write_files
+
+    def duration(self):
+        """seconds from right before the car first moved to right after it last moved"""
+        if self.first is None or self.end is None:
+            return 0.0
+        return self.end["time"] - self.first["time"]
+
+
+def replace_kml(path, write):
+    """write(kml) into a temp file next to path, then renamed over it"""
+    path = Path(path)
+    temp = path.with_name(path.name + ".tmp")
+    with KMLWriter(temp, name=path.stem) as kml:
+        write(kml)
+    os.replace(temp, path)
+
+
+def write_link(path, target, interval):
+    """the kml to open in Google Earth: a NetworkLink that keeps reloading target"""
+    with KMLWriter(path) as kml:
+        kml.network_link("Live GPS", Path(target).resolve().as_uri(), max(interval, 0.1))
+
+
+def run(source, kml_path, interval=INTERVAL, from_start=False, link=None, quiet=False, smooth=False):
+    """follows source until it ends (or ctrl-c), returns the LiveAnalyzer"""
+    live = LiveAnalyzer(smooth)
+    if link:
+        write_link(link, kml_path, interval)
+    last_write = 0.0
+    try:
+        for fix in main.iter_fixes(main.sentence_fields(follow(source, from_start))):
+            for kind, cluster in live.add(fix):
+                if not quiet:
+                    what = "Left turn" if kind == "left" else f"Stop ({cluster.total:.0f} s total)"
+                    print(f"{main.format_time(fix['time'])}  {what} at {cluster.lat:.6f},{cluster.lon:.6f}")
+            now = time.monotonic()
+            if now - last_write >= interval:
+                live.write_kml(kml_path)
+                last_write = now
+    except KeyboardInterrupt:
+        pass
+    live.finish()
+    if live.changed or not Path(kml_path).exists():
+        live.write_kml(kml_path)
+    return live
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Follow a live NMEA stream and keep a kml of it up to date")
+    parser.add_argument("source", help="growing log file, FIFO or serial device")
+    parser.add_argument("--kml", default="live.kml", help="kml rewritten as fixes come in (default live.kml)")
+    parser.add_argument("--link", metavar="KML",
+                        help="also write a NetworkLink kml that reloads --kml, open this one in Google Earth")
+    parser.add_argument("--interval", type=float, default=INTERVAL,
+                        help=f"seconds between kml rewrites (default {INTERVAL})")
+    parser.add_argument("--from-start", action="store_true",
+                        help="read a growing log from the beginning instead of only new lines")
+    parser.add_argument("--smooth", action="store_true",
+                        help="run the fixes through the Kalman filter first, like makeKMLFile --smooth")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't print stops and turns as they happen")
+    args = parser.parse_args()
+
+    live = run(args.source, args.kml, args.interval, args.from_start, args.link, args.quiet, args.smooth)
+    print(f"{live.fixes} fixes, {len(live.stops)} stops, {len(live.turns)} left turns, "
+          f"driving {timedelta(seconds=round(live.duration()))}")
+
+
+if __name__ == "__main__":
+    main_cli()
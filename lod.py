@@ -0,0 +1,159 @@
+"""
+Level of detail route output.
+
+One flat LineString of a long (or many trips aggregated) track makes Google
+Earth load and draw every point at every zoom. Here the route is cut into a
+quadtree of tiles instead, like an image superoverlay:
+
+    level 0     one tile over the whole route, simplified so it looks right
+                at ~TILE_PIXELS on screen (a few hundred points at most)
+    level L     2^L x 2^L tiles, each simplified for its own size
+    last level  the route at the normal --tolerance
+
+Every tile is its own small kml with a <Region>: its line is only drawn
+while the tile is MIN_LOD..2*MIN_LOD pixels on screen (the children take
+over after that, each being half as big), and it has a NetworkLink per
+child tile that Google Earth only follows once that child is in view and
+big enough. So whatever the length of the track, the viewer loads the
+few tiles in view at the detail the zoom needs.
+
+    with KMLWriter("trip.kml") as kml:
+        tiles = write_lod_route(kml, coords)     # -> trip_tiles/0_0_0.kml ...
+"""
+
+import math
+
+from geometry import R, simplify
+from kmlwriter import region
+
+# a tile is drawn from MIN_LOD pixels on screen until its children take over
+MIN_LOD = 128
+# tiles are simplified for this many pixels across (the most a tile is drawn
+# at is 2*MIN_LOD, so the simplify error stays under a pixel)
+TILE_PIXELS = 512
+# the deepest level (~1 m tiles for a 65 km route, plenty)
+MAX_LEVEL = 16
+# with --tolerance 0 the levels still stop at tiles this fine
+MIN_TOLERANCE = 0.5
+
+
+def route_box(coords):
+    """(west, south, east, north) of (lon, lat) points, never zero sized"""
+    lons = [c[0] for c in coords]
+    lats = [c[1] for c in coords]
+    west, east, south, north = min(lons), max(lons), min(lats), max(lats)
+    pad = 1e-6
+    return west - pad, south - pad, east + pad, north + pad
+
+
+def box_size_m(box):
+    """width and height of a box in meters"""
+    west, south, east, north = box
+    m_per_deg = R * math.pi / 180
+    mid = math.radians((south + north) / 2)
+    return (east - west) * m_per_deg * math.cos(mid), (north - south) * m_per_deg
+
+
+def level_count(box, tolerance):
+    """number of levels, so the last one is simplified at tolerance"""
+    span = max(box_size_m(box))
+    finest = max(tolerance, MIN_TOLERANCE) * TILE_PIXELS
+    if span <= finest:
+        return 1
+    return min(math.ceil(math.log2(span / finest)), MAX_LEVEL) + 1
+
+
+def tile_lines(coords, box, level):
+    """
+    {(col, row): [line, ...]} of the route cut into the level's tiles. A
+    segment goes into every tile its bounding box touches, consecutive
+    segments in a tile make one line
+    """
+    west, south, east, north = box
+    n = 1 << level
+    dlon = (east - west) / n
+    dlat = (north - south) / n
+    tiles = {}
+    last = {}       # tile -> index of the last segment put in it
+    for i in range(len(coords) - 1):
+        (lon1, lat1), (lon2, lat2) = coords[i], coords[i + 1]
+        c1 = min(int((min(lon1, lon2) - west) / dlon), n - 1)
+        c2 = min(int((max(lon1, lon2) - west) / dlon), n - 1)
+        r1 = min(int((min(lat1, lat2) - south) / dlat), n - 1)
+        r2 = min(int((max(lat1, lat2) - south) / dlat), n - 1)
+        for c in range(c1, c2 + 1):
+            for r in range(r1, r2 + 1):
+                key = (c, r)
+                if last.get(key) == i - 1:
+                    tiles[key][-1].append(coords[i + 1])
+                else:
+                    tiles.setdefault(key, []).append([coords[i], coords[i + 1]])
+                last[key] = i
+    return tiles
+
+
+def pyramid(coords, levels, box):
+    """
+    [{tile: lines}, ...] per level, finest last. Each level is simplified
+    from the one below it (fewer points every time), at the tolerance its
+    tiles are drawn at
+    """
+    width = max(box_size_m(box))
+    result = []
+    lons = [c[0] for c in coords]
+    lats = [c[1] for c in coords]
+    for level in range(levels - 1, -1, -1):
+        if level < levels - 1:
+            keep = simplify(lats, lons, width / (1 << level) / TILE_PIXELS)
+            lats = [lats[i] for i in keep]
+            lons = [lons[i] for i in keep]
+        result.append(tile_lines(list(zip(lons, lats)), box, level))
+    result.reverse()
+    return result
+
+
+def tile_box(box, level, col, row):
+    west, south, east, north = box
+    n = 1 << level
+    dlon = (east - west) / n
+    dlat = (north - south) / n
+    return west + col * dlon, south + row * dlat, west + (col + 1) * dlon, south + (row + 1) * dlat
+
+
+def tile_name(level, col, row):
+    return f"{level}_{col}_{row}.kml"
+
+
+def write_lod_route(kml, coords, tolerance=2.0, folder=None):
+    """
+    writes the route (list of (lon, lat), already simplified at tolerance)
+    as tiles next to the kml (in folder, <stem>_tiles/ by default, or inside
+    the same kmz) and links the top tile from the kml. returns (tiles, levels)
+    """
+    if len(coords) < 2:
+        return 0, 0
+    box = route_box(coords)
+    levels = level_count(box, tolerance)
+    tiles = pyramid(coords, levels, box)
+    folder = folder or f"{kml.path.stem}_tiles"
+
+    count = 0
+    for level, level_tiles in enumerate(tiles):
+        leaf = level == levels - 1
+        children = {}
+        if not leaf:
+            for col, row in tiles[level + 1]:
+                children.setdefault((col // 2, row // 2), []).append((col, row))
+        for (col, row), lines in level_tiles.items():
+            this = tile_box(box, level, col, row)
+            with kml.sibling(f"{folder}/{tile_name(level, col, row)}", f"Route {level}/{col}/{row}") as tile:
+                # the top tile is also what shows when zoomed all the way out
+                tile.multi_line("GPS Route", lines,
+                                lod=region(this, 0 if level == 0 else MIN_LOD, -1 if leaf else 2 * MIN_LOD))
+                for c, r in sorted(children.get((col, row), ())):
+                    tile.network_link(f"Route {level + 1}/{c}/{r}", tile_name(level + 1, c, r),
+                                      lod=region(tile_box(box, level + 1, c, r), MIN_LOD))
+            count += 1
+
+    kml.network_link("GPS Route", f"{folder}/{tile_name(0, 0, 0)}")
+    return count, levels
@@ -1,76 +1,193 @@
 #Names: Vivian Hernandez & Jenny Zheng
 
 from collections import Counter
+import argparse
+import bz2
+import calendar
+import contextlib
 import datetime
-import re
-import math
+import functools
+import glob
+import gzip
+import itertools
+import lzma
+import mmap
+import multiprocessing
+import operator
+import os
 import sys
-import simplekml
 from pathlib import Path
 from datetime import timedelta, timezone
 
+from analyzer import TrackAnalyzer
+from cache import TrackCache
+from kmlwriter import KMLWriter
+from lod import write_lod_route
+from places import PLACE_RADIUS, PlaceCatalog, load_places
+from smoothing import smooth_fixes
+from spatial import GridIndex
+from stats import PROFILERS, RunStats, append_record, stage
+from store import TripStore
+from trips import MIN_TRIP, TripSegmenter
+from track import COLUMNS, Track
+
 # RIT's (lat, lon)
 RIT = (43.085556, -77.680556)
 # Prof's Home
 HOUSE = (43.139444, -77.439444)
 
+# places trips start and end at, --places loads a bigger catalog instead (see places.py).
+# a trip end within PLACE_RADIUS meters of one is labeled with it
+PLACES = PlaceCatalog.from_points({"RIT": RIT, "House": HOUSE}, PLACE_RADIUS)
+
 # max number of points 
 MAX_POINTS = 10000
 
+# GGA fix quality thresholds, worse fixes are dropped before any detection
+MAX_HDOP = 5.0
+MIN_SATELLITES = 4
+# max seconds between an RMC and the GGA merged into it
+GGA_WINDOW = 0.5
+
+# speeds are in knots
+# below STOP_SPEED for at least MIN_STOP seconds counts as a stop
+STOP_SPEED = 1.0
+MIN_STOP = 1.0
+# using 0.8 m/s or 1.55 knots for the threshold for moving vehicles
+MOVING = 2
+# a left turn is the bearing swinging left by more than TURN_THRESHOLD
+# degrees, with the bearings taken between points at least TURN_STEP meters
+# apart (not between fixes, so the fix rate doesn't matter)
+TURN_THRESHOLD = 10.0
+TURN_STEP = 8.0
+# left turns within this many meters of each other get one marker
+TURN_SPACING = 10
+# same for stops (a queue at a light moves a few car lengths)
+STOP_RADIUS = 20
+# with --smooth, a left turn is the (smoothed) course swinging left more
+# than TURN_ANGLE degrees within TURN_SPAN meters
+TURN_SPAN = 20
+TURN_ANGLE = 40
+# the route line is simplified so no point is moved more than this many meters (0 = off)
+SIMPLIFY_TOLERANCE = 2.0
+
+# parsed tracks are cached here so re-runs (e.g. while tuning the thresholds
+# above) skip the NMEA parsing. bump PARSER_VERSION whenever readFile,
+# read_gprmc/read_gpgga or the GGA merge change what ends up in the track
+CACHE_DIR = Path(__file__).parent / ".track_cache"
+PARSER_VERSION = 2
+
 
 ######### STEP 1: Read File #########
-def readFile(file_path):
-    gps_data = []  # []format 
+# number of header lines (Vers, USE_SERIAL_FEEDBACK, ...) at the top of each log
+HEADER_LINES = 5
 
+def nmea_checksum(body):
+    """XOR of every character of the sentence between the $ and the *"""
+    return functools.reduce(operator.xor, body.encode('latin1'), 0)
+
+def nmea_checksum_ok(line):
+    """
+    Checks the *hh at the end of a sentence against the XOR of every
+    character between the $ and the *
+    """
+    star = len(line) - 3
+    if star < 1 or line[0] != '$' or line[star] != '*':
+        return False
     try:
-        with open(file_path, 'r', encoding='latin1') as f:
-            lines = f.read().splitlines()  
-            temp_arr = []
-            for line in lines[5:]: #Skip teh first 5 lines 
-                if not line.strip():
-                    continue
-                
-                # ignore lines with burped gps data
-                count = line.count("$GP")
-                if count > 1:
-                    # print("double found")
-                    # print(line)
-                    # parts_list = re.findall(r'(\$GP[^$\r\n]*)', line)
-                    # for sent in parts_list:
-                    #     fields = sent.split(',')
-                    #     fields = [p if p != '' else '0' for p in fields]
-                    #     temp_arr.append(fields)
-                    continue
+        expected = int(line[star+1:], 16)
+    except ValueError:
+        return False
+    return nmea_checksum(line[1:star]) == expected
 
 
-                parts = line.split(',') #Splits the data by comma
-                # print(parts)
-                
-                parts = [p if p != '' else '0' for p in parts] #makes this an array for the line 
-                temp_arr.append(parts)
-            gps_data.append(temp_arr)
+def split_sentences(line):
+    """
+    Pulls the sentences out of a burped line where the gps wrote one
+    sentence over another, e.g.
+    $GPRMC,144917.000,A,...,010525$GPGGA,144917.250,...,M,,*5F
+    Yields every piece (from a $ up to the next $) that has a good checksum,
+    the cut off ones fail it and are dropped
+    """
+    start = line.find('$')
+    while start != -1:
+        end = line.find('$', start + 1)
+        sentence = line[start:end] if end != -1 else line[start:]
+        if nmea_checksum_ok(sentence):
+            yield sentence
+        start = end
+
+
+# compressed logs are read through these, picked by the file extension
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def open_log(file_path):
+    """
+    Opens a gps log as latin1 text. .gz, .bz2 and .xz logs are decompressed
+    on the fly as they are read, never unpacked to disk or into memory
+    """
+    opener = OPENERS.get(Path(file_path).suffix.lower(), open)
+    return opener(file_path, 'rt', encoding='latin1')
+
+
+def readFile(file_path, counts=None):
+    """
+    Lazily reads the gps file one line at a time and yields the comma split
+    fields of each sentence, so the whole log is never held in memory.
+    Sentences that fail the checksum are dropped, burped lines holding more
+    than one sentence are split up and the complete ones kept.
+    counts: optional Counter the dropped lines are added up in (see stats.py)
+    """
+    try:
+        with open_log(file_path) as f:
+            yield from sentence_fields(itertools.islice(f, HEADER_LINES, None), counts) #Skip the first 5 lines
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
 
-    
-    # print(gps_data[0]) #EXAMPLE
-    return gps_data
-
-######### STEP 2: CONVERT DATA TO KML FILE #########
+def sentence_fields(lines, counts=None):
+    """
+    the comma split fields of every sentence in lines that passes the
+    checksum (shared by readFile and the live follow mode).
+    counts: optional Counter, gets the number of lines, bad checksums and
+    burped lines once the lines run out
+    """
+    # kept in locals, a Counter update per line would slow the parse down
+    total = bad = burped = recovered = 0
+    try:
+        for line in lines:
+            total += 1
+            line = line.strip()
+            if not line:
+                continue
 
+            # almost every line is one sentence, only go looking for
+            # more when there is a second $
+            if line.find('$', 1) == -1:
+                if nmea_checksum_ok(line):
+                    yield line.split(',') #Splits the data by comma
+                else:
+                    bad += 1
+            else:
+                burped += 1
+                found = 0
+                for sentence in split_sentences(line):
+                    found += 1
+                    yield sentence.split(',')
+                recovered += found
+                if not found:
+                    bad += 1
+    finally:
+        if counts is not None:
+            counts["lines"] += total
+            counts["bad_checksum"] += bad
+            counts["burped"] += burped
+            counts["burped_recovered"] += recovered
 
-####  HELPER FUNCT ####
 
-def safe_float(value):
-    # removes any character that isn't a digit or a decimal point 
-    cleaned = re.sub(r"[^0-9.]", "", value)
-    # returns the cleaned string as a float, otherwise 0.0 if empty str
-    return float(cleaned) if cleaned else 0.0
+######### STEP 2: CONVERT DATA TO KML FILE #########
 
-def clean_nmea_field(gps):
-    """Remove any non-digit characters from a NMEA field."""
-    return ''.join(ch for ch in gps if ch.isdigit())
 
+####  HELPER FUNCT ####
 
 def nmea_to_decimal(value, direction):
     """
@@ -81,261 +198,152 @@ def nmea_to_decimal(value, direction):
     Note: value has to be in str formay 
           NMEA format is fixed -> (d)ddmm.mmmm.
     """
-    if '.' in value:
-        # must have a . for valid NMEA format
-        dec_pos = value.find('.')
-        min_start = dec_pos - 2     # last 2 digits before the deimial are the degrees
-        # extract the degrees, index 0 to wherever min_start is
-        degrees_part = safe_float(value[:min_start])
-        # this gets the minutes part 
-        min_part = float(value[min_start:])
-
-        # convert to decimal by converting the minutes to decimal and adding degrees
-        dec_degrees = degrees_part + (min_part / 60.0)
-    else:
+    # must have a . for valid NMEA format
+    dec_pos = value.find('.')
+    if dec_pos < 2:
         return None #Case: No . found, likely an invalid format
-   
+
+    min_start = dec_pos - 2     # last 2 digits before the deimial are the degrees
+    # convert to decimal by converting the minutes to decimal and adding degrees
+    dec_degrees = int(value[:min_start] or 0) + float(value[min_start:]) / 60.0
+
     # negate if sourth or west -- standard gps convention
-    if direction in ["S", "W"]:
-        dec_degrees *= -1
+    if direction == "S" or direction == "W":
+        dec_degrees = -dec_degrees
 
     return dec_degrees
 
-def convert_utc(time):
+@functools.lru_cache(maxsize=64)
+def day_epoch(date):
     """
-    Converts to YYYY-MM-DDThh:mm:ssZ
-    Example: 144904.500        -> UTC Time: 14:49:04.500 (hhmmss.sss)
+    Unix time (seconds) of midnight UTC for a NMEA ddmmyy date.
+    Cached since every fix in a log has the same date or two
     """
-    return datetime.datetime.fromtimestamp(time, tz=timezone.utc)
+    return calendar.timegm((2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]), 0, 0, 0))
 
+def time_of_day(time):
+    """
+    Seconds since midnight UTC for a NMEA hhmmss.sss time
+    Example: 144904.500 -> 53344.5
+    """
+    return int(time[0:2])*3600 + int(time[2:4])*60 + float(time[4:])
 
-def date_time_conversion(date, time):
+def nmea_epoch(date, time):
     """
-    Converts to date time format
+    Unix time (seconds, keeps the fraction) for a NMEA ddmmyy date and
+    hhmmss.sss time
+    Example: 010525, 144904.500 -> 1746110944.5
     """
-    date = clean_nmea_field(date)
-    time = clean_nmea_field(time)
+    return day_epoch(date) + time_of_day(time)
 
-    hours = int(time[0:2])
-    minutes = int(time[2:4])
-    seconds = int(time[4:6])
-    
-    day = int(date[0:2])
-    month = int(date[2:4])
-    year = int(date[4:6])
-    year += 2000
-
-    dt = datetime.datetime(year, month, day, hours, minutes, seconds)
-
-    date_time = dt.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
-    return date_time
-
-
-
-
-def degree_turn(p1, p2):
-    """
-    Returns turn degrees from point1 to point2
-    0 = north
-    90 = east
-    180 = south
-    270 = west
-    """
-    # convert degrees to radians
-    lat1, lon1 = math.radians(p1[0]), math.radians(p1[1])
-    lat2, lon2 = math.radians(p2[0]), math.radians(p2[1])
-    # get the difference in longitude between the two points
-    dlon = lon2 - lon1
-    # calculates the east-west component of the bearing
-    x = math.sin(dlon) * math.cos(lat2)
-    # calculates the north-south component of the bearing 
-    y = math.cos(lat1)*math.sin(lat2) - math.sin(lat1)*math.cos(lat2)*math.cos(dlon)
-    # calcluate the angle from north clockwise to the (x,y) point 
-    brng = math.atan2(x, y)
-    # convert back to degrees
-    brng = math.degrees(brng)
-    # ensures result is positive 
-    return (brng + 360) % 360
-
-def haversine_m(lat1, lon1, lat2, lon2):
-    R = 6371000.0   # earth's radius in meters
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    diff_lat = math.radians(lat2-lat1)
-    diff_lon = math.radians(lon2 - lon1)
-
-    a = math.sin(diff_lat)**2 + math.cos(lat1_rad)*math.cos(lat2_rad)*math.sin(diff_lon/2)**2
-
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-def signed_bearing_delta(bearing1, bearing2):
-    # returns signed delta in degrees in range -180 and 180
-    # Postive = right turn, Negative = left turn
-    delta = (bearing2 - bearing1 + 540) % 360 - 180
-    return delta
-
-def turn_direction(p1, p2, p3, threshold_deg = 10.0, min_dist = 3.0):
-    '''
-    p1,p2,p3 are tuples (lat, lon)
-    threshold_deg: minimum absolute bearing change to consider a turn
-    min_dist: minimum meters between points to avoid noisy bearings
-    TODO: if too many false turns raise thresh to 20-30 or increase min dist
-    if we start missing gentle turns, lower the threshold
-    '''
-    lat1, lon1 = p1
-    lat2, lon2 = p2
-    lat3, lon3 = p3
-
-    # skip if points are too close
-    if haversine_m(lat1, lon1, lat2, lon2) < min_dist:
-        return "straight"
-    if haversine_m(lat2, lon2, lat3, lon3) < min_dist:
-        return "straight"
-
-    b1 = degree_turn(p1, p2)    # bearing from p1 to p2
-    b2 = degree_turn(p2, p3)    # bearing from p2 to p3
-
-    # diff = (b2 - b1 + 360) % 360    # change in bearing in degrees 
-
-    # if diff > 10 and diff < 180:
-    #     return "left"
-    # elif diff > 180 and diff < 350:
-    #     return "right"
-    # else:
-    #     return "straight"
-
-    delta = signed_bearing_delta(b1, b2)
-    
-    if delta > threshold_deg:
-        return "right"
-    elif delta < -threshold_deg:
-        return "left"
-    else:
-        return "straight"
+def to_datetime(epoch):
+    """Unix time -> naive UTC datetime"""
+    return datetime.datetime.fromtimestamp(epoch, tz=timezone.utc).replace(tzinfo=None)
 
+def format_time(epoch):
+    """Unix time -> YYYY-MM-DDThh:mm:ssZ"""
+    return to_datetime(epoch).strftime('%Y-%m-%dT%H:%M:%SZ')
 
 def read_gprmc(arr):
     """
     Read and convert the gprmc -> Recommended Minimum Navigation Information (navigation/positioning type)
+    arr is a sentence that already passed the checksum (see readFile).
+    Returns None for void or unreadable fixes
     """
     if len(arr) < 10:
         return None
-    
-    date_time = date_time_conversion(arr[9],arr[1])
-    time = float(arr[1])
+
     status = arr[2]
-    latitude = nmea_to_decimal(arr[3],arr[4])
-    longitude = nmea_to_decimal(arr[5],arr[6])
-    speed = safe_float(arr[7])
-    course = float(arr[8])
-
-    #Error Check: 2 valid args 
-    mode = ""
-    checkSum = ""
-    if len(arr) > 12:
-        if '*' in arr[12]:
-            parts = arr[12].split('*')
-            mode = parts[0]
-            checkSum = parts[1] if len(parts) > 1 else ""
-        else:
-            mode = arr[12]
+    if(status != 'A'): return None #Not Valid
 
+    try:
+        time = nmea_epoch(arr[9], arr[1])
+        latitude = nmea_to_decimal(arr[3],arr[4])
+        longitude = nmea_to_decimal(arr[5],arr[6])
+        speed = float(arr[7] or 0)
+        course = float(arr[8] or 0)
+    except ValueError:
+        return None
+    if latitude is None or longitude is None:
+        return None
 
-    if(status == 'V'): return None #Not Valid
+    # mode is the last field, in front of the *checksum
+    mode = arr[12][:-3] if len(arr) > 12 else ""
 
     return {
-        "date_time": date_time,   # ISO 8601 time 
-        "time":time,
+        "time": time,             #Unix time in seconds (UTC)
         "status": status,         #Status: A = valid, V = void              
         "latitude": latitude,                  
         "longitude": longitude,              
         "speed": speed,           #Speed over ground in knots              
         "course": course,         #Track angle in degrees                            
         "mode": mode,             #A = Autonomous, D = Differential, E = Estimated, N = Data not valid                   
-        "checksum": checkSum      #XOR of all characters between $ and *               
     }
 
 
 
 def read_gpgga(arr):
     """
-    Read and convert the gprmc -> Global Positioning System Fix Data (fix/precision type)
-    
+    Read and convert the gpgga -> Global Positioning System Fix Data (fix/precision type)
+    arr is a sentence that already passed the checksum (see readFile).
+    GGA has no date, so the time is kept as seconds since midnight and
+    matched up with the RMC fixes in iter_fixes.
+    Returns None when there is no fix or the sentence can't be read
+
     162.6             -> Altitude above mean sea level (meters)
     M                 -> Units for altitude: M = meters
     -34.4             -> Height of geoid (mean sea level) above WGS84 ellipsoid (meters)
     M                 -> Units for geoid separation: M = meters
     """
-    utc_time = convert_utc(float(arr[1]))
-    latitude = nmea_to_decimal(arr[2],arr[3])
-    longitude = nmea_to_decimal(arr[4],arr[5])
-    fix_quality = int(arr[6])
-    num_satellites = int(arr[7])
-    hdop = float(arr[8])
-    altitude = float(arr[9])
-    geoid_height = arr[11]
-    dgps_update = arr[13] if len(arr) > 12 else ''
-    dgps_station = arr[14] if len(arr) > 13 else ''
-    checksum = arr[14].replace("*","") if len(arr) > 14 else ""
+    if len(arr) < 10:
+        return None
+
+    try:
+        fix_quality = int(arr[6] or 0)
+        if fix_quality == 0: return None #No fix
+
+        time = time_of_day(arr[1])
+        num_satellites = int(arr[7] or 0)
+        hdop = float(arr[8] or 0)
+        altitude = float(arr[9] or 0)
+    except ValueError:
+        return None
 
     return {
-        "utc_time": utc_time,               #Time Format: 14:49:04.750 (hhmmss.sss)        
-        "latitude": latitude,                
-        "longitude": longitude,               
+        "time_of_day": time,                #Seconds since midnight UTC, from 14:49:04.750 (hhmmss.sss)
         "fix_quality": fix_quality,         #0 = invalid, 1 = GPS fix, 2 = DGPS fix
         "num_satellites": num_satellites,
         "hdop": hdop,                       #Horizontal Dilution of Precision (HDOP)
-        "altitude": altitude,          
-        "geoid_height": geoid_height,       #Units for altitude
-        "dgps_update": dgps_update,
-        "dgps_station": dgps_station,
-        "checksum": checksum                #XOR of all characters between $ and *
+        "altitude": altitude,               #meters above mean sea level
     }
 
 
-def get_start_and_end_index(all_info):
-    """
-    returns the start and end index of when the car first starts moving and 
-    last stops moving
-    Note: speed is in knots
-    """
-    # using 0.8 m/s or 1.55 knots for the threshold for moving vehicles
-    MOVING = 2
-    start = None
-    end = None
-    for index, info in enumerate(all_info):
-        # print(info)
-        if info["speed"] > MOVING:
-            start = index
-            break
-    
-    for index, info in enumerate(reversed(all_info)):
-        if info["speed"] > MOVING:
-            end = len(all_info) - index
-            break
-    
-    # use the points right before and right after motion detected
-    if start != 0:
-        start -= 1
+@functools.lru_cache(maxsize=4)
+def open_places(path):
+    """the catalog in a --places file, loaded once per process (batch workers only get the path)"""
+    return load_places(path)
 
-    return start, end
+def nearest_place(lat, lon, places=None):
+    """(name, distance in meters) of the closest place in the catalog (PLACES by default)"""
+    place, dist = (PLACES if places is None else places).nearest(lat, lon)
+    return place.name, dist
 
-def estimate_missing(all_info, index):
+def place_label(lat, lon, places=None):
+    """name of the place whose geofence the point is in, or None"""
+    place = (PLACES if places is None else places).locate(lat, lon)
+    return place.name if place is not None else None
+
+def estimate_missing(current, places=None):
     """
-    get the distance from the current index to the closest location (home or rit)
-    and then calculate how long it would have taken to go from current location to
-    the closest location at the current speed
+    get the distance from the current fix to the closest known place (home or
+    rit, or the closest in the places catalog) and then calculate how long it
+    would have taken to go from current location to there at the current speed
     """
-    current = all_info[index]
     # speed in knots
     speed = current["speed"]
-    
-    dist_to_rit = haversine_m(current["latitude"], current["longitude"], RIT[0], RIT[1])
-
-    dist_to_home = haversine_m(current["latitude"], current["longitude"], HOUSE[0], HOUSE[1])
 
     # get min dist in meters 
-    min_dist = min(dist_to_rit, dist_to_home)
+    _, min_dist = nearest_place(current["latitude"], current["longitude"], places)
 
     # print("min dist: ", min_dist)
 
@@ -349,255 +357,792 @@ def estimate_missing(all_info, index):
 
     return datetime.timedelta(seconds=seconds)
 
-    
 
-def is_jump(prev, curr, max_speed = 97):
-    """
-    prev, curr: tuples of (lat, lon, datetime)
-    max_speed: maximum plausible speed
-    """
-    # 97 knots is approx 50 m/s
-    # TODO maybe this needs to be swapped
-    dist = haversine_m(prev[0], prev[1], curr[0], curr[1])
-    time_diff = (curr[2] - prev[2]).total_seconds()
-    # print(time_diff)
-    
-    if time_diff == 0:
-        return True  # duplicate timestamp
-    
-    speed = dist / time_diff  # meters per second
-    if speed > max_speed:
-        return True  # unrealistically fast -> ignore
-    return False
+def gga_gap(rmc, gga):
+    """seconds between an RMC fix and a GGA fix, by time of day (handles midnight)"""
+    return abs((gga["time_of_day"] - rmc["time"] % 86400 + 43200) % 86400 - 43200)
 
+def attach_gga(rmc, gga):
+    """copies the GGA fix data onto the RMC record (None for all of it if there is no GGA)"""
+    rmc["altitude"] = gga["altitude"] if gga else None
+    rmc["hdop"] = gga["hdop"] if gga else None
+    rmc["num_satellites"] = gga["num_satellites"] if gga else None
+    rmc["fix_quality"] = gga["fix_quality"] if gga else None
 
-def filter_route(route_coords):
+def good_fix(rmc, max_hdop, min_satellites):
     """
-     if vehicle is traveling nearly straight, you can ignore some points on the line
-
-     keep the first and last point and any point where the bearing changes significantly 
+    HDOP/satellite check. Fixes that never got GGA data (e.g. logs written
+    with USE_RMC_ONLY=true) are let through
     """
-    threshold = 3.0
-    # if we only have 3 points, we keep them all
-    if len(route_coords) < 3:
-        return route_coords
-    
-    filtered = [route_coords[0]]
-
-    for i in range(1, len(route_coords) - 2):
-        p1 = (route_coords [i][1],route_coords [i][0])  # lat, lon
-        p2 = (route_coords [i+1][1], route_coords [i+1][0])
-        p3 = (route_coords [i+2][1], route_coords [i+2][0])
-
-        bearing1 = degree_turn(p1, p2)
-        bearing2 = degree_turn(p2, p3)
-
-        deg_change = abs(signed_bearing_delta(bearing1, bearing2))
-
-        if deg_change >= threshold:
-            filtered.append(route_coords[i])
-
-        # direction = turn_direction(p1, p2, p3)
-
-        # if direction != "straight":
-        #     filtered.append(route_coords[i])
-
-    filtered.append(route_coords[-1])
-
-    return filtered
-
-
+    if rmc["hdop"] is None:
+        return True
+    return rmc["hdop"] <= max_hdop and rmc["num_satellites"] >= min_satellites
 
-
-#### MAIN FILE #####
-def makeKMLFile(gps_data):
+class FixMerger:
     """
-    
-    array of arrays
-    """
-    STOP_SPEED = 1.0
-    MIN_STOP = 1.0
-    MOVING = 2
-    kml = simplekml.Kml()
- 
-    #Read in the gps info 
-    route_coords = []
-    all_info =[]
-    # track previous point
-    prev_point = None
-
-    for arr in gps_data:
-
+    The RMC/GGA merge from iter_fixes as an object that sentences are pushed
+    into (used where the sentences arrive over time, e.g. server.py)
+
+    Usage:
+        merger = FixMerger()
+        for arr in sentences:
+            for fix in merger.feed(arr): ...
+        for fix in merger.flush(): ...
+    """
+    __slots__ = ("max_hdop", "min_satellites", "last_gga", "pending", "pending_gap", "counts")
+
+    def __init__(self, max_hdop=MAX_HDOP, min_satellites=MIN_SATELLITES, counts=None):
+        self.max_hdop = max_hdop
+        self.min_satellites = min_satellites
+        # optional Counter for the dropped sentences/fixes (see stats.py)
+        self.counts = counts
+        self.last_gga = None
+        self.pending = None      # RMC fix waiting to see if the next GGA fits it better
+        self.pending_gap = None  # seconds to the GGA merged into it so far
+
+    def feed(self, arr):
+        """takes the fields of one sentence, returns the fixes it completed (0 or 1)"""
         if arr[0].endswith("GPRMC"):
             rmc = read_gprmc(arr) 
 
             if rmc is None:
-                continue 
+                if self.counts is not None:
+                    self.counts["void" if len(arr) > 2 and arr[2] == 'V' else "bad_rmc"] += 1
+                return () 
 
             # ignore impossible lat/long
             p_lon, p_lat = rmc["longitude"], rmc["latitude"]
             if not (-90 <= p_lat <= 90 and -180 <= p_lon <= 180):
                 # print("removed for impossible lat/lon: ", rmc)
-                continue
+                if self.counts is not None:
+                    self.counts["out_of_range"] += 1
+                return ()
+
+            done = self.flush()
+
+            # the GGA written just before this fix
+            gap = gga_gap(rmc, self.last_gga) if self.last_gga is not None else None
+            if gap is not None and gap <= GGA_WINDOW:
+                attach_gga(rmc, self.last_gga)
+                self.pending_gap = gap
+            else:
+                attach_gga(rmc, None)
+                self.pending_gap = None
+            self.pending = rmc
+            return done
+
+        if arr[0].endswith("GPGGA"):
+            gga = read_gpgga(arr)
+            if gga is None:
+                if self.counts is not None:
+                    self.counts["no_fix" if len(arr) >= 10 and arr[6] in ("0", "") else "bad_gga"] += 1
+                return ()
+
+            # the GGA written just after the waiting fix, if it is closer
+            pending = self.pending
+            if pending is not None:
+                gap = gga_gap(pending, gga)
+                if gap <= GGA_WINDOW and (self.pending_gap is None or gap < self.pending_gap):
+                    attach_gga(pending, gga)
+                    self.pending_gap = gap
+            self.last_gga = gga
+        return ()
+
+    def flush(self):
+        """hands over the waiting fix (if it passes good_fix), e.g. at the end of the stream"""
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            if good_fix(pending, self.max_hdop, self.min_satellites):
+                return (pending,)
+            if self.counts is not None:
+                self.counts["low_quality"] += 1
+        return ()
+
+def iter_fixes(gps_data, max_hdop=MAX_HDOP, min_satellites=MIN_SATELLITES, counts=None):
+    """
+    Pipeline stage between readFile and makeKMLFile: parses the GPRMC
+    sentences and yields the ones with a possible lat/lon, one at a time.
+
+    The GPGGA sentences are merged in on the way: each RMC fix gets the
+    altitude, hdop, satellite count and fix quality of the GGA closest to it in
+    time (within GGA_WINDOW seconds, None if there isn't one). The receiver
+    writes the GGA right before or right after its RMC, so only the last GGA
+    and the RMC still waiting for the next sentence are kept around (see
+    FixMerger). Fixes with a bad hdop or too few satellites are dropped here.
+
+    Jumps are filtered afterwards, in the one pass analysis (see analyzer.py).
+    counts: optional Counter for what got dropped (see stats.py)
+    """
+    merger = FixMerger(max_hdop, min_satellites, counts)
+    for arr in gps_data:
+        yield from merger.feed(arr)
+    yield from merger.flush()
+
 
-            # ignore big jumps
-            dt = datetime.datetime.strptime(rmc["date_time"], "%Y-%m-%dT%H:%M:%SZ")
-            curr_point = (p_lat, p_lon, dt)
-            if prev_point and is_jump(prev_point, curr_point):
-                # print("Ignored jump at:", rmc["date_time"])
-                # print("removed for big jumps: ", rmc)
-                continue
 
-            route_coords.append((rmc["longitude"], rmc["latitude"]))
-            all_info.append(rmc)
-            prev_point = curr_point
 
-    # TODO: double check this, this is supposed to make it so that we start the 
-    # duration count when the car first starts moving and when the car first stops moving
-    moving_start, moving_end = get_start_and_end_index(all_info)
-    all_info = all_info[moving_start:moving_end+1]
-    route_coords = route_coords[moving_start:moving_end+1]
+#### PARSING ####
+# log -> Track, the analysis then runs on the Track in one pass (analyzer.py)
 
-    print("speed at start: ", all_info[0]["speed"])
-    print("speed at end: ", all_info[-1]["speed"])
+def load_track(gps_data, counts=None):
+    """parse + GGA merge + quality filter, straight into a Track"""
+    track = Track.from_fixes(iter_fixes(gps_data, counts=counts))
+    if not len(track):
+        raise ValueError("no valid GPRMC fixes found")
+    return track
 
-    # print("size of the route_coords: ", len(route_coords))
+def parse_log(file_path, counts=None):
+    """reads and parses a whole log into a Track (counts: see stats.py)"""
+    return load_track(readFile(file_path, counts), counts)
 
-    # TODO here is where i would put the simplify route function -- issue here is that 
-    # decided to not use this bc it messed with the data points too much
-    # after filtering out some of the straight points, it no longer follows the curve of the road
-    # route_coords = filter_route(route_coords)
+def cache_tag():
+    """parser version + quality settings, part of the cache key"""
+    return f"v{PARSER_VERSION}-hdop{MAX_HDOP:g}-sat{MIN_SATELLITES}-gga{GGA_WINDOW:g}"
 
-    # print("size of the route_coords: ", len(route_coords))
+def read_track(file_path, cache_dir=CACHE_DIR, jobs=1, stats=None):
+    """
+    the parsed track of a log, from the track cache when it has this log
+    (cache_dir=None always parses). A big uncompressed log is parsed on
+    `jobs` cores (None = all of them), see parse_log_parallel.
+    stats: optional RunStats, gets the "read" time, the parse counts and
+    whether the cache had the track
+    """
+    counts = stats.counts if stats is not None else None
+    if jobs != 1 and Path(file_path).suffix.lower() not in OPENERS \
+            and os.path.getsize(file_path) >= PARALLEL_MIN_BYTES:
+        parse = functools.partial(parse_log_parallel, jobs=jobs)
+    else:
+        parse = parse_log
+    if stats is None:
+        return parse(file_path) if cache_dir is None else TrackCache(cache_dir).load(file_path, cache_tag(), parse)
+
+    def parse_and_note(path, counts):
+        stats.cache = "off" if cache_dir is None else "miss"
+        return parse(path, counts=counts)
+
+    stats.cache = "hit"
+    with stats.stage("read"):
+        if cache_dir is None:
+            track = parse_and_note(file_path, counts)
+        else:
+            # a track from the cache brings the counts of its parse with it
+            track = TrackCache(cache_dir).load(file_path, cache_tag(), parse_and_note, counts)
+    stats.counts["fixes"] += len(track)
+    return track
+
+
+#### BIG LOGS ####
+# one log of a week of serial capture is too slow on one core: it is
+# mmapped, cut into byte ranges on line boundaries and every range is parsed
+# in its own process. The parsed columns come back as raw bytes and are
+# joined in order. The jump filter compares each fix with the last kept one,
+# which can be in another chunk, so it is left for the one pass over the
+# joined track (TrackAnalyzer) like for any other log
+
+# logs at least this big are parsed in parallel (single log mode)
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+# bytes per chunk (more chunks than cores keeps every core busy to the end)
+CHUNK_BYTES = 8 * 1024 * 1024
+# how far before its range a chunk starts reading, to pick up the GGA
+# written just before its first RMC
+CHUNK_WARMUP = 4096
+
+def header_end(data):
+    """byte offset of the first sentence, after the HEADER_LINES header lines"""
+    return sum(len(line) for line in data[:65536].splitlines(keepends=True)[:HEADER_LINES])
+
+def chunk_ranges(data, start, chunk=CHUNK_BYTES):
+    """(start, end) byte ranges of about chunk bytes, each ending right after a newline"""
+    ranges = []
+    size = len(data)
+    while start < size:
+        end = data.find(b'\n', min(start + chunk, size) - 1) + 1 or size
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def decoded_lines(data, start, end):
+    """the lines of data[start:end] as latin1 text (split like readFile: \\n, \\r\\n or \\r)"""
+    return (line.decode('latin1') for line in data[start:end].splitlines())
+
+def parse_chunk(job):
+    """
+    Worker: parses the sentences starting in one byte range of the log,
+    returns the Track columns as bytes and the counts of what was dropped
+    in the range (see stats.py).
+
+    The RMC/GGA merge needs a bit of the neighbours: the lines right before
+    the range are fed first so the first RMC can get the GGA written before
+    it, and after the range lines are read until the last RMC has seen the
+    sentence after it (the next GGA, or an RMC that tells it no GGA is coming)
+    """
+    file_path, first, start, end = job
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        merger = FixMerger()
+        if start > first:
+            warm = max(first, start - CHUNK_WARMUP)
+            if warm > first:
+                warm = data.find(b'\n', warm, start) + 1 or start
+            for arr in sentence_fields(decoded_lines(data, warm, start)):
+                merger.feed(arr)
+            # the RMC before the range belongs to the chunk before
+            merger.pending = None
+            merger.pending_gap = None
+
+        track = Track()
+        counts = merger.counts = Counter()
+        for arr in sentence_fields(decoded_lines(data, start, end), counts):
+            for fix in merger.feed(arr):
+                track.append(fix)
+
+        # the lines past the range are counted by the next chunk, only the
+        # last fix of this one is
+        merger.counts = None
+        pending = merger.pending
+        pos = end
+        while pending is not None and merger.pending is pending and pos < len(data):
+            nxt = data.find(b'\n', pos + CHUNK_WARMUP) + 1 or len(data)
+            for arr in sentence_fields(decoded_lines(data, pos, nxt)):
+                done = merger.feed(arr)
+                if merger.pending is not pending:
+                    for fix in done:
+                        track.append(fix)
+                    if not done:
+                        counts["low_quality"] += 1
+                    break
+            pos = nxt
+        if pending is not None and merger.pending is pending:
+            # the end of the log
+            merger.counts = counts
+            for fix in merger.flush():
+                track.append(fix)
+    return tuple(track.columns[name].tobytes() for name in COLUMNS), dict(counts)
+
+def parse_log_parallel(file_path, jobs=None, chunk=CHUNK_BYTES, counts=None):
+    """same Track (and counts) as parse_log, parsed on jobs processes (None = all cores)"""
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        first = header_end(data)
+        work = [(str(file_path), first, start, end) for start, end in chunk_ranges(data, first, chunk)]
+    track = Track()
+    with multiprocessing.Pool(jobs) as pool:
+        for part, part_counts in pool.imap(parse_chunk, work):
+            for name, raw in zip(COLUMNS, part):
+                track.columns[name].frombytes(raw)
+            if counts is not None:
+                counts.update(part_counts)
+    if not len(track):
+        raise ValueError("no valid GPRMC fixes found")
+    return track
+
+def trip_times(start, end, moving=MOVING, estimate_start=True, estimate_end=True, places=None):
+    """
+    (start datetime, end datetime, duration, estimated) for a trip from the
+    start fix to the end fix. If the log starts or ends while the car is
+    moving (faster than moving knots), the time to/from the closest known place is added on and
+    estimated is True. estimate_start/end=False when that end of the trip is
+    known to be parked anyway (e.g. a trip split off at a long stop).
+    places: PlaceCatalog to measure to, PLACES by default
+    """
+    missing_s = timedelta(0)
+    missing_e = timedelta(0)
+
+    # check to see if the gps file started or stopped while the car is in motion
+    start_mov = estimate_start and start["speed"] > moving
+    end_mov = estimate_end and end["speed"] > moving
+    if start_mov:
+        missing_s = estimate_missing(start, places)
+    if end_mov:
+        missing_e = estimate_missing(end, places)
+
+    # get the trip duration as the first and last gps data 
+    start_dt = to_datetime(start["time"])
+    end_dt = to_datetime(end["time"])
+    return start_dt, end_dt, end_dt - start_dt + missing_e + missing_s, start_mov or end_mov
+
+def trip_analyzer(tolerance=SIMPLIFY_TOLERANCE, smooth=False, **options):
+    """
+    TrackAnalyzer with the settings above, for smoothed fixes when smooth
+    (shared by makeKMLFile, live.py and server.py so they all find the same
+    stops and turns). options go to TrackAnalyzer, e.g. window
+    """
+    return TrackAnalyzer(stop_speed=STOP_SPEED, min_stop=MIN_STOP, moving=MOVING, tolerance=tolerance,
+                         threshold_deg=TURN_THRESHOLD, turn_step=TURN_STEP,
+                         turn_span=TURN_SPAN if smooth else None, turn_angle=TURN_ANGLE, **options)
 
-    # split paths if number of points exceed the MAX_POINTS
-    for i in range(0, len(route_coords), MAX_POINTS):
-        chunk = route_coords[i: i+MAX_POINTS]
-        # A. A yellow line along the route of travel - Compl Below 
-        line = kml.newlinestring(name="GPS Route")
-        line.coords = chunk
-        line.extrude = 1 #Task: tell google earth to draw line to ground 
+def write_route(kml, coords, written=0):
+    """
+    streams the next (lon, lat) points of the route line into the kml, a new
+    line is started every MAX_POINTS points. written is how many points went
+    out before (the current line is left open), returns the new total
+    """
+    while coords:
+        if written % MAX_POINTS == 0:
+            if written:
+                kml.end_line()
+            # A. A yellow line along the route of travel (route style: yellow, width 3)
+            # B. Do not worry about the altitude -> the line is extruded and clamped to the ground
+            kml.begin_line("GPS Route")
+        part = coords[:MAX_POINTS - written % MAX_POINTS]
+        kml.add_coords(part)
+        written += len(part)
+        coords = coords[len(part):]
+    return written
 
-        # B. Do not worry about the altitude. You can set that a 3 meters or something fixed.
-        line.altitudemode = simplekml.AltitudeMode.clamptoground #Task: tell gooogle earth how to view
 
-        #A1 - Styling Below 
-        line.style.linestyle.width = 3
-        line.style.linestyle.color = simplekml.Color.yellow
+#### MAIN FILE #####
+def makeKMLFile(gps_data, output_path="gps_data_from_kml.kml", verbose=True, tolerance=SIMPLIFY_TOLERANCE,
+                smooth=False, stats=None, lod=False, split=False, trip_files=False, places=None):
+    """
+    gps_data: iterable of sentence fields, e.g. the generator from readFile,
+              or an already parsed Track (see read_track)
+    output_path: where the kml gets written
+    verbose: print the trip info while processing (turned off in batch mode)
+    tolerance: max meters the simplified route line may be off the real track, 0 keeps every point
+    smooth: run the fixes through the Kalman filter first (see smoothing.py), the
+            detection then uses the smoothed position/speed/course
+    stats: optional RunStats (see stats.py), gets the analyze/write times and
+           what the jump filter dropped
+    lod: write the route as level of detail tiles next to the kml, linked
+         from it (see lod.py), instead of one line in it
+    split: cut the log into trips at long stops and gaps (see trips.py), each
+           trip gets its own folder, markers and numbers
+    trip_files: same, with every trip in its own kml (<name>_trip1.kml, ...)
+                linked from output_path
+    places: PlaceCatalog (or the path of a csv/geojson one) to label the
+            trip ends and estimate missing time with, PLACES by default
+
+    returns a summary dict of the trip (start, end, duration, stop and left turn counts),
+    when split the totals over the trips plus "trips", the summary of each
+    """
+    counts = stats.counts if stats is not None else None
+    if isinstance(places, (str, Path)):
+        places = open_places(str(places))
+    if not isinstance(gps_data, Track):
+        gps_data = iter_fixes(gps_data, counts=counts)
+    if smooth:
+        gps_data = smooth_fixes(gps_data, counts=counts)
+    if split or trip_files:
+        return write_trips(gps_data, output_path, trip_files, verbose, tolerance, smooth, stats, lod, places)
+
+    # the header goes out right away, the route as it comes out of the analyzer
+    with stage(stats, "write"), KMLWriter(output_path) as kml:
+        return write_trip(lambda: kml, gps_data, verbose, tolerance, smooth, stats, lod, places=places)
+
+
+def write_trip(open_kml, fixes, verbose=True, tolerance=SIMPLIFY_TOLERANCE, smooth=False, stats=None,
+               lod=False, min_distance=0.0, lod_folder=None, parked=None, places=None):
+    """
+    Analyzes one trip's fixes and writes it: route, start/end, left turn
+    and stop markers go into the KMLWriter open_kml() returns.
+    open_kml is only called once the trip has covered min_distance meters
+    (the events up to there are held), so nothing gets written for a
+    stretch that turns out not to be a trip; then None is returned.
+    parked: optional function giving (parked before, parked after) the trip,
+            those ends get no missing time estimate (see trip_times)
+    returns the trip summary, raises ValueError if the car never moved
+    """
+    # jump filter, trim, turns, stops and route simplification all happen in
+    # this one pass over the fixes (see analyzer.py)
+    analyzer = trip_analyzer(tolerance, smooth)
+    # turns within TURN_SPACING meters of each other share one marker, and
+    # stops at the same spot (e.g. waiting in line at a light) share one too
+    left_turns = GridIndex(TURN_SPACING)
+    stops = GridIndex(STOP_RADIUS)
+
+    # (the route writing is timed as part of "analyze", it can't be pulled apart)
+    kml = None
+    held = []
+    with stage(stats, "analyze"):
+        route_points = 0
+        route = []      # only kept for the lod tiles
+        for event in analyzer.run(fixes):
+            if kml is None:
+                held.append(event)
+                if analyzer.odometer < min_distance:
+                    continue
+                kml = open_kml()
+                events, held = held, None
+            else:
+                events = (event,)
+            for event in events:
+                kind = event[0]
+                if kind == "route":
+                    if lod:
+                        route.extend(event[1])
+                        route_points += len(event[1])
+                    else:
+                        route_points = write_route(kml, event[1], route_points)
+                elif kind == "left":
+                    left_turns.add(event[1], event[2])
+                elif kind == "stop":
+                    stops.add(event[1], event[2], event[3])
+        if route_points and not lod:
+            kml.end_line()
+    if stats is not None:
+        stats.counts["jumps"] += analyzer.jumps
+        stats.counts["duplicate_time"] += analyzer.duplicates
+    if kml is None:
+        return None
+    if lod:
+        with stage(stats, "lod"):
+            tiles, levels = write_lod_route(kml, route, tolerance, lod_folder)
+        del route
+        if verbose:
+            print(f"Route split into {tiles} tiles over {levels} levels of detail")
+
+    start, end = analyzer.start_fix, analyzer.end_fix
+    if verbose:
+        print("speed at start: ", start["speed"])
+        print("speed at end: ", end["speed"])
+        print(f"Route simplified from {analyzer.points} to {route_points} points "
+              f"({100 * (1 - route_points / analyzer.points):.0f}% fewer)")
 
     # Mark the start and end of the route with green(start) and blue(end)
-    # TODO remove this if necessary for submission
-    if all_info:
-        start = all_info[0]
-        end = all_info[-1]
-        start_mov = False
-        end_mov = False
-        missing_s = timedelta(0,0,0,0,0,0,0)
-        missing_e = timedelta(0,0,0,0,0,0,0)
-
-        # check to see if the gps file started or stopped while the car is in motion
+    parked_before, parked_after = parked() if parked is not None else (False, False)
+    start_dt, end_dt, trip_duration, estimated = trip_times(start, end, MOVING, not parked_before,
+                                                            not parked_after, places)
+    kml.point("Start", start["longitude"], start["latitude"], "start",
+              description=f"Start time: {format_time(start['time'])}")
+    kml.point("End", end["longitude"], end["latitude"], "end",
+              description=f"End time: {format_time(end['time'])}")
+    if verbose:
         if start["speed"] > MOVING:
             print("GPS file started while the car was in motion. The total duration will be an estimate.")
-            start_mov = True
         if end["speed"] > MOVING:
             print("GPS file ended while the car was in motion. The total duration will be an estimate.")
-            end_mov = True
-
-        start_pt = kml.newpoint(
-            name="Start",
-            coords=[(start["longitude"], start["latitude"])],
-        )
-        start_pt.style.iconstyle.color = simplekml.Color.green
-        start_pt.style.iconstyle.scale = 1.3
-        start_pt.description = f"Start time: {start['date_time']}"
-
-        end_pt = kml.newpoint(
-            name="End",
-            coords=[(end["longitude"], end["latitude"])],
-        )
-        end_pt.style.iconstyle.color = simplekml.Color.blue
-        end_pt.style.iconstyle.scale = 1.3
-        end_pt.description = f"End time: {end['date_time']}"
-
-        if start_mov:
-            missing_s = estimate_missing(all_info, 0)
-            # print(missing_s)
-        if end_mov:
-            missing_e = estimate_missing(all_info, -1)
-            # print(missing_e)
-
-        # get the trip duration as the first and last gps data 
-        start_dt = datetime.datetime.strptime(start["date_time"], "%Y-%m-%dT%H:%M:%SZ")
-        end_dt =  datetime.datetime.strptime(end["date_time"], "%Y-%m-%dT%H:%M:%SZ")
-        trip_duration = end_dt - start_dt + missing_e + missing_s
         print("Trip started at: ", start_dt)
         print("Trip ended at: ", end_dt)
         print("Total driving time: ", trip_duration)
 
-    # variable to hold last marker location 
-    last_marker = None
     # D. A yellow marker if the car made a left turn.
-    for i in range(len(route_coords )-2):
-        p1 = (route_coords [i][1],route_coords [i][0])  # lat, lon
-        p2 = (route_coords [i+1][1], route_coords [i+1][0])
-        p3 = (route_coords [i+2][1], route_coords [i+2][0])
-        
-        direction = turn_direction(p1, p2, p3)
-        
-        if direction == "left":
-            lon, lat= route_coords [i+1]
-            # only add a new left turn marker if the distance between the new marker and the prev marker is greater than 5 meters
-            if not last_marker or haversine_m(lat, lon, last_marker[0], last_marker[1]) > 10:
-                last_marker = (lat, lon)
-                point = kml.newpoint(name="Left Turn", coords=[(lon, lat)])
-                point.style.iconstyle.color = simplekml.Color.yellow
-                point.altitudemode = simplekml.AltitudeMode.clamptoground
+    for turn in left_turns.clusters:
+        kml.point("Left Turn", turn.lon, turn.lat, "left", clamp=True,
+                  description=f"Left turns here: {turn.count}")
 
-    
     # C. A red marker if the car stopped for a stop sign or traffic light.
-        # C. A red marker if the car stopped for a stop sign or traffic light.
-    current_stop = []
+    for stop in stops.clusters:
+        kml.point("Stop", stop.lon, stop.lat, "stop",
+                  description=f"Stopped here {stop.count} time(s), {stop.total:.0f} s in total")
+
+    return {
+        "start": start_dt,
+        "end": end_dt,
+        "duration": trip_duration,
+        "estimated": estimated,
+        "stops": len(stops),
+        "left_turns": len(left_turns),
+        "points": analyzer.points,
+        "route_points": route_points,
+        "distance_m": round(analyzer.distance, 1),
+        "start_place": place_label(start["latitude"], start["longitude"], places),
+        "end_place": place_label(end["latitude"], end["longitude"], places),
+        # (lat, lon, count, total seconds) for the trip store
+        "stop_markers": [(c.lat, c.lon, c.count, c.total) for c in stops.clusters],
+        "turn_markers": [(c.lat, c.lon, c.count, c.total) for c in left_turns.clusters],
+    }
+
+
+def trip_path(output_path, number):
+    """kml of one trip in trip_files mode, e.g. out.kml -> out_trip2.kml"""
+    path = Path(output_path)
+    return path.with_name(f"{path.stem}_trip{number}{path.suffix}")
 
 
-    for point in all_info:
-        if point["speed"] < STOP_SPEED:  # speed is at index 2
-            current_stop.append(point)
+def write_trips(fixes, output_path, separate=False, verbose=True, tolerance=SIMPLIFY_TOLERANCE,
+                smooth=False, stats=None, lod=False, places=None):
+    """
+    makeKMLFile's split mode. The fixes are cut into trips by a
+    TripSegmenter as they stream past and every trip is analyzed on its own
+    (write_trip), into a "Trip N" folder of the kml or, when separate, into
+    its own kml that the main one links to.
+    returns the totals over the trips plus "trips", the summary of each
+    """
+    segmenter = TripSegmenter(moving=MOVING)
+    trips = []
+    with stage(stats, "write"), KMLWriter(output_path) as kml:
+        for number, trip_fixes in itertools.groupby(fixes, segmenter.trip_of):
+            name = f"Trip {len(trips) + 1}"
+            path = trip_path(output_path, len(trips) + 1)
+            with contextlib.ExitStack() as trip_out:
+                def open_kml():
+                    if separate:
+                        return trip_out.enter_context(KMLWriter(path, name))
+                    kml.begin_folder(name)
+                    trip_out.callback(kml.end_folder)
+                    return kml
+                try:
+                    summary = write_trip(open_kml, trip_fixes, False, tolerance, smooth, stats, lod,
+                                         min_distance=MIN_TRIP,
+                                         lod_folder=None if separate else f"{kml.path.stem}_tiles/trip{len(trips) + 1}",
+                                         parked=lambda: (segmenter.parked_before(number),
+                                                         segmenter.parked_after(number)),
+                                         places=places)
+                except ValueError:
+                    # the car never moved in this stretch
+                    continue
+            if summary is None:
+                continue
+            if separate:
+                kml.network_link(name, path.name)
+            trips.append(summary)
+            if verbose:
+                print(format_trip(name, summary))
+        if not trips:
+            raise ValueError("the car never moved")
+
+    first, last = trips[0], trips[-1]
+    total = {
+        "start": first["start"],
+        "end": last["end"],
+        # driving time only, the time parked between the trips isn't in it
+        "duration": sum((trip["duration"] for trip in trips), timedelta(0)),
+        "estimated": any(trip["estimated"] for trip in trips),
+        "start_place": first["start_place"],
+        "end_place": last["end_place"],
+        "stop_markers": [m for trip in trips for m in trip["stop_markers"]],
+        "turn_markers": [m for trip in trips for m in trip["turn_markers"]],
+        "trips": trips,
+    }
+    for key in ("stops", "left_turns", "points", "route_points", "distance_m"):
+        total[key] = sum(trip[key] for trip in trips)
+    if verbose:
+        print(f"{len(trips)} trips, total driving time: {total['duration']}")
+    return total
+
+
+def format_trip(name, summary):
+    """one line per trip in split mode"""
+    estimate = " (estimate)" if summary["estimated"] else ""
+    places = f"{summary['start_place'] or '?'} -> {summary['end_place'] or '?'}, "
+    return (f"{name}: {places}{summary['start']} to {summary['end']}, "
+            f"driving {summary['duration']}{estimate}, {summary['distance_m'] / 1000:.1f} km, "
+            f"stops {summary['stops']}, left turns {summary['left_turns']}")
+
+
+
+######### BATCH MODE #########
+# log files picked up when a directory is given
+LOG_PATTERNS = ("*.txt", "*.txt.gz", "*.txt.bz2", "*.txt.xz")
+
+
+def collect_logs(paths):
+    """
+    Expands the command line paths into a sorted list of log files.
+    Each path can be a file, a directory (all the *.txt logs in it) or a glob
+    """
+    files = []
+    for p in paths:
+        path = Path(p)
+        if path.is_dir():
+            files.extend(sorted(f for pattern in LOG_PATTERNS for f in path.glob(pattern)))
+        elif path.exists():
+            files.append(path)
         else:
-            if current_stop:
-                start_time = current_stop[0]["time"]
-                end_time = current_stop[-1]["time"]
-                
-                
-                duration = (end_time - start_time)
-                
-                if duration >= MIN_STOP:
-                    mid_point = current_stop[len(current_stop)//2]
-                    
-                    stop_marker = kml.newpoint(
-                        name="Stop",
-                        coords=[(mid_point["longitude"], mid_point["latitude"])]
-                    )
-                    stop_marker.style.iconstyle.color = simplekml.Color.red
-                    stop_marker.style.iconstyle.scale = 1.2
-                
-                current_stop = []
-
-   
-    # print("file complete")
-    kml.save(f"gps_data_from_kml.kml")
+            files.extend(sorted(Path(g) for g in glob.glob(p)))
+    # drop duplicates (same file given twice) but keep the order
+    unique = {}
+    for f in files:
+        unique.setdefault(f.resolve(), f)
+    return list(unique.values())
+
 
+def log_stem(log_path):
+    """file name without the extension(s), e.g. trip.txt.gz -> trip"""
+    path = Path(log_path)
+    if path.suffix.lower() in OPENERS:
+        path = path.with_suffix("")
+    return path.stem
+
+
+def output_names(logs, output_dir, extension=".kml"):
+    """
+    kml (or kmz) path for each log, named after the log so every input gets its own file.
+    Logs with the same name from different folders get a _2, _3, ... suffix
+    """
+    used = Counter()
+    names = []
+    for log in logs:
+        stem = log_stem(log)
+        used[stem] += 1
+        if used[stem] > 1:
+            stem = f"{stem}_{used[stem]}"
+        names.append(Path(output_dir) / (stem + extension))
+    return names
+
+
+def convert(log_path, kml_path, cache_dir=CACHE_DIR, jobs=1, stats=None, **options):
+    """
+    read_track + makeKMLFile for one log. With stats (a RunStats) the run is
+    timed, counted and profiled, and a failure is noted in it before it is raised
+    """
+    if stats is None:
+        return makeKMLFile(read_track(log_path, cache_dir, jobs), kml_path, **options)
+    try:
+        with stats.run():
+            return makeKMLFile(read_track(log_path, cache_dir, jobs, stats), kml_path, stats=stats, **options)
+    except Exception as e:
+        stats.error = f"{type(e).__name__}: {e}"
+        raise
+
+
+def process_file(job):
+    """
+    Worker for the process pool. Never raises, so one bad file does not
+    stop the rest of the batch.
+    instrument is None, or the profiler to run ("" for only the stats)
+    returns (log path, summary or None, error message or None, stats record or None)
+    """
+    log_path, kml_path, cache_dir, options, instrument = job
+    stats = None
+    if instrument is not None:
+        stats = RunStats(log_path, kml_path, instrument or None, Path(kml_path).with_suffix(".prof"))
+    summary = error = None
+    try:
+        summary = convert(log_path, kml_path, cache_dir, stats=stats, verbose=False, **options)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return str(log_path), summary, error, stats.record(summary) if stats is not None else None
+
+
+def format_summary(log_path, summary, error):
+    """one line per file for the batch report"""
+    name = Path(log_path).name
+    if error:
+        return f"{name}: FAILED ({error})"
+    estimate = " (estimate)" if summary["estimated"] else ""
+    trips = f"trips {len(summary['trips'])}, " if "trips" in summary else ""
+    return (f"{name}: {trips}start {summary['start']}, end {summary['end']}, "
+            f"duration {summary['duration']}{estimate}, "
+            f"stops {summary['stops']}, left turns {summary['left_turns']}, "
+            f"route points {summary['points']} -> {summary['route_points']}")
+
+
+def run_batch(logs, output_dir, jobs=None, kmz=False, db=None, cache_dir=CACHE_DIR,
+              stats_path=None, profile=None, **options):
+    """
+    Processes the logs across a pool of worker processes and prints a summary
+    line per file in input order. options are passed on to makeKMLFile.
+    Parsed tracks come from / go to the track cache in cache_dir (None = off).
+    With db (a sqlite path) every trip is also added to the TripStore, from
+    this process only so there is one writer.
+    With stats_path every run's stats record (see stats.py) is appended to
+    that jsonl file, profile turns on a profiler in every worker (cProfile
+    output goes next to each kml as .prof)
+    returns the number of files that failed
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    names = output_names(logs, output_dir, ".kmz" if kmz else ".kml")
+    instrument = (profile or "") if stats_path or profile else None
+    work = [(log, name, cache_dir, options, instrument) for log, name in zip(logs, names)]
+    failed = 0
+    added = 0
+    store = TripStore(db) if db else None
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            for log_path, summary, error, record in pool.imap(process_file, work):
+                print(format_summary(log_path, summary, error))
+                if record is not None:
+                    if stats_path:
+                        append_record(stats_path, record)
+                    if profile == "tracemalloc":
+                        print(f"  peak traced memory {record['profile']['peak_bytes'] / 1e6:.1f} MB")
+                if error:
+                    failed += 1
+                elif store is not None:
+                    added += store.ingest(log_path, summary)
+    finally:
+        if store is not None:
+            store.close()
+    print(f"Processed {len(logs)} files, {failed} failed.")
+    if db:
+        print(f"Added {added} new trips to {db}.")
+    return failed
 
 
 def main():
     """
     Main
 
+    One log file:  python main.py file.txt  -> gps_data_from_kml.kml
+    Batch mode:    python main.py Some_Example_GPS_Files/ [more dirs/globs] -o out_dir
+    Logs can be gzip/bz2/xz compressed, --kmz writes zipped kmz files instead of kml
     """
-    if len(sys.argv) > 1:
-        data = readFile(sys.argv[1])
-        makeKMLFile(data[0])
-    else:
+    parser = argparse.ArgumentParser(description="Convert NMEA gps logs to KML")
+    parser.add_argument("paths", nargs="*", help="gps log file(s), directories or globs")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="where batch mode writes the kml files (default: current dir)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes in batch mode, or for parsing one big log "
+                             "(default: all cores)")
+    parser.add_argument("--kmz", action="store_true",
+                        help="write compressed .kmz files instead of .kml")
+    parser.add_argument("--tolerance", type=float, default=SIMPLIFY_TOLERANCE,
+                        help=f"route simplification error in meters, 0 to keep every point (default {SIMPLIFY_TOLERANCE})")
+    parser.add_argument("--smooth", action="store_true",
+                        help="smooth the track with a Kalman filter before finding stops and turns")
+    parser.add_argument("--lod", action="store_true",
+                        help="write the route as level of detail tiles (<name>_tiles/) that Google Earth "
+                             "loads as you zoom in, for very long or aggregated tracks")
+    parser.add_argument("--split", action="store_true",
+                        help="cut the log into trips at long stops and gaps (see trips.py), one folder per trip")
+    parser.add_argument("--trip-files", action="store_true",
+                        help="like --split, with every trip in its own kml linked from the main one")
+    parser.add_argument("--places", metavar="FILE",
+                        help="csv (name,lat,lon[,radius]) or GeoJSON catalog of known places to label trip "
+                             "ends and estimate missing time with, instead of RIT/House (see places.py)")
+    parser.add_argument("--db", metavar="SQLITE",
+                        help="also add each trip to this stats store (see store.py for reports)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"always parse the logs, don't read or write the parsed track cache ({CACHE_DIR})")
+    parser.add_argument("--stats", metavar="JSONL",
+                        help="append a stats record per log (stage times, dropped line/fix counts, "
+                             "throughput) to this file, see stats.py")
+    parser.add_argument("--profile", choices=PROFILERS,
+                        help="profile the run: cprofile saves a .prof next to the kml, tracemalloc "
+                             "reports the peak memory and top allocation sites")
+    args = parser.parse_args()
+    cache_dir = None if args.no_cache else CACHE_DIR
+
+    if not args.paths:
         print("Missing the gps file. Try again.")
+        return
+    if args.places:
+        # a bad catalog fails here once, not in every batch worker (forked ones reuse it)
+        try:
+            open_places(args.places)
+        except (OSError, ValueError) as e:
+            print(f"Can't load the places file: {e}. Try again.")
+            return
+
+    # single log keeps the old behaviour
+    if len(args.paths) == 1 and Path(args.paths[0]).is_file():
+        output = "gps_data_from_kml.kmz" if args.kmz else "gps_data_from_kml.kml"
+        stats = summary = None
+        if args.stats or args.profile:
+            stats = RunStats(args.paths[0], output, args.profile, Path(output).with_suffix(".prof"))
+        try:
+            summary = convert(args.paths[0], output, cache_dir, args.jobs, stats,
+                              tolerance=args.tolerance, smooth=args.smooth, lod=args.lod,
+                              split=args.split, trip_files=args.trip_files, places=args.places)
+        finally:
+            if stats is not None:
+                print(stats.report())
+                if args.stats:
+                    stats.write(args.stats, summary)
+        if args.db:
+            with TripStore(args.db) as store:
+                if not store.ingest(args.paths[0], summary):
+                    print(f"Already in {args.db}, not added again.")
+        return
+
+    logs = collect_logs(args.paths)
+    if not logs:
+        print("No gps files found. Try again.")
+        return
+    if run_batch(logs, args.output_dir, args.jobs, args.kmz, args.db, cache_dir, args.stats, args.profile,
+                 tolerance=args.tolerance, smooth=args.smooth, lod=args.lod,
+                 split=args.split, trip_files=args.trip_files, places=args.places):
+        sys.exit(1)
 
 
     # data = readFile("Some_Example_GPS_Files/2025_05_01__145019_gps_file.txt")       # home to rit
@@ -0,0 +1,281 @@
+"""
+Known places: what trip starts/ends get labeled with, and what the missing
+time estimate (a log that starts or ends while moving) measures to.
+
+A PlaceCatalog holds named places, each a point with a radius or one or
+more polygons (its geofence), and answers two lookups whatever its size:
+
+    nearest(lat, lon)   closest place by its anchor (a point place's position,
+                        the middle of a polygon's corners). KD-tree over the
+                        anchors as unit vectors, so O(log n) and right across
+                        the whole globe
+    locate(lat, lon)    the place whose geofence the point is in, or None.
+                        Every fence is put in the grid cells its bounding box
+                        touches, so only the few in the point's cell get
+                        tested, O(1). A fence over the antimeridian (+-180)
+                        goes in the cells on both sides of it
+
+Catalogs load from csv (name, lat, lon and an optional radius column) or
+GeoJSON (Point, Polygon and MultiPolygon features with a "name" property and
+an optional "radius" for points):
+
+    places = load_places("depots.geojson")
+    place, meters = places.nearest(43.08, -77.68)
+    place = places.locate(43.08, -77.68)            # Place or None
+"""
+
+import csv
+import json
+import math
+from pathlib import Path
+
+from geometry import haversine_m
+from spatial import M_PER_DEG
+
+# a point place without its own radius covers this many meters
+PLACE_RADIUS = 500
+# geofence grid cell size in degrees (~1 km), a point only has to be tested
+# against the fences in its cell
+CELL_DEG = 0.01
+
+
+def wrap_lon(lon, ref):
+    """lon moved by 360 degrees when that puts it within 180 of ref, so a
+    fence that crosses the antimeridian is one piece around its anchor"""
+    if lon - ref > 180:
+        return lon - 360
+    if lon - ref < -180:
+        return lon + 360
+    return lon
+
+
+class Place:
+    """
+    A named place. lat/lon is its anchor; the geofence is the circle of
+    radius meters around it, or the polygons when there are any (rings of
+    (lat, lon), holes and several parts work by the even-odd rule).
+    The rings and the box are kept in longitudes around the anchor's, which
+    can go past +-180 for a fence over the antimeridian
+    """
+    __slots__ = ("name", "lat", "lon", "radius", "rings", "box")
+
+    def __init__(self, name, lat, lon, radius=None, rings=None):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.radius = radius
+        if rings:
+            rings = [[(p[0], wrap_lon(p[1], lon)) for p in ring] for ring in rings]
+            lats = [p[0] for ring in rings for p in ring]
+            lons = [p[1] for ring in rings for p in ring]
+            self.box = min(lats), min(lons), max(lats), max(lons)
+        else:
+            dlat = radius / M_PER_DEG
+            dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+            self.box = lat - dlat, lon - dlon, lat + dlat, lon + dlon
+        self.rings = rings
+
+    def contains(self, lat, lon):
+        """True if the point is inside the geofence"""
+        lon = wrap_lon(lon, self.lon)
+        south, west, north, east = self.box
+        if not (south <= lat <= north and west <= lon <= east):
+            return False
+        if not self.rings:
+            return haversine_m(lat, lon, self.lat, self.lon) <= self.radius
+        inside = False
+        for ring in self.rings:
+            j = len(ring) - 1
+            for i in range(len(ring)):
+                (lat1, lon1), (lat2, lon2) = ring[i], ring[j]
+                if (lat1 > lat) != (lat2 > lat) and lon < (lon2 - lon1) * (lat - lat1) / (lat2 - lat1) + lon1:
+                    inside = not inside
+                j = i
+        return inside
+
+    def __repr__(self):
+        return f"Place({self.name!r}, {self.lat:.6f}, {self.lon:.6f})"
+
+
+def unit_vector(lat, lon):
+    """point on the unit sphere, the straight line distance between two of
+    these grows with the great circle distance so the KD-tree can use it"""
+    lat, lon = math.radians(lat), math.radians(lon)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def kd_build(points, depth=0):
+    """points: [(unit vector, place index)] -> (vector, index, axis, left, right) nodes"""
+    if not points:
+        return None
+    axis = depth % 3
+    points.sort(key=lambda p: p[0][axis])
+    mid = len(points) // 2
+    vector, index = points[mid]
+    return (vector, index, axis,
+            kd_build(points[:mid], depth + 1), kd_build(points[mid + 1:], depth + 1))
+
+
+def kd_nearest(node, q, best=(math.inf, None)):
+    """(squared distance, place index) of the closest point to q"""
+    if node is None:
+        return best
+    vector, index, axis, left, right = node
+    d = (vector[0] - q[0]) ** 2 + (vector[1] - q[1]) ** 2 + (vector[2] - q[2]) ** 2
+    if d < best[0]:
+        best = d, index
+    diff = q[axis] - vector[axis]
+    near, far = (left, right) if diff < 0 else (right, left)
+    best = kd_nearest(near, q, best)
+    # the other side can only be closer if the splitting plane is
+    if diff * diff < best[0]:
+        best = kd_nearest(far, q, best)
+    return best
+
+
+class PlaceCatalog:
+    """
+    Usage:
+        places = PlaceCatalog()
+        places.add_point("RIT", 43.085556, -77.680556)            # PLACE_RADIUS fence
+        places.add_polygon("Depot 7", [[(lat, lon), ...]])
+        places.nearest(lat, lon)       # -> (Place, meters), (None, inf) when empty
+        places.locate(lat, lon)        # -> Place or None
+    """
+
+    def __init__(self, radius=PLACE_RADIUS, cell_deg=CELL_DEG):
+        self.radius = radius
+        self.cell_deg = cell_deg
+        self.places = []
+        self.cells = {}         # (row, col) -> places whose fence box touches the cell
+        self._tree = None       # built on the first nearest() after a change
+
+    @classmethod
+    def from_points(cls, points, radius=PLACE_RADIUS):
+        """catalog of {name: (lat, lon)}"""
+        catalog = cls(radius)
+        for name, (lat, lon) in points.items():
+            catalog.add_point(name, lat, lon)
+        return catalog
+
+    def add_point(self, name, lat, lon, radius=None):
+        return self._add(Place(name, lat, lon, radius or self.radius))
+
+    def add_polygon(self, name, rings):
+        """rings: lists of (lat, lon), the anchor is the middle of the first ring's corners"""
+        outer = rings[0]
+        if outer[0] == outer[-1]:
+            outer = outer[:-1]
+        lat = sum(p[0] for p in outer) / len(outer)
+        # (the corners of a fence over the antimeridian are averaged on one side of it)
+        lon = sum(wrap_lon(p[1], outer[0][1]) for p in outer) / len(outer)
+        return self._add(Place(name, lat, wrap_lon(lon, 0.0), rings=rings))
+
+    def _add(self, place):
+        self.places.append(place)
+        south, west, north, east = place.box
+        # a box over the antimeridian is two column ranges, one on each side
+        if east - west >= 360:
+            spans = [(-180.0, 180.0)]
+        elif west < -180:
+            spans = [(west + 360, 180.0), (-180.0, east)]
+        elif east > 180:
+            spans = [(west, 180.0), (-180.0, east - 360)]
+        else:
+            spans = [(west, east)]
+        for row in range(math.floor(south / self.cell_deg), math.floor(north / self.cell_deg) + 1):
+            for first, last in spans:
+                for col in range(math.floor(first / self.cell_deg), math.floor(last / self.cell_deg) + 1):
+                    self.cells.setdefault((row, col), []).append(place)
+        self._tree = None
+        return place
+
+    def nearest(self, lat, lon):
+        """(closest place by its anchor, distance in meters)"""
+        if not self.places:
+            return None, math.inf
+        if self._tree is None:
+            self._tree = kd_build([(unit_vector(p.lat, p.lon), i) for i, p in enumerate(self.places)])
+        _, index = kd_nearest(self._tree, unit_vector(lat, lon))
+        place = self.places[index]
+        return place, haversine_m(lat, lon, place.lat, place.lon)
+
+    def locate(self, lat, lon):
+        """the place whose geofence holds the point (the closest one if several do), or None"""
+        cell = math.floor(lat / self.cell_deg), math.floor(wrap_lon(lon, 0.0) / self.cell_deg)
+        best = None
+        best_dist = math.inf
+        for place in self.cells.get(cell, ()):
+            if place.contains(lat, lon):
+                dist = haversine_m(lat, lon, place.lat, place.lon)
+                if dist < best_dist:
+                    best, best_dist = place, dist
+        return best
+
+    def __len__(self):
+        return len(self.places)
+
+
+def load_places(path, radius=PLACE_RADIUS):
+    """
+    PlaceCatalog from a .csv or .geojson/.json file. raises ValueError if
+    the file can't be read as places or has none (OSError if it can't be opened)
+    """
+    path = Path(path)
+    catalog = PlaceCatalog(radius)
+    if path.suffix.lower() in (".geojson", ".json"):
+        read_geojson(path, catalog)
+    else:
+        read_csv(path, catalog)
+    if not catalog:
+        raise ValueError(f"no places in {path}")
+    return catalog
+
+
+def read_csv(path, catalog):
+    """rows of name, lat, lon and optionally radius (meters)"""
+    with open(path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                radius = row.get("radius")
+                catalog.add_point(row["name"], float(row["lat"]), float(row["lon"]),
+                                  float(radius) if radius else None)
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{line}: bad place row ({e})") from None
+
+
+def read_geojson(path, catalog):
+    """Point, Polygon and MultiPolygon features, GeoJSON coordinates are [lon, lat]"""
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"{path}: not valid json ({e})") from None
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: not a GeoJSON Feature or FeatureCollection")
+    features = data.get("features") if data.get("type") == "FeatureCollection" else [data]
+    for n, feature in enumerate(features or [], start=1):
+        try:
+            kind = add_feature(catalog, feature, n)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+            raise ValueError(f"{path}: bad feature {n} ({type(e).__name__}: {e})") from None
+        if kind is not None:
+            raise ValueError(f"{path}: feature {n} is a {kind}, only Point/Polygon/MultiPolygon are places")
+
+
+def add_feature(catalog, feature, n):
+    """adds one GeoJSON feature, returns its geometry type if that isn't one a place can be"""
+    props = feature.get("properties") or {}
+    name = props.get("name") or feature.get("id") or f"place {n}"
+    geometry = feature.get("geometry") or {}
+    kind, coords = geometry.get("type"), geometry.get("coordinates")
+    if kind == "Point":
+        radius = props.get("radius")
+        catalog.add_point(name, float(coords[1]), float(coords[0]), float(radius) if radius else None)
+    elif kind in ("Polygon", "MultiPolygon"):
+        polygons = [coords] if kind == "Polygon" else coords
+        catalog.add_polygon(name, [[(float(p[1]), float(p[0])) for p in ring]
+                                   for polygon in polygons for ring in polygon])
+    else:
+        return kind
+    return None
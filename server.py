@@ -0,0 +1,398 @@
+"""
+Ingestion server for vehicles pushing NMEA over the network.
+
+Each vehicle streams its sentences over TCP (one connection per vehicle)
+or UDP (any number of sentences per datagram). Every vehicle gets its own
+FixMerger + LiveAnalyzer, so the server only keeps a few fixes and the
+markers per vehicle no matter how long it drives. The vehicle's kml
+(OUT/<vehicle>.kml) and a summary line (OUT/summaries.jsonl) are written
+when it disconnects and every --flush seconds while it is still sending.
+
+A vehicle names itself with a first line of "ID <name>"; without one it is
+known by its address. A second connection with a name that is already
+streaming gets its own key (<name>_2, ...) instead of mixing its fixes into
+the first one's track. UDP vehicles count as gone after --idle seconds
+without a datagram.
+
+The files are written on a writer thread from a copy of the vehicle's
+state, so the event loop keeps reading while they are written. Ctrl-C and
+SIGTERM both stop the server with a final flush of every vehicle.
+
+    python server.py serve --port 10110 -o live_out
+    python server.py simulate --vehicles 1000 --port 10110      (local test sender)
+
+The server prints the sentences/second it is taking in every few seconds,
+and answers a tcp connection whose first line is "STATS" with its totals
+(simulate uses that to report how much actually arrived).
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+from pathlib import Path
+import re
+import signal
+import time
+
+from live import LiveAnalyzer
+import main
+
+PORT = 10110    # the usual NMEA-over-IP port
+# seconds between kml/summary flushes of vehicles that are still sending
+FLUSH = 30.0
+# a UDP vehicle that hasn't sent anything for this long is flushed and dropped
+IDLE = 60.0
+# seconds between throughput reports
+REPORT = 5.0
+# simulate over udp sends this many lines per second per vehicle unless told
+# otherwise, udp has no flow control so as fast as possible mostly gets dropped
+UDP_RATE = 100.0
+
+
+def safe_name(vehicle):
+    """vehicle id -> something usable as a file name"""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", vehicle)[:100] or "vehicle"
+
+
+class Vehicle:
+    """incremental state of one vehicle's track"""
+    __slots__ = ("id", "merger", "live", "lines", "sentences", "partial", "last_seen", "udp")
+
+    def __init__(self, vehicle_id):
+        self.id = vehicle_id
+        self.merger = main.FixMerger()
+        self.live = LiveAnalyzer()
+        self.lines = 0
+        self.sentences = 0
+        self.partial = ""       # start of a line whose end hasn't arrived yet
+        self.last_seen = time.monotonic()
+        self.udp = None         # source address when it sends over udp
+
+    def feed(self, text):
+        """takes the next chunk of the stream (may end mid line)"""
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        self.lines += len(lines)
+        for arr in main.sentence_fields(lines):
+            self.sentences += 1
+            for fix in self.merger.feed(arr):
+                self.live.add(fix)
+        self.last_seen = time.monotonic()
+
+    def finish(self):
+        """end of the stream: the last partial line and the fix still waiting for its GGA"""
+        if self.partial:
+            self.feed("\n")
+        for fix in self.merger.flush():
+            self.live.add(fix)
+        self.live.finish()
+
+    def summary(self, final):
+        live = self.live
+        first, end = live.first, live.end
+        return {
+            "vehicle": self.id,
+            "final": final,
+            "lines": self.lines,
+            "sentences": self.sentences,
+            "fixes": live.fixes,
+            "start": main.format_time(first["time"]) if first else None,
+            "end": main.format_time(end["time"]) if end else None,
+            "duration_s": round(live.duration(), 1),
+            "stops": len(live.stops),
+            "left_turns": len(live.turns),
+        }
+
+
+class IngestServer:
+    """
+    Usage:
+        server = IngestServer("live_out")
+        await server.serve("0.0.0.0", 10110)     # runs until cancelled
+    """
+
+    def __init__(self, output_dir, flush=FLUSH, idle=IDLE, report=REPORT):
+        self.out = Path(output_dir)
+        self.out.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush
+        self.idle = idle
+        self.report_every = report
+        self.vehicles = {}      # connected TCP vehicles and recently seen UDP ones
+        self.udp = {}           # udp source address -> vehicle id
+        self.lines = 0          # totals, for the throughput report and STATS
+        self.sentences = 0
+        self.names = itertools.count(1)
+        self.handlers = {}      # task -> stream writer of the open tcp connections
+        # one thread does all the file writing, in the order it was asked for
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kml-writer")
+
+    #### VEHICLES ####
+
+    def vehicle(self, vehicle_id):
+        vehicle = self.vehicles.get(vehicle_id)
+        if vehicle is None:
+            vehicle = self.vehicles[vehicle_id] = Vehicle(vehicle_id)
+        return vehicle
+
+    def unique_id(self, vehicle_id):
+        """vehicle_id, or vehicle_id_2, _3, ... if a vehicle by that name is already sending"""
+        name, n = vehicle_id, 1
+        while name in self.vehicles:
+            n += 1
+            name = f"{vehicle_id}_{n}"
+        return name
+
+    def feed(self, vehicle, text):
+        lines, sentences = vehicle.lines, vehicle.sentences
+        vehicle.feed(text)
+        self.lines += vehicle.lines - lines
+        self.sentences += vehicle.sentences - sentences
+
+    def flush(self, vehicle, final=False):
+        """
+        writes the vehicle's kml and a summary line. What gets written is
+        copied now, the writing itself happens on the writer thread
+        """
+        if final:
+            vehicle.finish()
+        kml = None
+        if vehicle.live.fixes:
+            kml = vehicle.live.kml_writer(self.out / f"{safe_name(vehicle.id)}.kml")
+        line = json.dumps(vehicle.summary(final)) + "\n"
+
+        def write():
+            if kml is not None:
+                kml()
+            with open(self.out / "summaries.jsonl", "a") as f:
+                f.write(line)
+        self.writer.submit(write)
+
+    def stats(self):
+        return {"vehicles": len(self.vehicles), "lines": self.lines, "sentences": self.sentences}
+
+    def close(self, vehicle):
+        """the vehicle is gone: final flush and forget it (once, closing it again does nothing)"""
+        if self.vehicles.get(vehicle.id) is not vehicle:
+            return
+        del self.vehicles[vehicle.id]
+        if vehicle.udp is not None:
+            self.udp.pop(vehicle.udp, None)
+        self.flush(vehicle, final=True)
+
+    #### TCP ####
+
+    async def handle_tcp(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        vehicle = None
+        task = asyncio.current_task()
+        self.handlers[task] = writer
+        try:
+            first = await reader.readline()
+            text = first.decode("latin1")
+            if text.strip() == "STATS":
+                writer.write((json.dumps(self.stats()) + "\n").encode())
+                await writer.drain()
+                return
+            if text.startswith("ID "):
+                vehicle_id, text = text[3:].strip(), ""
+            else:
+                vehicle_id = f"{peer[0]}_{peer[1]}" if peer else f"tcp{next(self.names)}"
+            vehicle = self.vehicle(self.unique_id(vehicle_id))
+            if text:
+                self.feed(vehicle, text)
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.feed(vehicle, data.decode("latin1"))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.handlers.pop(task, None)
+            writer.close()
+            if vehicle is not None:
+                self.close(vehicle)
+
+    #### UDP ####
+
+    def datagram(self, data, addr):
+        text = data.decode("latin1")
+        if text.startswith("ID "):
+            name, _, text = text[3:].partition("\n")
+            if self.udp.get(addr) is None:
+                self.udp[addr] = self.unique_id(name.strip())
+        vehicle_id = self.udp.get(addr) or f"{addr[0]}_{addr[1]}"
+        vehicle = self.vehicle(vehicle_id)
+        vehicle.udp = addr
+        if text:
+            # a datagram is whole sentences, don't wait for a newline on the last one
+            self.feed(vehicle, text if text.endswith("\n") else text + "\n")
+
+    #### TIMERS ####
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_every)
+            now = time.monotonic()
+            for vehicle in list(self.vehicles.values()):
+                if vehicle.udp is not None and now - vehicle.last_seen > self.idle:
+                    self.close(vehicle)
+                elif vehicle.live.changed:
+                    self.flush(vehicle)
+
+    async def report_loop(self):
+        last, last_time = self.sentences, time.monotonic()
+        while True:
+            await asyncio.sleep(self.report_every)
+            now = time.monotonic()
+            rate = (self.sentences - last) / (now - last_time)
+            print(f"{len(self.vehicles)} vehicles, {rate:,.0f} sentences/s, {self.sentences:,} total", flush=True)
+            last, last_time = self.sentences, now
+
+    async def serve(self, host="0.0.0.0", port=PORT, udp=True):
+        loop = asyncio.get_running_loop()
+        tcp = await asyncio.start_server(self.handle_tcp, host, port, backlog=4096, limit=1 << 20)
+        transport = None
+        if udp:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: UDPProtocol(self), local_addr=(host, port))
+        print(f"Listening on {host}:{port} (tcp{' + udp' if udp else ''}), writing to {self.out}", flush=True)
+        timers = [asyncio.create_task(self.flush_loop()), asyncio.create_task(self.report_loop())]
+        try:
+            # SIGTERM (e.g. from systemd or docker stop) stops it the same way as ctrl-c
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, AttributeError):  # not on windows
+            pass
+        try:
+            await tcp.serve_forever()
+        finally:
+            tcp.close()
+            for task in timers:
+                task.cancel()
+            if transport is not None:
+                transport.close()
+            # the open connections end first: closing them makes their
+            # handlers see the end of the stream and give the vehicle its
+            # final flush on the way out
+            handlers = list(self.handlers.items())
+            for _, writer in handlers:
+                writer.close()
+            await asyncio.gather(*(task for task, _ in handlers), return_exceptions=True)
+            await tcp.wait_closed()
+            # then the udp vehicles
+            for vehicle in list(self.vehicles.values()):
+                self.close(vehicle)
+            self.writer.shutdown(wait=True)
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.datagram(data, addr)
+
+
+#### SIMULATED SENDER ####
+
+async def send_tcp(host, port, vehicle_id, lines, rate):
+    """streams lines over one connection, rate lines/s per vehicle (0 = as fast as possible)"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"ID {vehicle_id}\n".encode())
+    batch = max(1, int(rate // 10)) if rate else 200
+    for i in range(0, len(lines), batch):
+        writer.write("".join(lines[i:i+batch]).encode("latin1"))
+        await writer.drain()
+        await asyncio.sleep(batch / rate if rate else 0)
+    writer.close()
+    await writer.wait_closed()
+
+async def send_udp(host, port, vehicle_id, lines, rate):
+    """same over UDP, a few sentences per datagram"""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+    transport.sendto(f"ID {vehicle_id}\n".encode())
+    batch = 10
+    for i in range(0, len(lines), batch):
+        transport.sendto("".join(lines[i:i+batch]).encode("latin1"))
+        await asyncio.sleep(batch / rate if rate else 0.001)
+    transport.close()
+
+async def server_stats(host, port):
+    """the server's totals (see IngestServer.stats)"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"STATS\n")
+    line = await reader.readline()
+    writer.close()
+    await writer.wait_closed()
+    return json.loads(line)
+
+async def simulate(logs, host="127.0.0.1", port=PORT, vehicles=100, rate=None, udp=False, settle=1.0):
+    """
+    Sends the logs from `vehicles` concurrent simulated vehicles (vehicle i
+    replays log i % len(logs)), rate lines/s per vehicle (default UDP_RATE
+    over udp, as fast as possible over tcp). Returns (lines sent, lines the
+    server received, seconds); received is taken from the server's totals
+    settle seconds after the last line went out
+    """
+    if rate is None:
+        rate = UDP_RATE if udp else 0.0
+    texts = []
+    for log in logs:
+        with main.open_log(log) as f:
+            texts.append(list(itertools.islice(f, main.HEADER_LINES, None)))
+    send = send_udp if udp else send_tcp
+    before = await server_stats(host, port)
+    start = time.perf_counter()
+    await asyncio.gather(*(send(host, port, f"sim{i:05d}", texts[i % len(texts)], rate)
+                           for i in range(vehicles)))
+    seconds = time.perf_counter() - start
+    await asyncio.sleep(settle)
+    received = (await server_stats(host, port))["lines"] - before["lines"]
+    sent = sum(len(texts[i % len(texts)]) for i in range(vehicles))
+    return sent, received, seconds
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="NMEA ingestion server for many vehicles")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the server")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=PORT, help=f"tcp and udp port (default {PORT})")
+    serve.add_argument("--no-udp", action="store_true")
+    serve.add_argument("-o", "--output-dir", default="live_out")
+    serve.add_argument("--flush", type=float, default=FLUSH,
+                       help=f"seconds between kml/summary writes per vehicle (default {FLUSH:g})")
+    serve.add_argument("--idle", type=float, default=IDLE,
+                       help=f"seconds before a silent udp vehicle counts as gone (default {IDLE:g})")
+
+    sim = commands.add_parser("simulate", help="send the sample logs from many fake vehicles")
+    sim.add_argument("logs", nargs="*", help="logs to replay (default: the sample logs)")
+    sim.add_argument("--host", default="127.0.0.1")
+    sim.add_argument("--port", type=int, default=PORT)
+    sim.add_argument("--vehicles", type=int, default=100)
+    sim.add_argument("--rate", type=float,
+                     help=f"lines per second per vehicle, 0 = as fast as possible "
+                          f"(default: 0 over tcp, {UDP_RATE:g} over udp)")
+    sim.add_argument("--udp", action="store_true", help="send over udp instead of tcp")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = IngestServer(args.output_dir, args.flush, args.idle)
+        try:
+            asyncio.run(server.serve(args.host, args.port, not args.no_udp))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+    else:
+        logs = args.logs or sorted(Path(__file__).parent.joinpath("Some_Example_GPS_Files").glob("*.txt"))
+        sent, received, seconds = asyncio.run(simulate(logs, args.host, args.port, args.vehicles,
+                                                       args.rate, args.udp))
+        print(f"Sent {sent:,} lines from {args.vehicles} vehicles in {seconds:.1f}s ({sent / seconds:,.0f} lines/s)")
+        print(f"The server received {received:,} of them ({received / sent:.1%})")
+
+
+if __name__ == "__main__":
+    main_cli()
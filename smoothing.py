@@ -0,0 +1,179 @@
+"""
+Constant velocity Kalman filter for gps fixes.
+
+Raw fixes wander by a few meters even when the car is parked, which shows
+up as false left turns (noisy point to point bearings) and as speed spikes
+that break up stops. MotionFilter tracks position and velocity in local
+meters and blends every fix in by how much it can be trusted: the position
+by its hdop, the velocity from the RMC speed/course (doppler, much steadier
+than the positions). The fixes that come out have the smoothed position,
+speed and course in place of the raw ones, so the jump filter, stop and
+turn detection downstream just see a cleaner track.
+
+It also rejects jumps better than the max speed rule: a fix whose position
+is too far from where the car should be (by the filter's own uncertainty)
+is dropped. After a few in a row, or a long gap, the filter restarts at the
+new position instead (the gps really was somewhere else).
+
+The x (east) and y (north) axes are independent in this model, so each is
+a 2 state (position, velocity) filter worked out by hand: one pass, a few
+multiplications per fix.
+"""
+
+import math
+
+from geometry import R
+
+KNOTS_TO_MS = 1852 / 3600
+# meters per degree of latitude
+M_PER_DEG = R * math.pi / 180
+
+# gps position error per unit of hdop (meters), and when there is no hdop
+UERE = 4.0
+DEFAULT_POS_SIGMA = 5.0
+# doppler speed error (m/s)
+SPEED_SIGMA = 0.5
+# how hard a car accelerates/brakes/turns (m/s^2), the process noise
+ACCEL_SIGMA = 2.0
+# squared normalized distance a fix may be off before it counts as a jump
+# (chi-square with 2 degrees of freedom, 99.9%)
+GATE = 13.8
+# restart after this many rejected fixes in a row or this many seconds without one
+MAX_REJECTS = 5
+MAX_GAP = 10.0
+
+
+class _Axis:
+    """position/velocity filter for one axis"""
+    __slots__ = ("p", "v", "p00", "p01", "p11")
+
+    def __init__(self, p, v, pos_var, vel_var):
+        self.p, self.v = p, v
+        self.p00, self.p01, self.p11 = pos_var, 0.0, vel_var
+
+    def predict(self, dt, q):
+        self.p += self.v * dt
+        dt2 = dt * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt2 * dt2 / 4
+        self.p01 += dt * self.p11 + q * dt2 * dt / 2
+        self.p11 += q * dt2
+
+    def innovation(self, z, var):
+        """(measured - predicted position, its variance)"""
+        return z - self.p, self.p00 + var
+
+    def update_position(self, z, var):
+        s = self.p00 + var
+        k0, k1 = self.p00 / s, self.p01 / s
+        y = z - self.p
+        self.p += k0 * y
+        self.v += k1 * y
+        self.p11 -= k1 * self.p01
+        self.p00 -= k0 * self.p00
+        self.p01 -= k0 * self.p01
+
+    def update_velocity(self, z, var):
+        s = self.p11 + var
+        k0, k1 = self.p01 / s, self.p11 / s
+        y = z - self.v
+        self.p += k0 * y
+        self.v += k1 * y
+        self.p00 -= k0 * self.p01
+        self.p01 -= k0 * self.p11
+        self.p11 -= k1 * self.p11
+
+
+class MotionFilter:
+    """
+    Usage:
+        kf = MotionFilter()
+        for fix in fixes:
+            smooth = kf.update(fix)     # None if the fix was rejected as a jump
+    """
+
+    def __init__(self, accel_sigma=ACCEL_SIGMA, gate=GATE):
+        self.q = accel_sigma ** 2
+        self.gate = gate
+        self.origin = None      # (lat, lon, meters per degree of lon) of the local x/y plane
+        self.x = self.y = None
+        self.time = None
+        self.rejects = 0
+        self.rejected = 0       # total, for reporting
+
+    def _measure(self, fix):
+        """(x, y, vx, vy, position variance) of a fix in local meters"""
+        lat0, lon0, m_per_lon = self.origin
+        x = (fix["longitude"] - lon0) * m_per_lon
+        y = (fix["latitude"] - lat0) * M_PER_DEG
+        speed = fix["speed"] * KNOTS_TO_MS
+        course = math.radians(fix["course"])
+        hdop = fix.get("hdop")
+        sigma = hdop * UERE if hdop and not math.isnan(hdop) else DEFAULT_POS_SIGMA
+        return x, y, speed * math.sin(course), speed * math.cos(course), sigma * sigma
+
+    def _start(self, fix):
+        if self.origin is None:
+            lat = fix["latitude"]
+            self.origin = (lat, fix["longitude"], M_PER_DEG * math.cos(math.radians(lat)))
+        x, y, vx, vy, pos_var = self._measure(fix)
+        vel_var = SPEED_SIGMA ** 2
+        self.x = _Axis(x, vx, pos_var, vel_var)
+        self.y = _Axis(y, vy, pos_var, vel_var)
+        self.time = fix["time"]
+        self.rejects = 0
+
+    def update(self, fix):
+        """
+        takes the next raw fix, returns a copy with the smoothed latitude,
+        longitude, speed (knots) and course, or None if it was rejected
+        """
+        dt = fix["time"] - self.time if self.time is not None else None
+        if dt is None or dt > MAX_GAP or self.rejects >= MAX_REJECTS:
+            self._start(fix)
+        elif dt <= 0:
+            # duplicate or out of order time
+            self.rejected += 1
+            return None
+        else:
+            x, y, vx, vy, pos_var = self._measure(fix)
+            self.x.predict(dt, self.q)
+            self.y.predict(dt, self.q)
+            ix, sx = self.x.innovation(x, pos_var)
+            iy, sy = self.y.innovation(y, pos_var)
+            if ix * ix / sx + iy * iy / sy > self.gate:
+                # too far from where the car should be, skip it and carry
+                # on from the prediction
+                self.rejects += 1
+                self.rejected += 1
+                self.time = fix["time"]
+                return None
+            self.rejects = 0
+            vel_var = SPEED_SIGMA ** 2
+            for axis, z, v in ((self.x, x, vx), (self.y, y, vy)):
+                axis.update_position(z, pos_var)
+                axis.update_velocity(v, vel_var)
+            self.time = fix["time"]
+
+        lat0, lon0, m_per_lon = self.origin
+        smooth = dict(fix)
+        smooth["latitude"] = lat0 + self.y.p / M_PER_DEG
+        smooth["longitude"] = lon0 + self.x.p / m_per_lon
+        smooth["speed"] = math.hypot(self.x.v, self.y.v) / KNOTS_TO_MS
+        smooth["course"] = math.degrees(math.atan2(self.x.v, self.y.v)) % 360
+        return smooth
+
+
+def smooth_fixes(fixes, accel_sigma=ACCEL_SIGMA, gate=GATE, counts=None):
+    """
+    pipeline stage: the fixes with smoothed position/speed/course, jumps
+    dropped. counts (a Counter) gets the number rejected at the end
+    """
+    kf = MotionFilter(accel_sigma, gate)
+    try:
+        for fix in fixes:
+            smooth = kf.update(fix)
+            if smooth is not None:
+                yield smooth
+    finally:
+        if counts is not None:
+            counts["smooth_rejected"] += kf.rejected
@@ -0,0 +1,98 @@
+"""
+Spatial hash grid for snapping markers together.
+
+The world is cut into cells about `radius` meters on a side. A point only
+has to be compared with the clusters in its own cell and the 8 around it, so
+finding the cluster a stop or left turn belongs to is O(1) no matter how
+many markers there already are.
+"""
+
+import math
+
+from geometry import haversine_m
+
+# meters per degree of latitude
+M_PER_DEG = 111320.0
+
+
+class Cluster:
+    """
+    Markers snapped to one spot. lat/lon is where the first one was seen
+    (so the cluster never moves to another cell), count is how many were
+    snapped to it and total adds up their values (e.g. seconds stopped)
+    """
+    __slots__ = ("lat", "lon", "count", "total")
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+        self.count = 0
+        self.total = 0.0
+
+    def __repr__(self):
+        return f"Cluster({self.lat:.6f}, {self.lon:.6f}, count={self.count}, total={self.total})"
+
+
+class GridIndex:
+    """
+    Usage:
+        grid = GridIndex(20)           # points within 20 m are the same spot
+        grid.add(lat, lon, seconds)    # -> the cluster it was snapped to
+        grid.clusters                  # every cluster, in the order they were made
+    """
+
+    def __init__(self, radius_m):
+        self.radius = radius_m
+        # cell height in degrees of latitude
+        self.dlat = radius_m / M_PER_DEG
+        self.cells = {}
+        self.clusters = []
+
+    def _dlon(self, row):
+        """cell width in degrees of longitude for a row, so cells stay ~radius meters wide"""
+        lat = (row + 0.5) * self.dlat
+        return self.dlat / max(math.cos(math.radians(lat)), 0.01)
+
+    def cell(self, lat, lon):
+        """(row, col) key of the cell holding a point"""
+        row = math.floor(lat / self.dlat)
+        return row, math.floor(lon / self._dlon(row))
+
+    def nearest(self, lat, lon):
+        """closest cluster within radius meters of the point, or None"""
+        best = None
+        best_dist = self.radius
+        row = math.floor(lat / self.dlat)
+        for r in (row - 1, row, row + 1):
+            col = math.floor(lon / self._dlon(r))
+            for c in (col - 1, col, col + 1):
+                for cluster in self.cells.get((r, c), ()):
+                    dist = haversine_m(lat, lon, cluster.lat, cluster.lon)
+                    if dist <= best_dist:
+                        best, best_dist = cluster, dist
+        return best
+
+    def add(self, lat, lon, value=0.0):
+        """snaps a point to the nearest cluster (making a new one if none is close) and returns it"""
+        cluster = self.nearest(lat, lon)
+        if cluster is None:
+            cluster = Cluster(lat, lon)
+            self.cells.setdefault(self.cell(lat, lon), []).append(cluster)
+            self.clusters.append(cluster)
+        cluster.count += 1
+        cluster.total += value
+        return cluster
+
+    def __len__(self):
+        return len(self.clusters)
+
+
+def cluster_points(points, radius_m):
+    """
+    points: (lat, lon) or (lat, lon, value) tuples
+    returns the clusters after snapping every point within radius_m meters together
+    """
+    grid = GridIndex(radius_m)
+    for point in points:
+        grid.add(point[0], point[1], point[2] if len(point) > 2 else 0.0)
+    return grid.clusters
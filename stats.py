@@ -0,0 +1,209 @@
+"""
+Per run instrumentation: stage timers, counters and optional profiling.
+
+A RunStats is passed down the pipeline (read_track, makeKMLFile). The
+stages time themselves with stats.stage(name), and the parser, GGA merge
+and jump filter add up what they dropped in stats.counts:
+
+    lines               lines read after the header
+    bad_checksum        lines with no sentence that passes the checksum
+    burped              lines holding more than one sentence (see split_sentences)
+    burped_recovered    complete sentences pulled out of those
+    void                RMC with status V
+    bad_rmc, bad_gga    sentences that can't be read (too short, bad numbers)
+    no_fix              GGA with fix quality 0
+    out_of_range        RMC with an impossible lat/lon
+    low_quality         fixes dropped for hdop/satellites (good_fix)
+    fixes               fixes in the parsed track
+    jumps, duplicate_time   fixes dropped by the jump filter (see analyzer.py)
+    smooth_rejected     fixes the Kalman filter rejected (--smooth)
+
+The parse counts are saved with the track in the cache, so a run that
+got the track from the cache reports the counts of the run that parsed it
+(record()["cache"] says which it was).
+
+Nothing is timed or counted when no RunStats is given, so the normal path
+costs the same as before. record() gives one json-able dict per run, which
+main.py --stats appends to a jsonl file for tracking throughput and data
+quality over time.
+"""
+
+from collections import Counter
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+# profilers --profile can turn on
+PROFILERS = ("cprofile", "tracemalloc")
+# allocation sites / functions kept in the record and printed
+PROFILE_TOP = 15
+
+
+class RunStats:
+    """
+    Usage:
+        stats = RunStats("trip.txt", profile="cprofile", profile_path="trip.prof")
+        with stats.run():
+            track = read_track("trip.txt", stats=stats)
+            summary = makeKMLFile(track, "trip.kml", stats=stats)
+        stats.write("stats.jsonl", summary)
+    """
+
+    def __init__(self, log_path, output=None, profile=None, profile_path=None):
+        if profile not in (None,) + PROFILERS:
+            raise ValueError(f"unknown profiler {profile!r}, use one of {', '.join(PROFILERS)}")
+        self.log = str(log_path)
+        self.output = str(output) if output is not None else None
+        self.profile = profile
+        self.profile_path = profile_path
+        self.started = time.time()
+        self.seconds = 0.0
+        self.stages = {}            # stage name -> seconds, in the order they finished
+        self._inner = []            # seconds spent in nested stages, per open stage
+        self.counts = Counter()
+        self.cache = None           # "hit", "miss" or "off" once read_track ran
+        self.profile_info = None
+        self.error = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        times the block; a stage that runs more than once adds up. Stages
+        can nest, the time of the ones inside is left out of the outer one
+        so the stages add up to the total
+        """
+        self._inner.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - self._inner.pop()
+            if self._inner:
+                self._inner[-1] += elapsed
+
+    @contextlib.contextmanager
+    def run(self):
+        """the whole run: total time, and the profiler if one was asked for"""
+        profiler = None
+        if self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profile == "tracemalloc":
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._cprofile_done(profiler)
+            elif self.profile == "tracemalloc":
+                self._tracemalloc_done()
+
+    def _cprofile_done(self, profiler):
+        if self.profile_path:
+            profiler.dump_stats(self.profile_path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        self.profile_info = {"kind": "cprofile", "path": self.profile_path and str(self.profile_path),
+                             "report": out.getvalue()}
+
+    def _tracemalloc_done(self):
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+        top = snapshot.statistics("lineno")[:PROFILE_TOP]
+        tracemalloc.stop()
+        self.profile_info = {
+            "kind": "tracemalloc",
+            "peak_bytes": peak,
+            # what is still allocated at the end, by line
+            "top": [{"where": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+                    for stat in top],
+        }
+
+    def record(self, summary=None):
+        """one json-able dict for this run"""
+        try:
+            size = os.path.getsize(self.log)
+        except OSError:
+            size = None
+        fixes = self.counts.get("fixes")
+        rec = {
+            "log": self.log,
+            "output": self.output,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "seconds": round(self.seconds, 6),
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "cache": self.cache,
+            "bytes": size,
+            "counts": dict(self.counts),
+        }
+        if self.seconds > 0:
+            if size is not None:
+                rec["mb_per_s"] = round(size / 1e6 / self.seconds, 3)
+            if fixes:
+                rec["fixes_per_s"] = round(fixes / self.seconds, 1)
+        if summary is not None:
+            rec["trip"] = {
+                "duration_s": round(summary["duration"].total_seconds(), 3),
+                "estimated": summary["estimated"],
+                "stops": summary["stops"],
+                "left_turns": summary["left_turns"],
+                "points": summary["points"],
+                "route_points": summary["route_points"],
+            }
+        if self.profile_info is not None:
+            rec["profile"] = {k: v for k, v in self.profile_info.items() if k != "report"}
+        if self.error is not None:
+            rec["error"] = self.error
+        return rec
+
+    def write(self, path, summary=None):
+        """appends the record as one json line"""
+        append_record(path, self.record(summary))
+
+    def report(self):
+        """short human readable version for the single log mode"""
+        stages = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.stages.items())
+        lines = [f"Time: {self.seconds:.3f}s ({stages})"]
+        counts = self.counts
+        dropped = {k: v for k, v in sorted(counts.items())
+                   if k not in ("lines", "fixes", "burped", "burped_recovered") and v}
+        if counts.get("lines"):
+            cached = " (track from the cache)" if self.cache == "hit" else ""
+            lines.append(f"Lines: {counts['lines']}, fixes: {counts.get('fixes', 0)}, burped lines: "
+                         f"{counts.get('burped', 0)} ({counts.get('burped_recovered', 0)} sentences recovered)"
+                         f"{cached}")
+        elif self.cache == "hit":
+            lines.append(f"Track from the cache, fixes: {counts.get('fixes', 0)}")
+        if dropped:
+            lines.append("Dropped: " + ", ".join(f"{k} {v}" for k, v in dropped.items()))
+        if self.profile_info is not None:
+            if self.profile_info["kind"] == "cprofile":
+                if self.profile_info["path"]:
+                    lines.append(f"Profile saved to {self.profile_info['path']}")
+                lines.append(self.profile_info["report"].strip())
+            else:
+                lines.append(f"Peak traced memory: {self.profile_info['peak_bytes'] / 1e6:.1f} MB, "
+                             f"still allocated at the end:")
+                lines += [f"  {site['bytes'] / 1e3:8.1f} kB  {site['where']}" for site in self.profile_info["top"]]
+        return "\n".join(lines)
+
+
+def stage(stats, name):
+    """stats.stage(name), or a no-op when there is no RunStats"""
+    return stats.stage(name) if stats is not None else contextlib.nullcontext()
+
+
+def append_record(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
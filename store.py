@@ -0,0 +1,210 @@
+"""
+Persistent stats across trips, kept in a local SQLite file.
+
+Every ingested log adds one row to `trips` (times, counts, start/end place),
+or one per trip when it was split into trips (main.py --split/--trip-files),
+and adds its stop and left turn markers to `cells`, which keeps running
+totals per ~CELL_SIZE meter grid cell (roughly one intersection). Logs are
+recognised by a hash of their contents (decompressed, so log.txt and
+log.txt.gz are the same log), so ingesting the same log twice does nothing
+and new logs only add to the totals.
+
+Reports are plain queries on the file:
+    python store.py gps_stats.sqlite trips
+    python store.py gps_stats.sqlite routes
+    python store.py gps_stats.sqlite intersections --kind stop --top 20
+
+Logs get into the store through main.py --db gps_stats.sqlite
+"""
+
+import argparse
+import bz2
+import calendar
+import gzip
+import hashlib
+import lzma
+from pathlib import Path
+import sqlite3
+import time
+
+from spatial import GridIndex
+
+# size of the grid cells intersection stats are kept in (meters)
+CELL_SIZE = 25
+GRID = GridIndex(CELL_SIZE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id INTEGER PRIMARY KEY,
+    log TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    trip INTEGER,           -- trip number in the log when it was split, NULL for a whole log
+    start_time REAL,
+    end_time REAL,
+    duration REAL,          -- seconds, includes the estimate if the log started/ended moving
+    estimated INTEGER,
+    start_place TEXT,
+    end_place TEXT,
+    points INTEGER,
+    stops INTEGER,
+    stop_seconds REAL,
+    left_turns INTEGER,
+    ingested REAL,
+    UNIQUE (hash, trip)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    row INTEGER NOT NULL,
+    col INTEGER NOT NULL,
+    kind TEXT NOT NULL,     -- 'stop' or 'left'
+    count INTEGER NOT NULL DEFAULT 0,
+    total REAL NOT NULL DEFAULT 0,      -- seconds stopped for stops
+    lat_sum REAL NOT NULL DEFAULT 0,
+    lon_sum REAL NOT NULL DEFAULT 0,
+    trips INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (row, col, kind)
+);
+"""
+
+
+def utc_epoch(dt):
+    """naive UTC datetime (as in the makeKMLFile summary) -> unix time"""
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+# compressed logs are hashed decompressed, so a log and its .gz are the same
+# log (the same extensions as main.OPENERS, main imports this module so it
+# can't be imported from here)
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def file_hash(path):
+    """sha1 of a log's contents (decompressed for .gz/.bz2/.xz), read in chunks"""
+    digest = hashlib.sha1()
+    opener = OPENERS.get(Path(path).suffix.lower(), open)
+    with opener(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TripStore:
+    """
+    Usage:
+        with TripStore("gps_stats.sqlite") as store:
+            store.ingest(log_path, summary)     # summary from makeKMLFile, -> trips added
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.db.close()
+
+    def has(self, digest):
+        return self.db.execute("SELECT 1 FROM trips WHERE hash = ?", (digest,)).fetchone() is not None
+
+    def ingest(self, log_path, summary, digest=None):
+        """
+        adds the log's trip and its markers, or every trip in summary["trips"]
+        when the log was split. returns the number of trips added, 0 (and
+        changes nothing) if this log was already ingested
+        """
+        digest = digest or file_hash(log_path)
+        if self.has(digest):
+            return 0
+
+        trips = summary.get("trips")
+        numbered = enumerate(trips, start=1) if trips is not None else [(None, summary)]
+        with self.db:
+            for number, trip in numbered:
+                self._add_trip(log_path, digest, number, trip)
+        return len(trips) if trips is not None else 1
+
+    def _add_trip(self, log_path, digest, number, summary):
+        self.db.execute(
+            "INSERT INTO trips (log, hash, trip, start_time, end_time, duration, estimated, start_place,"
+            " end_place, points, stops, stop_seconds, left_turns, ingested)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(log_path), digest, number, utc_epoch(summary["start"]), utc_epoch(summary["end"]),
+             summary["duration"].total_seconds(), int(summary["estimated"]),
+             summary.get("start_place"), summary.get("end_place"), summary["points"],
+             sum(count for _, _, count, _ in summary["stop_markers"]),
+             sum(total for _, _, _, total in summary["stop_markers"]),
+             sum(count for _, _, count, _ in summary["turn_markers"]), time.time()))
+        self._add_cells("stop", summary["stop_markers"])
+        self._add_cells("left", summary["turn_markers"])
+
+    def _add_cells(self, kind, markers):
+        """adds one trip's markers, summed per cell first so a cell counts the trip once"""
+        cells = {}
+        for lat, lon, count, total in markers:
+            cell = cells.setdefault(GRID.cell(lat, lon), [0, 0.0, 0.0, 0.0])
+            cell[0] += count
+            cell[1] += total
+            cell[2] += lat * count
+            cell[3] += lon * count
+        self.db.executemany(
+            "INSERT INTO cells (row, col, kind, count, total, lat_sum, lon_sum, trips)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 1)"
+            " ON CONFLICT (row, col, kind) DO UPDATE SET count = count + excluded.count,"
+            " total = total + excluded.total, lat_sum = lat_sum + excluded.lat_sum,"
+            " lon_sum = lon_sum + excluded.lon_sum, trips = trips + 1",
+            [(row, col, kind, *sums) for (row, col), sums in cells.items()])
+
+    #### REPORTS ####
+
+    def trips(self):
+        return self.db.execute(
+            "SELECT log, trip, datetime(start_time, 'unixepoch'), duration, start_place, end_place,"
+            " stops, stop_seconds, left_turns FROM trips ORDER BY start_time").fetchall()
+
+    def routes(self):
+        """per start -> end place: trips, average duration, stops, stop time and left turns"""
+        return self.db.execute(
+            "SELECT coalesce(start_place, '?'), coalesce(end_place, '?'), count(*), avg(duration),"
+            " avg(stops), avg(stop_seconds), avg(left_turns) FROM trips"
+            " GROUP BY start_place, end_place ORDER BY count(*) DESC").fetchall()
+
+    def intersections(self, kind="stop", top=20):
+        """busiest cells: (lat, lon, count, trips, average seconds per stop)"""
+        return self.db.execute(
+            "SELECT lat_sum / count, lon_sum / count, count, trips, total / count FROM cells"
+            " WHERE kind = ? ORDER BY count DESC, total DESC LIMIT ?", (kind, top)).fetchall()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Reports on the trips ingested with main.py --db")
+    parser.add_argument("db", help="sqlite file")
+    parser.add_argument("report", choices=("trips", "routes", "intersections"))
+    parser.add_argument("--kind", choices=("stop", "left"), default="stop",
+                        help="intersections report: stops or left turns")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    with TripStore(args.db) as store:
+        if args.report == "trips":
+            for log, trip, start, duration, a, b, stops, stop_s, lefts in store.trips():
+                print(f"{start}  {a or '?'} -> {b or '?'}  {duration / 60:6.1f} min  "
+                      f"stops {stops} ({stop_s:.0f} s)  left turns {lefts}  {log}"
+                      + (f" (trip {trip})" if trip else ""))
+        elif args.report == "routes":
+            for a, b, n, duration, stops, stop_s, lefts in store.routes():
+                print(f"{a} -> {b}: {n} trips, avg {duration / 60:.1f} min, "
+                      f"avg stops {stops:.1f} ({stop_s:.0f} s), avg left turns {lefts:.1f}")
+        else:
+            for lat, lon, count, trips, avg in store.intersections(args.kind, args.top):
+                line = f"{lat:.6f},{lon:.6f}: {count} {'stops' if args.kind == 'stop' else 'left turns'} over {trips} trips"
+                if args.kind == "stop":
+                    line += f", avg {avg:.0f} s per stop"
+                print(line)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,262 @@
+"""
+Threshold sweep: how many stops, left turns and how long a trip every
+combination of the detection settings gives, on every log at once.
+
+Each log is parsed once (through the track cache) and kept as a Track. The
+jump filter and the segment distances run once per max speed, the turn
+vertices and their bearing changes once per turn step, and the slow
+stretches once per stop speed (geometry.py's whole-track helpers), so each
+extra config only redoes the cheap part: picking the turns/stops by the
+thresholds and trimming them to the trip. The rules are TrackAnalyzer's,
+so the numbers are the ones makeKMLFile would give with those settings.
+
+    python sweep.py --threshold-deg 10,20,30 --turn-step 5,8 --stop-speed 0.5,1 --min-stop 1,3
+    python sweep.py Some_Example_GPS_Files/2025_05_01__145019_gps_file.txt --moving 1,2,3 --per-log
+"""
+
+import argparse
+import csv
+from datetime import timedelta
+from itertools import compress
+import itertools
+from pathlib import Path
+import sys
+
+from geometry import bearing_deltas, jump_mask, step_vertices, stop_runs, track_geometry, turn_runs
+import main
+from spatial import GridIndex
+
+# settings that can be swept, with makeKMLFile's values as the default
+PARAMS = {
+    "threshold_deg": main.TURN_THRESHOLD,
+    "turn_step": main.TURN_STEP,
+    "moving": main.MOVING,
+    "stop_speed": main.STOP_SPEED,
+    "min_stop": main.MIN_STOP,
+    "max_speed": 97.0,
+}
+
+
+class SweepTrack:
+    """
+    one log's jump filtered track plus the work every config shares
+
+    Usage:
+        prepared = SweepTrack(track, max_speed=97)
+        prepared.evaluate(config)     # makeKMLFile's counts for one config
+    """
+
+    def __init__(self, track, max_speed):
+        self.track = track
+        keep = jump_mask(track.latitude, track.longitude, track.time, max_speed)
+        # index in track of every fix the jump filter kept
+        self.kept = list(compress(range(len(track)), keep))
+        self.lats = list(compress(track.latitude, keep))
+        self.lons = list(compress(track.longitude, keep))
+        self.times = list(compress(track.time, keep))
+        self.speeds = list(compress(track.speed, keep))
+        self.dist, _ = track_geometry(self.lats, self.lons)
+        self._bounds = {}
+        self._runs = {}
+        self._vertices = {}
+        self._turns = {}
+
+    def bounds(self, moving):
+        """(start, first moving, last moving, end) of the trip, None if the car never moved"""
+        if moving not in self._bounds:
+            movers = [i for i, speed in enumerate(self.speeds) if speed > moving]
+            if not movers:
+                self._bounds[moving] = None
+            else:
+                first, last = movers[0], movers[-1]
+                self._bounds[moving] = (max(first - 1, 0), first, last, min(last + 1, len(self.speeds) - 1))
+        return self._bounds[moving]
+
+    def runs(self, stop_speed):
+        """every slow stretch that ended, whatever its length"""
+        if stop_speed not in self._runs:
+            self._runs[stop_speed] = stop_runs(self.speeds, self.times, stop_speed, 0.0)
+        return self._runs[stop_speed]
+
+    def vertices(self, turn_step, start, first_moving):
+        """
+        the turn vertices and the bearing change at each, from the trip
+        start on (the turn rule starts there, so this is per start too, which
+        only changes with moving)
+        """
+        key = (turn_step, start)
+        if key not in self._vertices:
+            vertices = step_vertices(self.lats, self.lons, turn_step, start, first_moving + 1, self.dist)
+            _, bearing = track_geometry([self.lats[v] for v in vertices], [self.lons[v] for v in vertices])
+            self._vertices[key] = (vertices, bearing_deltas(bearing))
+        return self._vertices[key]
+
+    def turns(self, turn_step, start, first_moving, threshold_deg):
+        """(vertex of the marker, index the turn ended at or None) of every left turn"""
+        key = (turn_step, start, threshold_deg)
+        if key not in self._turns:
+            vertices, deltas = self.vertices(turn_step, start, first_moving)
+            turns = []
+            # delta k is the swing at vertex k+1, known once vertex k+2 is
+            # reached. A run is over at the vertex that shows the next delta isn't one
+            for a, b in turn_runs(deltas, "left", threshold_deg):
+                ended = vertices[b + 3] if b + 1 < len(deltas) else None
+                turns.append((vertices[a + 1 + (b - a + 1) // 2], ended))
+            self._turns[key] = turns
+        return self._turns[key]
+
+    def evaluate(self, config):
+        """makeKMLFile's counts for one config, ValueError if the car never moved"""
+        bounds = self.bounds(config["moving"])
+        if bounds is None:
+            raise ValueError("the car never moved")
+        start, first_moving, last_moving, end = bounds
+        lats, lons, times = self.lats, self.lons, self.times
+
+        # a turn counts once the car moves past the point it ended at, one
+        # still going at the end of the log if its last vertex is in the trip
+        turns = GridIndex(main.TURN_SPACING)
+        vertices, _ = self.vertices(config["turn_step"], start, first_moving)
+        for mid, ended in self.turns(config["turn_step"], start, first_moving, config["threshold_deg"]):
+            if ended - 1 <= last_moving if ended is not None else vertices[-1] <= end:
+                turns.add(lats[mid], lons[mid])
+
+        # a stop has to end (the car moves again) inside the trip. One that
+        # was already going at the trip start counts from the start
+        stops = GridIndex(main.STOP_RADIUS)
+        stop_seconds = 0.0
+        for a, b in self.runs(config["stop_speed"]):
+            a = max(a, start)
+            if b < a or b > last_moving:
+                continue
+            seconds = times[b] - times[a]
+            if seconds >= config["min_stop"]:
+                mid = a + (b - a + 1) // 2
+                stops.add(lats[mid], lons[mid], seconds)
+                stop_seconds += seconds
+
+        _, _, duration, estimated = main.trip_times(self.track[self.kept[start]], self.track[self.kept[end]],
+                                                    config["moving"])
+        return {
+            "left_turns": len(turns),
+            "stops": len(stops),
+            "stop_seconds": stop_seconds,
+            "duration": duration,
+            "estimated": estimated,
+        }
+
+
+def configs(grid):
+    """every combination of the grid values, as dicts"""
+    names = list(PARAMS)
+    values = [grid.get(name) or [PARAMS[name]] for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def sweep(logs, grid, cache_dir=main.CACHE_DIR):
+    """
+    logs: log paths, grid: {param: [values]} (missing params keep their default)
+    returns one row per config: the config, the totals over all logs, and
+    the per log results ({"error": why} for a log without a trip)
+    """
+    names = [Path(log).name for log in logs]
+    tracks = {}
+    failed = {}
+    for name, log in zip(names, logs):
+        try:
+            tracks[name] = main.read_track(log, cache_dir)
+        except ValueError as e:
+            # no good fix in the whole log, every row shows it as failed
+            failed[name] = {"error": str(e)}
+    prepared = {}
+    rows = []
+    for config in configs(grid):
+        max_speed = config["max_speed"]
+        if max_speed not in prepared:
+            prepared[max_speed] = {name: SweepTrack(track, max_speed) for name, track in tracks.items()}
+        per_log = {}
+        for name in names:
+            try:
+                per_log[name] = failed.get(name) or prepared[max_speed][name].evaluate(config)
+            except ValueError as e:
+                per_log[name] = {"error": str(e)}
+        done = [r for r in per_log.values() if "error" not in r]
+        rows.append({
+            "config": config,
+            "left_turns": sum(r["left_turns"] for r in done),
+            "stops": sum(r["stops"] for r in done),
+            "stop_seconds": sum(r["stop_seconds"] for r in done),
+            "duration": sum((r["duration"] for r in done), timedelta(0)),
+            "estimated": sum(r["estimated"] for r in done),
+            "failed": len(per_log) - len(done),
+            "logs": per_log,
+        })
+    return rows
+
+
+def print_table(rows, per_log=False, out=sys.stdout):
+    swept = [name for name in PARAMS if len({row["config"][name] for row in rows}) > 1] or list(PARAMS)[:1]
+    header = swept + ["left_turns", "stops", "stop_s", "duration", "estimated"]
+    widths = [max(len(h), 9) for h in header]
+    print("  ".join(h.rjust(w) for h, w in zip(header, widths)), file=out)
+
+    def line(config, result, indent=""):
+        cells = [f"{config[name]:g}" for name in swept]
+        cells += [str(result["left_turns"]), str(result["stops"]), f"{result['stop_seconds']:.0f}",
+                  str(timedelta(seconds=round(result["duration"].total_seconds()))), str(int(result["estimated"]))]
+        print(indent + "  ".join(c.rjust(w) for c, w in zip(cells, widths)), file=out)
+
+    for row in rows:
+        line(row["config"], row)
+        if per_log:
+            for name, result in row["logs"].items():
+                if "error" in result:
+                    print(f"    {name}: {result['error']}", file=out)
+                else:
+                    print(f"    {name}", file=out)
+                    line(row["config"], result, "    ")
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(PARAMS) + ["log", "left_turns", "stops", "stop_seconds", "duration_s", "estimated"])
+        for row in rows:
+            for name, result in row["logs"].items():
+                if "error" in result:
+                    continue
+                writer.writerow([row["config"][p] for p in PARAMS] +
+                                [name, result["left_turns"], result["stops"], round(result["stop_seconds"], 2),
+                                 round(result["duration"].total_seconds(), 2), int(result["estimated"])])
+
+
+def floats(text):
+    return [float(value) for value in text.split(",")]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare detection settings on already parsed logs")
+    parser.add_argument("paths", nargs="*", help="logs, directories or globs (default: the sample logs)")
+    for name, default in PARAMS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=floats, metavar="V1,V2,...",
+                            help=f"values to try (default {default:g})")
+    parser.add_argument("--per-log", action="store_true", help="also show every log's numbers")
+    parser.add_argument("--csv", metavar="PATH", help="write the per log results as csv")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the parsed track cache")
+    args = parser.parse_args()
+
+    logs = main.collect_logs(args.paths or [Path(__file__).parent / "Some_Example_GPS_Files"])
+    if not logs:
+        print("No gps files found. Try again.")
+        return
+    grid = {name: getattr(args, name) for name in PARAMS if getattr(args, name)}
+    rows = sweep(logs, grid, None if args.no_cache else main.CACHE_DIR)
+    print(f"{len(rows)} configs x {len(logs)} logs")
+    print_table(rows, args.per_log)
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"Results saved to {args.csv}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,188 @@
+"""
+TrackAnalyzer (one pass, a fix at a time) against a plain whole-track
+version of the same rules written out below: jump filter, trim to the
+motion, stops, left turns and the simplified route.
+
+    python -m pytest -q
+"""
+
+from pathlib import Path
+
+import pytest
+
+import analyzer
+from bench import generate_log
+from geometry import degree_turn, haversine_m, signed_bearing_delta, simplify
+import main
+
+SAMPLES = sorted((Path(__file__).parent / "Some_Example_GPS_Files").glob("*.txt"))
+
+
+def reference(fixes, max_speed=97, stop_speed=main.STOP_SPEED, min_stop=main.MIN_STOP, moving=main.MOVING,
+              threshold_deg=main.TURN_THRESHOLD, turn_step=main.TURN_STEP, tolerance=2.0, window=2000):
+    """the analysis on the whole list of fixes at once"""
+    def pos(i):
+        return kept[i]["latitude"], kept[i]["longitude"]
+
+    # jump filter: same time as the last kept fix, or faster than max_speed to get to
+    kept = []
+    for fix in fixes:
+        if kept:
+            dt = fix["time"] - kept[-1]["time"]
+            if dt == 0 or haversine_m(*pos(-1), fix["latitude"], fix["longitude"]) / dt > max_speed:
+                continue
+        kept.append(fix)
+
+    # the trip runs from right before the first moving fix to right after the last one
+    movers = [i for i, fix in enumerate(kept) if fix["speed"] > moving]
+    first_moving, last_moving = movers[0], movers[-1]
+    start = max(first_moving - 1, 0)
+    end = min(last_moving + 1, len(kept) - 1)
+
+    # stops: runs of slow fixes in the trip that the car drove away from
+    stops = []
+    i = start
+    while i < len(kept):
+        if kept[i]["speed"] >= stop_speed:
+            i += 1
+            continue
+        j = i
+        while j + 1 < len(kept) and kept[j + 1]["speed"] < stop_speed:
+            j += 1
+        seconds = kept[j]["time"] - kept[i]["time"]
+        if j + 1 < len(kept) and j <= last_moving and seconds >= min_stop:
+            stops.append((*pos(i + (j - i + 1) // 2), seconds))
+        i = j + 1
+
+    # left turns: bearings between points turn_step apart, a run of left
+    # swings is one turn at its middle point
+    turns = []
+    vertex, bearing, run = start, None, []
+    for i in range(first_moving + 1, len(kept)):
+        if haversine_m(*pos(vertex), *pos(i)) < turn_step:
+            continue
+        new = degree_turn(pos(vertex), pos(i))
+        if bearing is not None and signed_bearing_delta(bearing, new) < -threshold_deg:
+            run.append(vertex)
+        elif run:
+            if i - 1 <= last_moving:
+                turns.append(pos(run[len(run) // 2]))
+            run = []
+        vertex, bearing = i, new
+    if run and vertex <= end:
+        turns.append(pos(run[len(run) // 2]))
+
+    # route: of the fixes in a row that aren't moving only the first and last
+    trip = kept[start:end + 1]
+    standing = [fix["speed"] <= moving for fix in trip]
+    route = [fix for k, fix in enumerate(trip)
+             if not (0 < k < len(trip) - 1 and standing[k - 1] and standing[k] and standing[k + 1])]
+    lats = [fix["latitude"] for fix in route]
+    lons = [fix["longitude"] for fix in route]
+    keep = simplify(lats, lons, tolerance, window) if tolerance > 0 else range(len(route))
+    return {
+        "start": kept[start],
+        "end": kept[end],
+        "stops": stops,
+        "turns": turns,
+        "route": [(lons[k], lats[k]) for k in keep],
+        "points": len(trip),
+        "distance": sum(haversine_m(*pos(k - 1), *pos(k)) for k in range(start + 1, end + 1)),
+        "dropped": len(fixes) - len(kept),
+    }
+
+
+def analyze(fixes, **options):
+    """the same results from TrackAnalyzer"""
+    analyzer = main.trip_analyzer(**options)
+    result = {"stops": [], "turns": [], "route": []}
+    for event in analyzer.run(fixes):
+        kind = event[0]
+        if kind in ("start", "end"):
+            result[kind] = event[1]
+        elif kind == "stop":
+            result["stops"].append(event[1:])
+        elif kind == "left":
+            result["turns"].append(event[1:])
+        else:
+            result["route"].extend(event[1])
+    result["points"] = analyzer.points
+    result["distance"] = analyzer.distance
+    result["dropped"] = analyzer.jumps + analyzer.duplicates
+    return result
+
+
+def check(fixes, **options):
+    got = analyze(fixes, **options)
+    want = reference(fixes, **{"tolerance": main.SIMPLIFY_TOLERANCE, **options})
+    assert got["start"] == want["start"]
+    assert got["end"] == want["end"]
+    assert got["stops"] == want["stops"]
+    assert got["turns"] == want["turns"]
+    assert got["route"] == want["route"]
+    assert got["points"] == want["points"]
+    assert got["dropped"] == want["dropped"]
+    assert got["distance"] == pytest.approx(want["distance"])
+    return got
+
+
+@pytest.mark.parametrize("log", SAMPLES, ids=lambda path: path.stem)
+def test_sample_logs(log):
+    fixes = list(main.read_track(log, cache_dir=None))
+    got = check(fixes)
+    assert got["turns"]
+
+
+def test_unsimplified_route_and_small_windows():
+    fixes = list(main.read_track(SAMPLES[0], cache_dir=None))
+    check(fixes, tolerance=0)
+    check(fixes, window=50)
+
+
+def test_synthetic_drive(tmp_path):
+    """10 Hz, with stops at intersections"""
+    path = tmp_path / "drive.txt"
+    generate_log(path, hours=0.2, hz=10, seed=5)
+    got = check(list(main.read_track(path, cache_dir=None)))
+    assert got["stops"] and got["turns"]
+
+
+def test_jumps_and_duplicates():
+    fixes = list(main.read_track(SAMPLES[1], cache_dir=None))
+    # a fix 2 km off, and a repeated time
+    jump = dict(fixes[500], latitude=fixes[500]["latitude"] + 0.02, time=fixes[500]["time"] + 0.1)
+    fixes[501:501] = [jump, dict(fixes[500])]
+    assert check(fixes)["dropped"] == 2
+
+
+def test_never_moved():
+    fixes = [{"time": float(t), "latitude": 43.0, "longitude": -77.0, "speed": 0.1, "course": 0.0}
+             for t in range(10)]
+    with pytest.raises(ValueError):
+        list(main.trip_analyzer().run(fixes))
+
+
+def test_parked_state_stays_small():
+    """a car parked for hours, with gps jitter, between two drives"""
+    drive = list(main.read_track(SAMPLES[0], cache_dir=None))[:400]
+    last = drive[-1]
+    parked = [dict(last, time=last["time"] + 1 + k, speed=0.1, latitude=last["latitude"] + (k % 7) * 1e-6)
+              for k in range(200_000)]
+    later = [dict(fix, time=fix["time"] - drive[0]["time"] + parked[-1]["time"] + 1) for fix in drive]
+
+    trip = main.trip_analyzer()
+    for k, fix in enumerate(drive + parked):
+        trip.add(fix)
+        if k % 50_000 == 0:
+            assert len(trip.route) <= trip.window + 2
+            assert len(trip.slow_half) <= analyzer.MAX_SLOW_POINTS
+    assert len(trip.route) <= trip.window + 2
+    assert len(trip.slow_half) <= analyzer.MAX_SLOW_POINTS
+
+    got = analyze(drive + parked + later)
+    want = reference(drive + parked + later, tolerance=main.SIMPLIFY_TOLERANCE)
+    assert got["route"] == want["route"] and got["turns"] == want["turns"]
+    # the stop marker is within a few fixes of the middle one
+    (lat, lon, seconds), = [stop for stop in got["stops"] if stop[2] > 1000]
+    (want_lat, want_lon, want_seconds), = [stop for stop in want["stops"] if stop[2] > 1000]
+    assert seconds == want_seconds and haversine_m(lat, lon, want_lat, want_lon) < 1
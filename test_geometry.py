@@ -0,0 +1,90 @@
+"""
+The whole-track helpers in geometry.py against the scalar ones, with numpy
+and without it (geometry.np = None), and simplify's two branches against
+each other.
+
+    python -m pytest -q
+"""
+
+from pathlib import Path
+
+import pytest
+
+import geometry
+from geometry import (bearing_deltas, degree_turn, haversine_m, jump_mask, signed_bearing_delta, simplify,
+                      step_vertices, stop_runs, track_geometry, turn_runs)
+import main
+
+SAMPLE = Path(__file__).parent / "Some_Example_GPS_Files" / "2025_05_01__145019_gps_file.txt"
+
+
+@pytest.fixture(scope="module")
+def track():
+    return main.read_track(SAMPLE, cache_dir=None)
+
+
+@pytest.fixture(params=["python", "numpy"])
+def branch(request, monkeypatch):
+    """runs the test once on the pure python code and once on the numpy code"""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(geometry, "np", None)
+    return request.param
+
+
+def test_track_geometry_same_as_scalar(track, branch):
+    lats, lons = track.latitude, track.longitude
+    dist, bearing = track_geometry(lats, lons)
+    assert len(dist) == len(bearing) == len(track) - 1
+    for i in range(0, len(track) - 1, 7):
+        assert dist[i] == pytest.approx(haversine_m(lats[i], lons[i], lats[i+1], lons[i+1]), abs=1e-6)
+        if dist[i] > 1:
+            assert bearing[i] == pytest.approx(degree_turn((lats[i], lons[i]), (lats[i+1], lons[i+1])), abs=1e-6)
+    deltas = bearing_deltas(bearing)
+    for i in range(0, len(deltas), 7):
+        assert deltas[i] == pytest.approx(signed_bearing_delta(bearing[i], bearing[i+1]), abs=1e-6)
+
+
+def test_jump_mask(track, branch):
+    lats, lons, times = list(track.latitude), list(track.longitude), list(track.time)
+    # a fix 2 km off and a repeated time
+    lats[500:500] = [lats[500] + 0.02, lats[500]]
+    lons[500:500] = [lons[500], lons[500]]
+    times[500:500] = [times[500] - 0.5, times[499]]
+    keep = jump_mask(lats, lons, times)
+    assert [i for i, k in enumerate(keep) if not k] == [500, 501]
+
+
+def test_step_vertices_same_as_a_plain_scan(track, branch):
+    lats, lons = track.latitude, track.longitude
+    for step in (3.0, 8.0, 25.0):
+        want = [10]
+        for i in range(12, len(track)):
+            if haversine_m(lats[want[-1]], lons[want[-1]], lats[i], lons[i]) >= step:
+                want.append(i)
+        assert step_vertices(lats, lons, step, first=10, begin=12) == want
+
+
+def test_turn_runs(branch):
+    deltas = [-20, -15, 5, -30, 12, 0, -11, -12, -13]
+    assert turn_runs(deltas, "left", 10) == [(0, 1), (3, 3), (6, 8)]
+    assert turn_runs(deltas, "right", 10) == [(4, 4)]
+    assert turn_runs([], "left", 10) == []
+
+
+def test_stop_runs(branch):
+    speeds = [0.5, 3, 0.2, 0.1, 0.3, 4, 0.0, 5, 0.1, 0.2]
+    times = [float(t) for t in range(len(speeds))]
+    # the last run never ended (the car didn't move again)
+    assert stop_runs(speeds, times, 1.0, 0.0) == [(0, 0), (2, 4), (6, 6)]
+    assert stop_runs(speeds, times, 1.0, 1.0) == [(2, 4)]
+
+
+@pytest.mark.parametrize("tolerance, window", [(2.0, 2000), (0.5, 300), (10.0, 50)])
+def test_simplify_numpy_same_as_python(track, monkeypatch, tolerance, window):
+    pytest.importorskip("numpy")
+    lats, lons = list(track.latitude), list(track.longitude)
+    with_numpy = simplify(lats, lons, tolerance, window)
+    monkeypatch.setattr(geometry, "np", None)
+    assert simplify(lats, lons, tolerance, window) == with_numpy
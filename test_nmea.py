@@ -0,0 +1,143 @@
+"""
+Checks for the NMEA parsing: checksums, burped line recovery, the RMC/GGA
+merge (FixMerger) and the parallel parse of big logs.
+
+    python -m pytest -q
+"""
+
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from bench import generate_log, nmea_lat, nmea_lon, sentence
+import main
+
+SAMPLES = Path(__file__).parent / "Some_Example_GPS_Files"
+RMC = "GPRMC,144917.000,A,4308.4726,N,07726.4375,W,0.11,284.42,010525,,,A"
+GGA = "GPGGA,144917.250,4308.4726,N,07726.4375,W,1,09,1.05,150.0,M,-34.4,M,,"
+
+
+def rmc(t, lat=43.1412, lon=-77.4406, status="A", speed=12.0):
+    """RMC sentence fields at t seconds past 14:49:00"""
+    lat_s, ns = nmea_lat(lat)
+    lon_s, ew = nmea_lon(lon)
+    line = sentence(f"GPRMC,1449{t:06.3f},{status},{lat_s},{ns},{lon_s},{ew},{speed:.2f},90.00,010525,,,A")
+    return line.strip().split(",")
+
+
+def gga(t, quality=1, satellites=9, hdop=1.05):
+    line = sentence(f"GPGGA,1449{t:06.3f},4308.4726,N,07726.4375,W,{quality},{satellites:02d},{hdop},150.0,M,-34.4,M,,")
+    return line.strip().split(",")
+
+
+#### CHECKSUMS ####
+
+def test_checksum_ok():
+    good = sentence(RMC).strip()
+    assert main.nmea_checksum_ok(good)
+    assert main.nmea_checksum_ok(good[:-2] + good[-2:].lower())
+
+
+@pytest.mark.parametrize("line", [
+    sentence(RMC).strip().replace("4308", "4309"),     # changed field
+    f"${RMC}*{main.nmea_checksum(RMC) ^ 1:02X}",        # wrong checksum
+    sentence(RMC).strip()[:-3],                       # no *hh
+    sentence(RMC).strip()[1:],                        # no $
+    sentence(RMC).strip()[:-2] + "zz",                # not hex
+    "",
+])
+def test_checksum_bad(line):
+    assert not main.nmea_checksum_ok(line)
+
+
+def test_split_sentences_keeps_the_whole_ones():
+    rmc_line, gga_line = sentence(RMC).strip(), sentence(GGA).strip()
+    # the RMC cut off by the GGA: only the GGA survives
+    assert list(main.split_sentences(rmc_line[:40] + gga_line)) == [gga_line]
+    # two whole sentences on one line
+    assert list(main.split_sentences(rmc_line + gga_line)) == [rmc_line, gga_line]
+    # noise in front and a cut off sentence at the end
+    assert list(main.split_sentences("\xfc\xfc" + gga_line + rmc_line[:30])) == [gga_line]
+
+
+def test_sentence_fields_counts():
+    rmc_line, gga_line = sentence(RMC).strip(), sentence(GGA).strip()
+    lines = [rmc_line, "", rmc_line[:40] + gga_line, rmc_line.replace("4308", "4309"),
+             rmc_line[:20] + rmc_line[:25]]
+    counts = Counter()
+    fields = list(main.sentence_fields(lines, counts))
+    assert fields == [rmc_line.split(","), gga_line.split(",")]
+    assert counts == Counter(lines=5, bad_checksum=2, burped=2, burped_recovered=1)
+
+
+#### RMC/GGA MERGE ####
+
+def merge(sentences, **options):
+    merger = main.FixMerger(**options)
+    fixes = [fix for arr in sentences for fix in merger.feed(arr)]
+    return fixes + list(merger.flush())
+
+
+def test_merger_gga_before_the_rmc():
+    fix, = merge([gga(16.75, satellites=7), rmc(17.0)])
+    assert fix["num_satellites"] == 7 and fix["fix_quality"] == 1
+
+
+def test_merger_picks_the_closer_gga():
+    fixes = merge([gga(16.6, satellites=5), rmc(17.0), gga(17.1, satellites=8), rmc(18.0)])
+    assert [fix["num_satellites"] for fix in fixes] == [8, None]
+
+
+def test_merger_gga_too_far_away():
+    fix, = merge([gga(10.0), rmc(17.0), gga(17.0 + main.GGA_WINDOW + 0.25)])
+    assert fix["hdop"] is None and fix["altitude"] is None
+
+
+def test_merger_quality_filter_and_counts():
+    counts = Counter()
+    fixes = merge([rmc(1.0), gga(1.0, hdop=9.5),             # hdop too high
+                   rmc(2.0), gga(2.0, satellites=3),         # too few satellites
+                   rmc(3.0, status="V"), gga(3.0, quality=0),
+                   rmc(4.0, lat=95.0),                       # impossible latitude
+                   rmc(5.0), gga(5.0)], counts=counts)
+    assert [fix["time"] % 60 for fix in fixes] == [5.0]
+    assert counts == Counter(low_quality=2, void=1, no_fix=1, out_of_range=1)
+
+
+def test_merger_rmc_only():
+    # logs written with USE_RMC_ONLY=true never get a GGA, the fixes still count
+    fixes = merge([rmc(1.0), rmc(2.0), rmc(3.0)])
+    assert len(fixes) == 3 and all(fix["hdop"] is None for fix in fixes)
+
+
+def test_merger_same_as_iter_fixes():
+    log = SAMPLES / "2025_05_06__134918_gps_file.txt"
+    fields = list(main.readFile(log))
+    assert merge(fields) == list(main.iter_fixes(fields))
+
+
+#### PARALLEL PARSE ####
+
+@pytest.fixture(scope="module")
+def synthetic_log(tmp_path_factory):
+    """a few minutes of 10 Hz drive with burped and garbled lines mixed in"""
+    path = tmp_path_factory.mktemp("logs") / "drive.txt"
+    generate_log(path, hours=0.1, hz=10, seed=3)
+    return path
+
+
+@pytest.mark.parametrize("chunk", [997, 4096, 50_000, 1 << 30])
+def test_parallel_parse_same_as_serial(synthetic_log, chunk):
+    serial_counts, parallel_counts = Counter(), Counter()
+    serial = main.parse_log(synthetic_log, serial_counts)
+    parallel = main.parse_log_parallel(synthetic_log, jobs=2, chunk=chunk, counts=parallel_counts)
+    assert len(serial) > 3000
+    for name in main.COLUMNS:
+        assert parallel.column(name).tobytes() == serial.column(name).tobytes(), name
+    assert +parallel_counts == +serial_counts
+
+
+def test_parallel_parse_sample_log():
+    log = SAMPLES / "2025_09_11__221355_gps_file.txt"
+    assert list(main.parse_log_parallel(log, jobs=2, chunk=20_000)) == list(main.parse_log(log))
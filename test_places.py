@@ -0,0 +1,138 @@
+"""
+PlaceCatalog lookups against brute force over every place, and the
+catalog files.
+
+    python -m pytest -q
+"""
+
+import math
+import random
+
+import pytest
+
+from geometry import haversine_m
+from places import PlaceCatalog, load_places
+
+
+def wrap(lon):
+    return lon - 360 if lon > 180 else lon + 360 if lon < -180 else lon
+
+
+def random_catalog(rng, n, lat_range=(-89.0, 89.0), lon_range=(-180.0, 180.0)):
+    catalog = PlaceCatalog()
+    for i in range(n):
+        lat, lon = rng.uniform(*lat_range), rng.uniform(*lon_range)
+        if i % 5 == 0:
+            # a small square fence instead of a circle
+            d = rng.uniform(0.001, 0.02)
+            west, east = wrap(lon - d), wrap(lon + d)
+            catalog.add_polygon(f"poly{i}", [[(lat - d, west), (lat - d, east), (lat + d, east),
+                                              (lat + d, west), (lat - d, west)]])
+        else:
+            catalog.add_point(f"place{i}", lat, wrap(lon), rng.choice((None, 50, 2000)))
+    return catalog
+
+
+def brute_nearest(catalog, lat, lon):
+    return min(haversine_m(lat, lon, p.lat, p.lon) for p in catalog.places)
+
+
+def brute_locate(catalog, lat, lon):
+    inside = [p for p in catalog.places if p.contains(lat, lon)]
+    return min(inside, key=lambda p: haversine_m(lat, lon, p.lat, p.lon), default=None)
+
+
+@pytest.mark.parametrize("seed, n", [(1, 1), (2, 7), (3, 200), (4, 3000)])
+def test_nearest_same_as_brute_force(seed, n):
+    rng = random.Random(seed)
+    catalog = random_catalog(rng, n)
+    for _ in range(300):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        place, meters = catalog.nearest(lat, lon)
+        assert meters == pytest.approx(brute_nearest(catalog, lat, lon), abs=1e-6)
+        assert meters == pytest.approx(haversine_m(lat, lon, place.lat, place.lon))
+
+
+def test_nearest_across_the_antimeridian_and_poles():
+    catalog = PlaceCatalog()
+    catalog.add_point("east", 10.0, 179.9)
+    catalog.add_point("west", 10.0, -170.0)
+    catalog.add_point("north", 89.9, 0.0)
+    assert catalog.nearest(10.0, -179.95)[0].name == "east"
+    assert catalog.nearest(89.95, 180.0)[0].name == "north"
+
+
+def test_locate_same_as_brute_force():
+    rng = random.Random(9)
+    # a dense area so the fences overlap and share grid cells
+    catalog = random_catalog(rng, 2000, lat_range=(43.0, 43.3), lon_range=(-77.8, -77.4))
+    hits = 0
+    for _ in range(2000):
+        lat, lon = rng.uniform(43.0, 43.3), rng.uniform(-77.8, -77.4)
+        place = catalog.locate(lat, lon)
+        assert place is brute_locate(catalog, lat, lon)
+        hits += place is not None
+    assert hits > 100
+
+
+def test_locate_across_the_antimeridian():
+    catalog = PlaceCatalog()
+    catalog.add_point("x", 10.0, 179.999, 500)
+    catalog.add_polygon("dateline", [[(-17.0, 179.99), (-17.0, -179.99), (-16.99, -179.99), (-16.99, 179.99)]])
+    assert catalog.locate(10.0, -179.999).name == "x"
+    assert catalog.locate(10.0, 179.9985).name == "x"
+    assert catalog.locate(10.0, -179.99) is None
+    dateline = catalog.locate(-16.995, -179.995)
+    assert dateline.name == "dateline" and abs(dateline.lon) == pytest.approx(180.0)
+    assert catalog.locate(-16.995, 179.995) is dateline
+    assert catalog.locate(-16.995, 179.98) is None
+    assert catalog.locate(-16.995, 0.0) is None
+
+    # and the grid agrees with testing every fence, around +-180
+    rng = random.Random(11)
+    catalog = random_catalog(rng, 500, lat_range=(-0.2, 0.2), lon_range=(179.8, 180.2))
+    hits = 0
+    for _ in range(2000):
+        lat, lon = rng.uniform(-0.2, 0.2), wrap(rng.uniform(179.8, 180.2))
+        place = catalog.locate(lat, lon)
+        assert place is brute_locate(catalog, lat, lon)
+        hits += place is not None
+    assert hits > 100
+
+
+def test_empty_catalog():
+    catalog = PlaceCatalog()
+    assert catalog.nearest(43.0, -77.0) == (None, math.inf)
+    assert catalog.locate(43.0, -77.0) is None
+
+
+def test_load_csv_and_geojson(tmp_path):
+    csv_path = tmp_path / "places.csv"
+    csv_path.write_text("name,lat,lon,radius\nRIT,43.085556,-77.680556,\nHouse,43.139444,-77.439444,100\n")
+    places = load_places(csv_path)
+    assert [p.name for p in places.places] == ["RIT", "House"]
+    assert places.places[1].radius == 100
+
+    geojson = tmp_path / "places.geojson"
+    geojson.write_text('{"type": "FeatureCollection", "features": ['
+                       '{"properties": {"name": "Depot"}, "geometry": {"type": "Polygon", "coordinates":'
+                       ' [[[-77.0, 43.0], [-77.0, 43.01], [-76.99, 43.01], [-76.99, 43.0], [-77.0, 43.0]]]}},'
+                       '{"properties": {"name": "Pin"}, "geometry": {"type": "Point", "coordinates": [-77.5, 43.2]}}]}')
+    places = load_places(geojson)
+    assert places.locate(43.005, -76.995).name == "Depot"
+    assert places.nearest(43.2, -77.5)[0].name == "Pin"
+
+
+@pytest.mark.parametrize("name, text", [
+    ("bad.csv", "name,lat,lon\nA,43.1,abc\n"),
+    ("empty.csv", "name,lat,lon\n"),
+    ("bad.json", "{bad"),
+    ("list.geojson", "[1, 2]"),
+    ("short.geojson", '{"type": "Feature", "geometry": {"type": "Point", "coordinates": [1]}}'),
+    ("line.geojson", '{"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[1, 2], [3, 4]]}}'),
+])
+def test_bad_files_raise_value_error(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    with pytest.raises(ValueError, match=name):
+        load_places(path)
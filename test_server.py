@@ -0,0 +1,60 @@
+"""
+IngestServer shutdown with vehicles still connected.
+
+    python -m pytest -q
+"""
+
+import asyncio
+import itertools
+import json
+from pathlib import Path
+import socket
+
+import main
+from server import IngestServer
+
+LOG = Path(__file__).parent / "Some_Example_GPS_Files" / "2025_05_01__145019_gps_file.txt"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_cancel_flushes_every_open_vehicle_once(tmp_path):
+    with main.open_log(LOG) as f:
+        text = "".join(itertools.islice(f, main.HEADER_LINES, main.HEADER_LINES + 2000))
+    errors = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        port = free_port()
+        server = IngestServer(tmp_path, report=3600)
+        serving = asyncio.create_task(server.serve("127.0.0.1", port, udp=False))
+        await asyncio.sleep(0.2)
+        connections = []
+        for name in ("a", "b"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"ID {name}\n{text}".encode("latin1"))
+            await writer.drain()
+            connections.append(writer)
+        while sum(v.lines for v in server.vehicles.values()) < 4000:
+            await asyncio.sleep(0.05)
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        for writer in connections:
+            writer.close()
+        await asyncio.sleep(0.1)
+        return server
+
+    server = asyncio.run(run())
+    rows = [json.loads(line) for line in (tmp_path / "summaries.jsonl").read_text().splitlines()]
+    assert sorted(row["vehicle"] for row in rows if row["final"]) == ["a", "b"]
+    assert all(row["fixes"] > 900 for row in rows)
+    assert (tmp_path / "a.kml").exists() and (tmp_path / "b.kml").exists()
+    assert not server.vehicles and not server.handlers
+    assert not errors
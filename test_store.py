@@ -0,0 +1,36 @@
+"""
+TripStore: a log is ingested once, compressed or not.
+
+    python -m pytest -q
+"""
+
+import bz2
+import gzip
+import lzma
+from pathlib import Path
+
+import pytest
+
+import main
+from store import TripStore, file_hash
+
+LOG = Path(__file__).parent / "Some_Example_GPS_Files" / "2025_05_01__145019_gps_file.txt"
+
+
+@pytest.mark.parametrize("suffix, compress", [(".gz", gzip.compress), (".bz2", bz2.compress),
+                                              (".xz", lzma.compress)])
+def test_compressed_log_has_the_same_hash(tmp_path, suffix, compress):
+    packed = tmp_path / (LOG.name + suffix)
+    packed.write_bytes(compress(LOG.read_bytes()))
+    assert file_hash(packed) == file_hash(LOG)
+
+
+def test_log_and_its_gz_are_ingested_once(tmp_path):
+    packed = tmp_path / (LOG.name + ".gz")
+    packed.write_bytes(gzip.compress(LOG.read_bytes()))
+    with TripStore(tmp_path / "stats.sqlite") as store:
+        for log in (LOG, packed):
+            summary = main.convert(log, tmp_path / "trip.kml", cache_dir=None, verbose=False)
+            added = store.ingest(log, summary)
+            assert added == (1 if log == LOG else 0)
+        assert store.db.execute("SELECT COUNT(*) FROM trips").fetchone() == (1,)
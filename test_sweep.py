@@ -0,0 +1,87 @@
+"""
+The sweep's shared per-track work (SweepTrack) against a full TrackAnalyzer
+run per config, and logs the sweep can't use.
+
+    python -m pytest -q
+"""
+
+import io
+from pathlib import Path
+
+import pytest
+
+from analyzer import TrackAnalyzer
+from bench import generate_log
+import main
+from spatial import GridIndex
+import sweep
+
+SAMPLES = sorted((Path(__file__).parent / "Some_Example_GPS_Files").glob("*.txt"))
+
+GRID = {"threshold_deg": [5.0, 10.0, 30.0], "turn_step": [3.0, 8.0], "moving": [0.5, 2.0, 6.0],
+        "stop_speed": [0.5, 1.0], "min_stop": [1.0, 5.0]}
+
+
+def analyzer_counts(track, config):
+    """the same counts from one TrackAnalyzer pass"""
+    analyzer = TrackAnalyzer(max_speed=config["max_speed"], stop_speed=config["stop_speed"],
+                             min_stop=config["min_stop"], moving=config["moving"],
+                             threshold_deg=config["threshold_deg"], turn_step=config["turn_step"], tolerance=0)
+    turns = GridIndex(main.TURN_SPACING)
+    stops = GridIndex(main.STOP_RADIUS)
+    stop_seconds = 0.0
+    for event in analyzer.run(track):
+        if event[0] == "left":
+            turns.add(event[1], event[2])
+        elif event[0] == "stop":
+            stops.add(event[1], event[2], event[3])
+            stop_seconds += event[3]
+    _, _, duration, estimated = main.trip_times(analyzer.start_fix, analyzer.end_fix, config["moving"])
+    return {"left_turns": len(turns), "stops": len(stops), "stop_seconds": stop_seconds,
+            "duration": duration, "estimated": estimated}
+
+
+def check(track, grid, max_speed=97.0):
+    prepared = sweep.SweepTrack(track, max_speed)
+    for config in sweep.configs({**grid, "max_speed": [max_speed]}):
+        try:
+            want = analyzer_counts(track, config)
+        except ValueError as e:
+            with pytest.raises(ValueError, match=str(e)):
+                prepared.evaluate(config)
+            continue
+        got = prepared.evaluate(config)
+        assert got["stop_seconds"] == pytest.approx(want.pop("stop_seconds")), config
+        got.pop("stop_seconds")
+        assert got == want, config
+
+
+@pytest.mark.parametrize("log", SAMPLES[::3], ids=lambda path: path.stem)
+def test_same_as_track_analyzer(log):
+    check(main.read_track(log, cache_dir=None), GRID)
+
+
+def test_same_as_track_analyzer_with_jumps(tmp_path):
+    path = tmp_path / "drive.txt"
+    generate_log(path, hours=0.1, hz=10, seed=8)
+    track = main.read_track(path, cache_dir=None)
+    check(track, {"threshold_deg": [10.0], "turn_step": [8.0, 20.0], "moving": [2.0]}, max_speed=20.0)
+
+
+def test_bad_logs_are_reported(tmp_path):
+    empty = tmp_path / "empty.txt"
+    empty.write_text("header\n" * main.HEADER_LINES + "$GPRMC,garbage*00\n")
+    parked = tmp_path / "parked.txt"
+    with main.open_log(SAMPLES[0]) as f:
+        lines = f.readlines()
+    # only the start of the log, before the car first moves
+    parked.write_text("".join(lines[:main.HEADER_LINES + 20]))
+    rows = sweep.sweep([SAMPLES[0], empty, parked], {}, cache_dir=None)
+    row, = rows
+    assert row["logs"]["empty.txt"] == {"error": "no valid GPRMC fixes found"}
+    assert row["logs"]["parked.txt"] == {"error": "the car never moved"}
+    assert row["failed"] == 2 and row["left_turns"] > 0
+
+    out = io.StringIO()
+    sweep.print_table(rows, per_log=True, out=out)
+    assert "empty.txt: no valid GPRMC fixes found" in out.getvalue()
@@ -0,0 +1,94 @@
+"""
+Column-wise storage for a gps track.
+
+Instead of one dict per fix, every field is its own array('d') (8 bytes a
+value), so a fix costs ~72 bytes instead of a ~600 byte dict. Slicing a
+Track gives a view on the same arrays, nothing is copied.
+"""
+
+from array import array
+import math
+
+# fields kept per fix, in order
+COLUMNS = ("time", "latitude", "longitude", "speed", "course",
+           "altitude", "hdop", "num_satellites", "fix_quality")
+# GGA fields, missing when no GGA was merged into the fix (stored as nan)
+OPTIONAL = ("altitude", "hdop", "num_satellites", "fix_quality")
+
+NAN = float("nan")
+
+
+class Track:
+    """
+    A gps track stored as typed columns.
+
+    track.latitude, track.speed, ... give the column as a memoryview of
+    doubles (works with zip/len/indexing, and with numpy without a copy).
+    track[i] gives fix i as a dict with the numbers of the merged fix
+    (read_gprmc's plus the GGA fields from attach_gga, None where there was
+    no GGA), and track[a:b] gives a view of part of the track. The text
+    fields status and mode aren't kept: every fix in a track is valid (A).
+    """
+    __slots__ = ("columns", "start", "stop")
+
+    def __init__(self, columns=None, start=0, stop=None):
+        if columns is None:
+            columns = {name: array('d') for name in COLUMNS}
+        self.columns = columns
+        self.start = start
+        # stop=None means "up to the end", so a full track sees appends
+        self.stop = stop
+
+    @classmethod
+    def from_fixes(cls, fixes):
+        """builds a track from fix dicts (e.g. iter_fixes) without keeping the dicts"""
+        track = cls()
+        for fix in fixes:
+            track.append(fix)
+        return track
+
+    def append(self, fix):
+        """adds a fix dict to the end of the track (only on a full track, not a view)"""
+        for name in COLUMNS:
+            value = fix.get(name)
+            self.columns[name].append(NAN if value is None else value)
+
+    def _bounds(self):
+        stop = len(self.columns["time"]) if self.stop is None else self.stop
+        return self.start, stop
+
+    def __len__(self):
+        start, stop = self._bounds()
+        return stop - start
+
+    def column(self, name):
+        """one column of this track (or view) as a memoryview, no copy"""
+        start, stop = self._bounds()
+        return memoryview(self.columns[name])[start:stop]
+
+    def __getattr__(self, name):
+        if name in COLUMNS:
+            return self.column(name)
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        start, stop = self._bounds()
+        if isinstance(key, slice):
+            first, last, step = key.indices(stop - start)
+            if step != 1:
+                raise ValueError("Track views don't support a step")
+            return Track(self.columns, start + first, start + max(first, last))
+
+        if key < 0:
+            key += stop - start
+        if not 0 <= key < stop - start:
+            raise IndexError("track index out of range")
+        fix = {name: self.columns[name][start + key] for name in COLUMNS}
+        for name in OPTIONAL:
+            if math.isnan(fix[name]):
+                fix[name] = None
+        return fix
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
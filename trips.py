@@ -0,0 +1,73 @@
+"""
+Splitting one log into trips.
+
+makeKMLFile treats a log as one trip from the first to the last time the
+car moved, so a log like 2025_05_06__174741 (RIT -> Wegmans -> RIT) comes
+out as one trip with the time parked at Wegmans counted as driving.
+TripSegmenter cuts the stream of fixes wherever the car
+
+    stood still for DWELL seconds (time since it last moved, so a logger
+    that stops writing while parked counts too), or
+    has no fixes for MAX_GAP seconds (logger off, whatever the car did)
+
+It only keeps the time of the last fix and of the last moving fix, so it
+runs alongside the one pass analysis in constant memory: each trip gets
+its own TrackAnalyzer (see makeKMLFile's split option), which trims the
+standing still off both ends of it like for a whole log.
+
+A stretch that moves less than MIN_TRIP meters between two dwells (moving
+the car in a parking lot) isn't a trip and is dropped.
+"""
+
+# standing still longer than this ends a trip. longer than any light, queue
+# or drive-through in the sample logs (the longest mid trip wait is ~6 min)
+# and shorter than a stop at the store (~7.5 min at Wegmans)
+DWELL = 400.0
+# no fixes for this long ends a trip even if the car was moving on both sides
+MAX_GAP = 600.0
+# a trip has to cover at least this many meters
+MIN_TRIP = 250.0
+
+
+class TripSegmenter:
+    """
+    Usage:
+        segmenter = TripSegmenter()
+        for number, trip_fixes in itertools.groupby(fixes, segmenter.trip_of):
+            ...                         # one trip's fixes, still streaming
+    """
+
+    def __init__(self, dwell=DWELL, max_gap=MAX_GAP, moving=2):
+        self.dwell = dwell
+        self.max_gap = max_gap
+        self.moving = moving
+        self.trip = 0
+        self.last_time = None
+        self.last_moving = None     # time of the last moving fix of this trip
+        self.causes = []            # why trip i ended and i + 1 began: "dwell" or "gap"
+
+    def trip_of(self, fix):
+        """number of the trip the fix belongs to (fixes come in time order)"""
+        t = fix["time"]
+        if self.last_time is not None:
+            if t - self.last_time >= self.max_gap:
+                self._cut("gap")
+            elif self.last_moving is not None and t - self.last_moving >= self.dwell:
+                self._cut("dwell")
+        self.last_time = t
+        if fix["speed"] > self.moving:
+            self.last_moving = t
+        return self.trip
+
+    def _cut(self, cause):
+        self.trip += 1
+        self.last_moving = None
+        self.causes.append(cause)
+
+    def parked_before(self, trip):
+        """True if the car is known to have been parked right before the trip"""
+        return trip > 0 and self.causes[trip - 1] == "dwell"
+
+    def parked_after(self, trip):
+        """True if the car is known to have been parked right after the trip"""
+        return trip < len(self.causes) and self.causes[trip] == "dwell"